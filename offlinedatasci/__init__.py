@@ -1,4 +1,5 @@
 from . import main
+from .events import *
 from .main import *
 
 __version__ = '0.7.0'
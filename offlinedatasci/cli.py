@@ -1,32 +1,73 @@
 import argparse
-from secrets import choice
 import sys
 from offlinedatasci import *
 
-def get_installer_function(selection, ods_dir):
-    if selection == "all":
-        download_all(ods_dir)
-    elif selection == "rstudio":
-        try_except_functions(ods_dir, download_rstudio)
-    elif selection == "python":
-        try_except_functions(ods_dir, download_python)
-    elif selection == "r-packages":
-        try_except_functions(ods_dir, download_r_packages)
-    elif selection == "python-packages":
-        try_except_functions(ods_dir, download_python_packages)
-    elif selection == "lessons":
-        try_except_functions(ods_dir, download_lessons)
+def get_installer_function(selection, ods_dir, max_workers = DEFAULT_MAX_WORKERS):
+    return download_targets(ods_dir, [selection], max_workers)
 
 def main():
     parser = argparse.ArgumentParser(prog = 'offlinedatasci')
+    parser.add_argument('--sources',
+                        metavar = 'FILE',
+                        help = f'file declaring more installers, package sets and lessons '
+                               f'(defaults to {SOURCES_FILENAME} in path, if it exists)')
     subparsers = parser.add_subparsers(help = 'sub-command help', dest='command')
-    INSTALL_OPTIONS = ["all", "lessons", "r-packages", "python", "python-packages", "r", "rstudio"]
 
     install_parser = subparsers.add_parser('install')
     install_parser.add_argument('item',
                                 default = 'all',
                                 nargs = '+',
-                                choices=INSTALL_OPTIONS)
+                                help = 'all, lessons, r-packages, python, python-packages, r, rstudio '
+                                       'or an installer declared in the sources file')
+    install_parser.add_argument('-j', '--jobs',
+                                type = int,
+                                default = DEFAULT_MAX_WORKERS,
+                                help = 'maximum number of downloads to run at the same time')
+    install_parser.add_argument('--plan',
+                                action = 'store_true',
+                                help = 'only show which items are out of date and would be downloaded')
+    install_parser.add_argument('--force',
+                                action = 'store_true',
+                                help = 'download items even if they are up to date')
+    install_parser.add_argument('--profile',
+                                metavar = 'DIR',
+                                help = 'save a cProfile profile of each stage in DIR')
+
+    verify_parser = subparsers.add_parser('verify')
+    verify_parser.add_argument('-j', '--jobs',
+                               type = int,
+                               default = None,
+                               help = 'number of threads used for hashing (defaults to the number of CPUs)')
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--host',
+                              default = '0.0.0.0',
+                              help = 'address to listen on (defaults to all interfaces)')
+    serve_parser.add_argument('-p', '--port',
+                              type = int,
+                              default = DEFAULT_SERVE_PORT,
+                              help = 'port to listen on')
+    serve_parser.add_argument('-q', '--quiet',
+                              action = 'store_true',
+                              help = 'do not log each request')
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('output',
+                               help = 'archive to write, e.g., kiosk.tar.zst (.tar.gz, .tar.xz and .tar also work)')
+    export_parser.add_argument('--since',
+                               metavar = 'MANIFEST',
+                               help = 'only export files added or changed since MANIFEST, '
+                                      'the manifest.json of a previous export')
+    export_parser.add_argument('--compression',
+                               choices = list(EXPORT_SUFFIXES),
+                               help = 'compression to use (defaults to the extension of output)')
+    export_parser.add_argument('--level',
+                               type = int,
+                               help = 'compression level')
+    export_parser.add_argument('-j', '--jobs',
+                               type = int,
+                               default = None,
+                               help = 'number of threads used for compression (defaults to the number of CPUs)')
 
     packages_parser = subparsers.add_parser('add')
     packages_parser.add_argument('package_type',
@@ -43,10 +84,21 @@ def main():
 
     args = parser.parse_args()
     ods_dir = get_ods_dir(args.path)
+    sources_path = args.sources or Path(ods_dir, SOURCES_FILENAME)
+    if args.sources or sources_path.exists():
+        load_sources(sources_path)
 
     if args.command == 'install':
-        for i in args.item:
-            get_installer_function(i, ods_dir)
+        try:
+            select_download_targets(args.item)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.plan:
+            print_download_plan(plan_download_targets(ods_dir, args.item, args.jobs, args.force))
+        else:
+            if args.profile:
+                add_profiling_hook(cprofile_hook(args.profile))
+            download_targets(ods_dir, args.item, args.jobs, args.force)
 
     elif args.command == 'add':
         packages_to_install = package_selection(args.package_type[0], args.packages)
@@ -54,6 +106,27 @@ def main():
             download_python_packages(ods_dir, packages_to_install)
         elif args.package_type[0] == "r-packages":
             download_r_packages(ods_dir, packages_to_install)
+
+    elif args.command == 'verify':
+        problems = verify_manifest(ods_dir, args.jobs)
+        descriptions = {"missing": "Missing files",
+                        "modified": "Files changed since they were downloaded",
+                        "untracked": "Files not in the manifest",
+                        "upstream": "Files not matching upstream checksums"}
+        for problem, description in descriptions.items():
+            if problems[problem]:
+                print(f"{description}:")
+                for relative_path in problems[problem]:
+                    print(f"  {relative_path}")
+        if any(problems[problem] for problem in ["missing", "modified", "upstream"]):
+            sys.exit(1)
+        print("All files match the manifest")
+
+    elif args.command == 'export':
+        export_ods_dir(ods_dir, args.output, args.since, args.compression, args.level, args.jobs)
+
+    elif args.command == 'serve':
+        serve_ods_dir(ods_dir, args.host, args.port, args.quiet)
         
             
 if __name__=='__main__':
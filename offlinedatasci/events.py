@@ -0,0 +1,394 @@
+"""Events reported while downloading, and the listeners they are sent to.
+
+Also holds the stages, transfers, progress display and event log built on
+them. fetch reports retries and open circuits here, which lets it avoid
+importing main.
+"""
+from pathlib import Path
+import contextlib
+import cProfile
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import warnings
+
+PROGRESS_INTERVAL = 0.5
+_event_lock = threading.RLock()
+_event_listeners = []
+_event_display = None
+_profiling_hooks = []
+
+def report_event(event, **fields):
+    """Report an event to the event listeners and the progress display.
+
+    Events are dictionaries with the "event" name, the "time" and the
+    "thread" that reported them, plus the fields passed. Downloads report
+    stage_start/stage_end with the "stage" name and its "seconds",
+    file_start/file_progress/file_end with the "url", "path", "size",
+    "bytes" transferred, "retries" and "throughput", file_skipped, and
+    lesson_start/lesson_end. Errors in listeners are turned into warnings so
+    they never stop a download.
+
+    Keyword arguments:
+    event -- Name of the event
+    fields -- Details of the event, which must be JSON serializable
+    """
+    record = {"event": event, "time": time.time(), "thread": threading.current_thread().name, **fields}
+    with _event_lock:
+        for listener in [*_event_listeners, _event_display or print_event]:
+            try:
+                listener(record)
+            except Exception as e:
+                warnings.warn(f"Error reporting {event} event: {e}")
+
+def add_event_listener(listener):
+    """Call listener with every event reported from now on.
+
+    Keyword arguments:
+    listener -- Function taking the event dictionary
+    """
+    with _event_lock:
+        _event_listeners.append(listener)
+
+def remove_event_listener(listener):
+    """Stop calling a listener added with add_event_listener.
+
+    Keyword arguments:
+    listener -- Function passed to add_event_listener
+    """
+    with _event_lock:
+        _event_listeners.remove(listener)
+
+def set_event_display(display):
+    """Show events on display instead of printing them with print_event.
+
+    Returns the previous display, which should be restored afterwards.
+
+    Keyword arguments:
+    display -- Function taking each event dictionary, or None
+    """
+    global _event_display
+    with _event_lock:
+        previous_display, _event_display = _event_display, display
+    return previous_display
+
+def print_event(record):
+    """Print short messages for events when no progress display is active.
+
+    Keyword arguments:
+    record -- Event dictionary passed by report_event
+    """
+    if record["event"] == "file_start":
+        print(f"Downloading {record['path']}")
+    elif record["event"] == "file_skipped":
+        print(f"Already downloaded {record['path']}")
+    elif record["event"] == "file_end" and record["error"]:
+        print(f"Failed to download {record['path']}: {record['error']}")
+    elif record["event"] == "lesson_start":
+        print(f"Downloading lesson from {record['url']}")
+    elif record["event"] == "circuit_open":
+        print(f"Not connecting to {record['host']} for {record['cooldown']}s "
+              f"after {record['failures']} failed attempts")
+
+@contextlib.contextmanager
+def event_log(path):
+    """Write every event reported inside the context to a JSON lines file.
+
+    Each run starts a new log, and the log of the previous run is kept
+    next to it with ".1" added before the extension, e.g., events.1.jsonl,
+    so the logs do not grow across runs.
+
+    Keyword arguments:
+    path -- Path of the log file
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        os.replace(path, path.with_name(f"{path.stem}.1{path.suffix}"))
+    with open(path, "w") as log_file:
+        def write_event(record):
+            log_file.write(json.dumps(record, default=str) + "\n")
+            log_file.flush()
+        add_event_listener(write_event)
+        try:
+            yield path
+        finally:
+            remove_event_listener(write_event)
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a stage of a download, reporting stage_start and stage_end events.
+
+    The context managers returned by the profiling hooks are entered
+    around the stage.
+
+    Keyword arguments:
+    name -- Name of the stage
+    """
+    report_event("stage_start", stage=name)
+    start_time = time.perf_counter()
+    error = None
+    try:
+        with contextlib.ExitStack() as hooks:
+            for hook in list(_profiling_hooks):
+                hooks.enter_context(hook(name))
+            yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        report_event("stage_end", stage=name, seconds=time.perf_counter() - start_time,
+                     error=str(error) if error else None)
+
+def add_profiling_hook(hook):
+    """Run every stage started from now on inside the context manager returned by hook.
+
+    Keyword arguments:
+    hook -- Function taking the stage name and returning a context manager,
+            which is entered in the thread running the stage
+    """
+    with _event_lock:
+        _profiling_hooks.append(hook)
+
+def remove_profiling_hook(hook):
+    """Stop using a hook added with add_profiling_hook.
+
+    Keyword arguments:
+    hook -- Function passed to add_profiling_hook
+    """
+    with _event_lock:
+        _profiling_hooks.remove(hook)
+
+def cprofile_hook(output_dir):
+    """Return a profiling hook saving a cProfile profile of each stage in output_dir.
+
+    Only the outermost stage of each thread is profiled since cProfile
+    cannot nest, and stages are not profiled if another profiler is
+    already active. Profiles are saved as <stage>.prof and can be read with
+    pstats or snakeviz.
+
+    Keyword arguments:
+    output_dir -- Directory to save the profiles in
+    """
+    profiling = threading.local()
+
+    @contextlib.contextmanager
+    def profile_stage(name):
+        if getattr(profiling, "active", False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            yield
+            return
+        profiling.active = True
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiling.active = False
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            file_name = re.sub(r"[^A-Za-z0-9.-]+", "_", name).strip("_") + ".prof"
+            profiler.dump_stats(Path(output_dir, file_name))
+
+    return profile_stage
+
+@contextlib.contextmanager
+def track_transfer(url, path, size):
+    """Report file_start and file_end events around a file transfer.
+
+    Yields the transfer, a dictionary to pass to report_transfer_progress.
+    Its "retries" can be increased by the code retrying the transfer.
+
+    Keyword arguments:
+    url -- Link the file is downloaded from
+    path -- Path the file is saved to
+    size -- Size of the file in bytes, or None if it is not known
+    """
+    start_time = time.perf_counter()
+    transfer = {"url": url, "path": str(path), "size": size, "bytes": 0, "resumed_bytes": 0,
+                "retries": 0, "reported_time": start_time, "lock": threading.Lock()}
+    report_event("file_start", url=url, path=str(path), size=size)
+    error = None
+    try:
+        yield transfer
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - start_time
+        report_event("file_end", url=url, path=str(path), size=size, bytes=transfer["bytes"],
+                     resumed_bytes=transfer["resumed_bytes"], retries=transfer["retries"],
+                     seconds=seconds, throughput=transfer["bytes"] / seconds if seconds > 0 else None,
+                     error=str(error) if error else None)
+
+def report_transfer_progress(transfer, transferred_bytes, resumed_bytes=0):
+    """Add to the bytes of a transfer, reporting file_progress events every PROGRESS_INTERVAL seconds.
+
+    Keyword arguments:
+    transfer -- Transfer yielded by track_transfer
+    transferred_bytes -- Number of bytes just transferred
+    resumed_bytes -- Number of bytes kept from an earlier attempt
+    """
+    with transfer["lock"]:
+        transfer["bytes"] += transferred_bytes
+        transfer["resumed_bytes"] += resumed_bytes
+        now = time.perf_counter()
+        if now - transfer["reported_time"] < PROGRESS_INTERVAL:
+            return
+        transfer["reported_time"] = now
+        fields = {key: transfer[key] for key in ["url", "path", "size", "bytes", "resumed_bytes"]}
+    report_event("file_progress", **fields)
+
+@contextlib.contextmanager
+def progress_display(stream=None):
+    """Show a ProgressDisplay instead of print_event inside the context.
+
+    Keyword arguments:
+    stream -- Stream to write to (defaults to sys.stdout)
+    """
+    display = ProgressDisplay(stream or sys.stdout)
+    previous_display = set_event_display(display)
+    display.start()
+    try:
+        if display.interactive:
+            # Other output clears the status line before it is written
+            with contextlib.redirect_stdout(display):
+                yield display
+        else:
+            yield display
+    finally:
+        display.stop()
+        set_event_display(previous_display)
+
+class ProgressDisplay:
+    """Live display of the events reported while downloading.
+
+    Finished files, lessons and stages are printed as they end. On a
+    terminal, a status line with the number of files and bytes downloaded,
+    the throughput and the progress of the active transfers is redrawn
+    below them every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.interactive = hasattr(stream, "isatty") and stream.isatty()
+        self.transfers = {}
+        self.lessons = set()
+        self.files_done = 0
+        self.bytes_done = 0
+        self.start_time = time.perf_counter()
+        self.status_width = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __call__(self, record):
+        event = record["event"]
+        if event == "file_start":
+            self.transfers[record["path"]] = (0, record["size"])
+        elif event == "file_progress":
+            self.transfers[record["path"]] = (record["bytes"] + record["resumed_bytes"], record["size"])
+        elif event == "file_end":
+            self.transfers.pop(record["path"], None)
+            if record["error"]:
+                self.print_line(f"Failed to download {record['path']}: {record['error']}")
+            else:
+                self.files_done += 1
+                self.bytes_done += record["bytes"]
+                throughput = format_bytes(record["throughput"]) + "/s" if record["throughput"] else ""
+                self.print_line(f"Downloaded {os.path.basename(record['path'])} "
+                                f"({format_bytes(record['bytes'])} in {record['seconds']:.1f}s {throughput})")
+        elif event == "lesson_start":
+            self.lessons.add(record["url"])
+        elif event == "lesson_end":
+            self.lessons.discard(record["url"])
+            self.print_line(f"Downloaded lesson {record['url']} ({record['error']}, {record['seconds']:.1f}s)")
+        elif event == "stage_end":
+            status = f"failed: {record['error']}" if record["error"] else "done"
+            self.print_line(f"{record['stage']}: {status} ({record['seconds']:.1f}s)")
+        elif event == "retry":
+            self.print_line(f"Retrying {record['url']} in {record['delay']:.1f}s ({record['reason']})")
+        elif event == "circuit_open":
+            self.print_line(f"Not connecting to {record['host']} for {record['cooldown']}s "
+                            f"after {record['failures']} failed attempts")
+
+    def print_line(self, text):
+        self.clear_status()
+        self.stream.write(text + "\n")
+        self.draw_status()
+
+    def get_status(self):
+        seconds = time.perf_counter() - self.start_time
+        in_flight = sum(transferred for transferred, size in self.transfers.values())
+        throughput = (self.bytes_done + in_flight) / seconds if seconds > 0 else 0
+        status = (f"{self.files_done} files, {format_bytes(self.bytes_done + in_flight)} "
+                  f"at {format_bytes(throughput)}/s")
+        active = [f"{os.path.basename(path)} {transferred * 100 // size}%" if size
+                  else f"{os.path.basename(path)} {format_bytes(transferred)}"
+                  for path, (transferred, size) in self.transfers.items()]
+        active += [f"lesson {url.rstrip('/').rsplit('/', 1)[-1]}" for url in sorted(self.lessons)]
+        if active:
+            status += " | " + ", ".join(active)
+        width = shutil.get_terminal_size().columns - 1
+        return status if len(status) <= width else status[:max(0, width - 3)] + "..."
+
+    def draw_status(self):
+        if not self.interactive:
+            return
+        status = self.get_status()
+        self.stream.write("\r" + status.ljust(self.status_width))
+        self.stream.flush()
+        self.status_width = len(status)
+
+    def clear_status(self):
+        if self.interactive and self.status_width:
+            self.stream.write("\r" + " " * self.status_width + "\r")
+            self.status_width = 0
+
+    def write(self, text):
+        with _event_lock:
+            self.clear_status()
+            return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def start(self):
+        if not self.interactive:
+            return
+
+        def redraw():
+            while not self.stop_event.wait(PROGRESS_INTERVAL):
+                with _event_lock:
+                    self.draw_status()
+
+        self.thread = threading.Thread(target=redraw, name="progress-display", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with _event_lock:
+            self.clear_status()
+            self.stream.flush()
+
+def format_bytes(size):
+    """Return a number of bytes in human readable units, e.g., "12.3 MB".
+
+    Keyword arguments:
+    size -- Number of bytes
+    """
+    for unit in ["B", "kB", "MB", "GB"]:
+        if abs(size) < 1000 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
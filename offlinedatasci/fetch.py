@@ -0,0 +1,188 @@
+"""The requests session used for every download and the fetch policy it follows.
+
+Kept apart from main so that requests is only imported by the commands
+that download something.
+"""
+import itertools
+import random
+import threading
+import time
+import urllib.parse
+import requests
+import urllib3
+from .events import report_event
+
+CIRCUIT_BREAKER_COOLDOWN = 60
+CIRCUIT_BREAKER_THRESHOLD = 8
+DEFAULT_HOST_RATE = (10, 20)
+FETCH_BACKOFF_BASE = 1
+FETCH_BACKOFF_MAX = 30
+FETCH_CONNECT_TIMEOUT = 10
+FETCH_READ_TIMEOUT = 60
+FETCH_RETRIES = 4
+HOST_RATES = {}
+HTTP_POOL_SIZE = 16
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_session = None
+_host_buckets = {}
+_host_circuits = {}
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host that keeps failing."""
+
+class FetchSession(requests.Session):
+    """requests session applying the fetch policy to every request.
+
+    Requests get connect and read timeouts unless they set their own.
+    Before each attempt the circuit breaker of the host is checked and a
+    token is taken from its TokenBucket. Connection errors, timeouts and
+    429/5xx responses are retried up to FETCH_RETRIES times, waiting an
+    exponentially increasing, jittered delay (or the server's Retry-After)
+    between attempts. Failed attempts count towards opening the circuit.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT))
+        host = urllib.parse.urlsplit(url).netloc
+        for attempt in itertools.count():
+            check_host_circuit(host)
+            get_host_bucket(host).acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record_host_result(host, failed=True)
+                if attempt >= FETCH_RETRIES:
+                    raise
+                delay, reason = get_retry_delay(attempt), str(e)
+            else:
+                record_host_result(host, failed=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= FETCH_RETRIES:
+                    return response
+                delay = get_retry_delay(attempt, response.headers.get("Retry-After"))
+                reason = f"HTTP {response.status_code}"
+                response.close()
+            report_event("retry", url=url, attempt=attempt + 1, delay=delay, reason=reason)
+            time.sleep(delay)
+
+def get_session():
+    """Return the pooled HTTP session shared by all downloads in this run.
+
+    The session is a FetchSession, so every request follows the fetch policy.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = FetchSession()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                                    pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def get_retry_delay(attempt, retry_after=None):
+    """Return how many seconds to wait before retrying a request.
+
+    Uses exponential backoff with full jitter, or the server's Retry-After
+    header when it gives a number of seconds, capped at FETCH_BACKOFF_MAX.
+
+    Keyword arguments:
+    attempt -- Number of attempts already retried (0 for the first retry)
+    retry_after -- Value of the Retry-After header, if any
+    """
+    if retry_after is not None and retry_after.strip().isdigit():
+        return min(int(retry_after), FETCH_BACKOFF_MAX)
+    return random.uniform(0, min(FETCH_BACKOFF_MAX, FETCH_BACKOFF_BASE * 2 ** attempt))
+
+class TokenBucket:
+    """Rate limit allowing rate requests per second on average, in bursts of up to capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request can be sent and take a token for it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_host_bucket(host):
+    """Return the TokenBucket limiting requests to a host.
+
+    Keyword arguments:
+    host -- Host name and port, as in the URL
+    """
+    with _lock:
+        if host not in _host_buckets:
+            hostname = host.rsplit(":", 1)[0] if not host.endswith("]") else host
+            _host_buckets[host] = TokenBucket(*HOST_RATES.get(hostname, DEFAULT_HOST_RATE))
+        return _host_buckets[host]
+
+def check_host_circuit(host):
+    """Raise CircuitOpenError if the circuit breaker of a host is open.
+
+    The circuit opens after CIRCUIT_BREAKER_THRESHOLD failed attempts in a
+    row. Once CIRCUIT_BREAKER_COOLDOWN seconds have passed a single trial
+    request is let through, which closes the circuit if it succeeds and
+    opens it again otherwise.
+
+    Keyword arguments:
+    host -- Host name and port, as in the URL
+    """
+    with _lock:
+        circuit = _host_circuits.get(host)
+        if circuit is None or circuit["failures"] < CIRCUIT_BREAKER_THRESHOLD:
+            return
+        if time.monotonic() - circuit["opened"] < CIRCUIT_BREAKER_COOLDOWN:
+            raise CircuitOpenError(f"Not connecting to {host} after {circuit['failures']} failed attempts")
+        circuit["opened"] = time.monotonic()
+
+def record_host_result(host, failed):
+    """Record the outcome of a request for the circuit breaker of a host.
+
+    Keyword arguments:
+    host -- Host name and port, as in the URL
+    failed -- Whether the request failed
+    """
+    with _lock:
+        circuit = _host_circuits.setdefault(host, {"failures": 0, "opened": 0})
+        if not failed:
+            circuit["failures"] = 0
+            return
+        circuit["failures"] += 1
+        if circuit["failures"] == CIRCUIT_BREAKER_THRESHOLD:
+            circuit["opened"] = time.monotonic()
+            report_event("circuit_open", host=host, failures=circuit["failures"],
+                         cooldown=CIRCUIT_BREAKER_COOLDOWN)
+
+def iter_raw_content(response, chunk_size):
+    """Yield the body of a streamed response exactly as it was sent.
+
+    Unlike response.iter_content, a Content-Encoding such as gzip is not
+    decoded, so the bytes match the Content-Length and byte ranges of the
+    file. Errors are raised as the requests exceptions iter_content raises.
+
+    Keyword arguments:
+    response -- Response of a request made with stream=True
+    chunk_size -- Number of bytes to read at a time
+    """
+    try:
+        yield from response.raw.stream(chunk_size, decode_content=False)
+    except urllib3.exceptions.ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+    except urllib3.exceptions.SSLError as e:
+        raise requests.exceptions.SSLError(e)
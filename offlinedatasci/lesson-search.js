@@ -0,0 +1,50 @@
+// Search the titles and headings of the downloaded lessons.
+// lessonSearchIndex is defined by search-index.js, generated by add_lesson_index_page.
+(function () {
+  var input = document.getElementById("lesson-search");
+  var results = document.getElementById("search-results");
+  var lessonList = document.getElementById("lesson-list");
+  var pages = (window.lessonSearchIndex || []).map(function (page) {
+    return {page: page, text: [page.title].concat(page.headings).join("\n").toLowerCase()};
+  });
+
+  function matchingHeading(page, words) {
+    for (var i = 0; i < page.headings.length; i++) {
+      var heading = page.headings[i].toLowerCase();
+      if (words.some(function (word) { return heading.indexOf(word) !== -1; })) {
+        return page.headings[i];
+      }
+    }
+    return "";
+  }
+
+  function search() {
+    var words = input.value.toLowerCase().split(/\s+/).filter(Boolean);
+    results.textContent = "";
+    lessonList.hidden = words.length > 0;
+    if (!words.length) {
+      return;
+    }
+    var matches = pages.filter(function (entry) {
+      return words.every(function (word) { return entry.text.indexOf(word) !== -1; });
+    });
+    matches.slice(0, 100).forEach(function (entry) {
+      var item = document.createElement("li");
+      var link = document.createElement("a");
+      link.href = entry.page.path;
+      link.textContent = entry.page.title;
+      item.appendChild(link);
+      var details = [entry.page.lesson, matchingHeading(entry.page, words)].filter(Boolean);
+      item.appendChild(document.createTextNode(" — " + details.join(": ")));
+      results.appendChild(item);
+    });
+    if (!matches.length) {
+      var empty = document.createElement("li");
+      empty.textContent = "No lessons found";
+      results.appendChild(empty);
+    }
+  }
+
+  input.addEventListener("input", search);
+  search();
+})();
@@ -3,86 +3,720 @@
 #Downloading Data Carpentry website using httrack
 
 from pathlib import Path
-import airium
-import bs4 as bs
+import concurrent.futures
+import contextlib
+import email.utils
+import fnmatch
+import functools
+import gzip
+import hashlib
+import html
+import importlib
+import io
+import itertools
+import json
+import lzma
 import os
+import posixpath
 import re
 import subprocess
-import urllib.request, urllib.error, urllib.parse
-import importlib_resources
-import pypi_mirror
-import requests
 import shutil
+import socket
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
 import warnings
+import zipfile
+from .events import (event_log, format_bytes, progress_display, report_event, report_transfer_progress,
+                     stage, track_transfer)
 
-def add_lesson_index_page(lesson_path):
-    """Add a basic landing page for lessons
-    
-    Uses the top-level directory name to group lessons into sections by source
-    Then displays an unordered list of lessons within each source
+class LazyModule:
+    """Module that is only imported when one of its attributes is first used.
+
+    Keeps importing offlinedatasci, and so starting the command line, fast
+    by not loading the larger dependencies until a command needs them.
+
+    Keyword arguments:
+    name -- Name of the module
+    """
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.__name__), attribute)
+
+    def __repr__(self):
+        return f"<module {self.__name__!r} (imported on first use)>"
 
+airium = LazyModule("airium")
+asyncio = LazyModule("asyncio")
+bs = LazyModule("bs4")
+importlib_resources = LazyModule("importlib_resources")
+pypi_mirror = LazyModule("pypi_mirror")
+requests = LazyModule("requests")
+# The session and fetch policy, which import requests. Private so that
+# "from .main import *" does not hide the offlinedatasci.fetch submodule
+_fetch = LazyModule(f"{__package__}.fetch")
+
+ARTIFACT_DIRS = ["R", "rstudio", "python", "pythonlibraries", "pypi", "miniCRAN", "lessons"]
+CRAN_REPO_TYPES = {
+    "source": ("src/contrib", ".tar.gz"),
+    "win.binary": ("bin/windows/contrib/{r_version}", ".zip"),
+    "mac.binary.big-sur-x86_64": ("bin/macosx/big-sur-x86_64/contrib/{r_version}", ".tgz"),
+    "mac.binary.big-sur-arm64": ("bin/macosx/big-sur-arm64/contrib/{r_version}", ".tgz")
+}
+CRAN_URL = "https://cloud.r-project.org/"
+CSS_URL_PATTERN = re.compile(r"""(?:url\(\s*|@import\s+(?!url\())(['"]?)([^'")\s;]+)\1""")
+DEDUPLICATE_MIN_SIZE = 1024
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_PYTHON_PACKAGES = ["matplotlib", "notebook", "numpy", "pandas"]
+DEFAULT_R_PACKAGES = ["tidyverse", "RSQLite"]
+DEFAULT_DOWNLOAD_PARTS = 4
+DEFAULT_HOST_LIMIT = 2
+DEFAULT_SERVE_PORT = 8000
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+EXPORT_REMOVED_FILENAME = "removed.txt"
+EXPORT_SUFFIXES = {"zst": ".tar.zst", "gz": ".tar.gz", "xz": ".tar.xz", "none": ".tar"}
+PACKAGE_SETS = {
+    "r-packages": {
+        "data-carpentry": ["tidyverse", "RSQLite"],
+        "data-science": ["dplyr", "ggplot2", "shiny", "lubridate", "knitr", "esquisse", "mlr3", "knitr", "DT"]
+    },
+    "python-packages": {
+        "data-carpentry": ["pandas", "notebook", "numpy", "matplotlib", "plotnine"],
+        "software-carpentry": ["matplotlib", "notebook", "numpy", "pandas"],
+        "data-science": ["scipy", "numpy", "pandas", "matplotlib", "keras", "scikit-learn", "beautifulsoup4", "seaborn","torch"]
+    }
+}
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+PARTIAL_FILE_PATTERN = re.compile(r"(?P<name>.*)\.part(?:\.\d+|\.validator)?")
+PRECOMPRESS_MIN_SIZE = 256
+PRECOMPRESS_PATTERNS = ["*.html", "*.htm", "*.css", "*.js", "*.svg", "*.metadata"]
+PYPI_INDEX_URL = None
+PYTHON_PACKAGE_PLATFORMS = ["manylinux_2_17_x86_64", "macosx_10_12_x86_64", "win_amd64"]
+HASH_CHUNK_SIZE = 1024 * 1024
+HREF_PATTERN = re.compile(r"""href\s*=\s*["']([^"'#?]+)""", re.IGNORECASE)
+INSTALLER_MATRIX = {
+    "python": {"directory": "python", "versions": ["3.12"], "keep": 2, "platforms": [
+        {"os": "windows", "arch": "x86", "pattern": r"python-{version}\.exe"},
+        {"os": "windows", "arch": "x86_64", "pattern": r"python-{version}-amd64\.exe"},
+        {"os": "windows", "arch": "arm64", "pattern": r"python-{version}-arm64\.exe"},
+        {"os": "macos", "arch": "universal2", "pattern": r"python-{version}-macos\d+\.pkg"}]},
+    "r": {"directory": "R", "versions": ["latest"], "keep": 2, "platforms": [
+        {"os": "windows", "arch": "x86_64", "pattern": r"R-{version}-win\.exe"},
+        {"os": "macos", "arch": "arm64", "pattern": r"R-{version}-arm64\.pkg"},
+        {"os": "macos", "arch": "x86_64", "pattern": r"R-{version}-x86_64\.pkg"}]},
+    "rstudio": {"directory": "rstudio", "versions": ["latest"], "keep": 2, "platforms": [
+        {"os": "windows", "arch": "x86_64", "pattern": r"RStudio-{version}\.exe"},
+        {"os": "macos", "arch": "universal", "pattern": r"RStudio-{version}\.dmg"}]}
+}
+INSTALLER_VERSION_PATTERN = r"\d+(?:\.\d+)+(?:-\d+)?"
+LINK_ATTRIBUTES = [("a", "href"), ("link", "href"), ("img", "src"), ("script", "src"),
+                   ("source", "src"), ("video", "src"), ("audio", "src"), ("iframe", "src")]
+MANIFEST_FILENAME = "manifest.json"
+METADATA_CACHE_TTL = 60 * 60
+SOURCES_FILENAME = "sources.json"
+STATE_FILENAME = "state.json"
+STATE_MAX_AGE = 7 * 24 * 60 * 60
+RSTUDIO_DOWNLOAD_URL = "https://www.rstudio.com/products/rstudio/download/#download"
+R_VERSION_PATTERN = re.compile(r"(R-\d+\.\d+\.\d+)-(?:x86_64|arm64|win)\.(?:exe|pkg)")
+R_OLD_VERSION_LINK_PATTERN = re.compile(r'href="(\d+\.\d+\.\d+)/"')
+R_BASE_PACKAGES = {"R", "base", "compiler", "datasets", "graphics", "grDevices", "grid",
+                   "methods", "parallel", "splines", "stats", "stats4", "tcltk", "tools",
+                   "utils"}
+PYTHON_URL = "https://www.python.org/"
+PYTHON_VERSION_LINK_PATTERN = re.compile(r'href="(\d+(?:\.\d+)+)/"')
+
+WGET_RETRY_ARGS = ["--timeout=60", "--tries=5", "--waitretry=10"]
+WGET_EXIT_CODES = {
+    0: "ok",
+    1: "generic error",
+    2: "parse error",
+    3: "file I/O error",
+    4: "network failure",
+    5: "SSL verification failure",
+    6: "username/password authentication failure",
+    7: "protocol error",
+    8: "server issued an error response"
+}
+
+_manifest_lock = threading.RLock()
+_state_lock = threading.Lock()
+_session_lock = threading.Lock()
+_metadata_cache = {}
+_metadata_locks = {}
+_registered_targets = {}
+_registered_lesson_sources = {}
+
+def add_lesson_index_page(lesson_path, catalogue_path=None):
+    """Add a landing page and search index for the downloaded lessons.
+
+    Lessons are the directories inside each source directory. A catalogue of
+    their titles, sources, crawl times and page headings is cached and only
+    lessons whose HTML files changed are read again. The landing page lists
+    the lessons grouped by source, and search-index.js lets it search page
+    titles and headings offline. Both files are written atomically and only
+    when they change. Returns the catalogue.
+
+    Keyword arguments:
+    lesson_path -- Directory containing the lessons
+    catalogue_path -- JSON file caching the catalogue (defaults to
+                      .offlinedatasci/cache/lesson-catalogue.json next to lesson_path)
     """
     lesson_path = Path(lesson_path)
+    if catalogue_path is None:
+        catalogue_path = Path(get_ods_state_dir(lesson_path.parent), "cache", "lesson-catalogue.json")
+    try:
+        with open(catalogue_path) as catalogue_file:
+            previous_catalogue = json.load(catalogue_file)
+    except (OSError, ValueError):
+        previous_catalogue = {}
+
+    catalogue = {}
+    for source in list_subdirectories(lesson_path):
+        for lesson in list_subdirectories(Path(lesson_path, source)):
+            key = f"{source}/{lesson}"
+            pages, signature = find_lesson_pages(lesson_path, key)
+            entry = previous_catalogue.get(key)
+            if entry is None or entry["signature"] != signature:
+                entry = read_lesson_pages(lesson_path, key, pages)
+                entry.update(source=source, signature=signature, crawled=time.time())
+            catalogue[key] = entry
+    if catalogue != previous_catalogue:
+        write_json_atomically(catalogue_path, catalogue)
+
+    search_index = [dict(page, lesson=entry["title"])
+                    for entry in catalogue.values() for page in entry["pages"]]
+    write_if_changed(Path(lesson_path, "search-index.js"),
+                     f"var lessonSearchIndex = {json.dumps(search_index, sort_keys=True)};\n")
+    write_if_changed(Path(lesson_path, "index.html"), render_lesson_index_page(catalogue))
+    return catalogue
+
+def list_subdirectories(path):
+    """Return the sorted names of the directories in path, skipping hidden ones.
+
+    Keyword arguments:
+    path -- Directory to list
+    """
+    return sorted(entry.name for entry in os.scandir(path)
+                  if entry.is_dir() and not entry.name.startswith("."))
+
+def find_lesson_pages(lesson_path, key):
+    """Return the HTML pages of a lesson and a signature that changes when they do.
+
+    The signature is the number of pages, their total size and the newest
+    modification time, so finding out whether a lesson changed needs no
+    more than a stat of each file.
+
+    Keyword arguments:
+    lesson_path -- Directory containing the lessons
+    key -- Path of the lesson relative to lesson_path
+    """
+    pages = []
+    total_size = 0
+    newest_mtime = 0
+    for root, dirs, files in os.walk(Path(lesson_path, key)):
+        dirs.sort()
+        for file_name in sorted(files):
+            if not file_name.lower().endswith((".html", ".htm")):
+                continue
+            path = Path(root, file_name)
+            stat = path.stat()
+            pages.append(path.relative_to(lesson_path).as_posix())
+            total_size += stat.st_size
+            newest_mtime = max(newest_mtime, stat.st_mtime)
+    return pages, [len(pages), total_size, newest_mtime]
+
+def read_lesson_pages(lesson_path, key, pages):
+    """Return the catalogue entry of a lesson with the title and headings of its pages.
+
+    Keyword arguments:
+    lesson_path -- Directory containing the lessons
+    key -- Path of the lesson relative to lesson_path
+    pages -- Paths of the HTML pages of the lesson, relative to lesson_path
+    """
+    strainer = bs.SoupStrainer(["title", "h1", "h2"])
+    page_entries = []
+    for page in pages:
+        soup = bs.BeautifulSoup(Path(lesson_path, page).read_bytes(), 'lxml', parse_only=strainer)
+        headings = []
+        for heading in soup.find_all(["h1", "h2"]):
+            text = " ".join(heading.get_text().split())
+            if text and text not in headings:
+                headings.append(text)
+        title = soup.find("title")
+        title = " ".join(title.get_text().split()) if title else ""
+        page_entries.append({"path": urllib.parse.quote(page),
+                             "title": title or (headings[0] if headings else page),
+                             "headings": headings})
+    index_page = f"{key}/index.html"
+    index_entry = next((page for page in page_entries if page["path"] == urllib.parse.quote(index_page)), None)
+    lesson_name = key.split("/", 1)[1].replace('-', ' ').title()
+    return {"title": index_entry["title"] if index_entry else lesson_name,
+            "path": urllib.parse.quote(index_page if index_entry else f"{key}/"),
+            "pages": page_entries}
+
+def render_lesson_index_page(catalogue):
+    """Return the HTML of the lesson landing page.
+
+    Keyword arguments:
+    catalogue -- Lesson catalogue as returned by add_lesson_index_page
+    """
+    search_script = (importlib_resources.files("offlinedatasci") / "lesson-search.js").read_text()
+    lessons_by_source = {}
+    for entry in catalogue.values():
+        lessons_by_source.setdefault(entry["source"], []).append(entry)
+
     a = airium.Airium()
     a('<!DOCTYPE html>')
-    sources = next(os.walk(lesson_path))[1]
-    with a.html():
-        for source in sources:
-            with a.head():
-                a.meta(charset="utf-8")
-                a.title(_t="Lessons")
-            with a.body():
-                a.h1(_t="Lesson Material")
-                a.h2(_t=source.replace('-', ' ').title())
-            lessons = next(os.walk(Path(lesson_path, Path(source))))[1]
-            with a.ul():
-                for lesson in lessons:
-                    with a.li():
-                        lesson_index = Path(Path(source), Path(lesson), Path("index.html"))
-                        with a.a(href = lesson_index):
-                            a(lesson.replace('-', ' ').title())
-
-    with open(Path(Path(lesson_path), Path("index.html")), "w+") as index_file:
-        index_file.writelines(str(a))
-
-def download_all(ods_dir):
+    with a.html(lang="en"):
+        with a.head():
+            a.meta(charset="utf-8")
+            a.meta(name="viewport", content="width=device-width, initial-scale=1")
+            a.title(_t="Lessons")
+        with a.body():
+            a.h1(_t="Lesson Material")
+            a.input(type="search", id="lesson-search", placeholder="Search lessons",
+                    **{"aria-label": "Search lessons"})
+            a.ul(id="search-results")
+            with a.div(id="lesson-list"):
+                for source, entries in lessons_by_source.items():
+                    a.h2(_t=html.escape(source.replace('-', ' ').title()))
+                    with a.ul():
+                        for entry in entries:
+                            with a.li():
+                                a.a(href=entry["path"], _t=html.escape(entry["title"]))
+                                crawled = time.strftime("%Y-%m-%d", time.localtime(entry["crawled"]))
+                                a.small(_t=f"updated {crawled}")
+            a.script(src="search-index.js")
+            with a.script():
+                a(search_script)
+    return str(a)
+
+def download_all(ods_dir, max_workers=DEFAULT_MAX_WORKERS):
     """Download all installers, repositories, and lesson materials.
 
     Each function will run even if others fail.
 
     Keyword arguments:
     ods_dir -- Directory to save installers and lesson materials
+    max_workers -- Maximum number of downloads to run at the same time
     """
-    try:
-        download_r(ods_dir)
-    except Exception as e:
-        print(f"Error downloading R: {e}")
+    return download_targets(ods_dir, ["all"], max_workers)
 
-    try:
-        download_rstudio(ods_dir)
-    except Exception as e:
-        print(f"Error downloading RStudio: {e}")
+def download_targets(ods_dir, targets, max_workers=DEFAULT_MAX_WORKERS, force=False):
+    """Download several targets at the same time using a bounded pool of workers.
 
-    try:
-        download_r_packages(ods_dir)
-    except Exception as e:
-        print(f"Error downloading R packages: {e}")
+    Targets that plan_download_targets finds up to date are skipped. Each
+    target will run even if others fail, the outcome of each target is
+    saved in the state file and a summary of all targets is printed once
+    every target has finished.
 
-    try:
-        download_lessons(ods_dir)
-    except Exception as e:
-        print(f"Error downloading lessons: {e}")
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    targets -- Names of targets to download, "all" selects every target
+    max_workers -- Maximum number of targets to download at the same time
+    force -- Download every target, even if it is up to date
+    """
+    available_targets = get_download_targets()
+    event_log_path = Path(get_ods_state_dir(ods_dir), "logs", "events.jsonl")
+    with event_log(event_log_path), progress_display(), stage("install"):
+        with stage("plan"):
+            plan = plan_download_targets(ods_dir, targets, max_workers, force)
+        print_download_plan(plan)
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {}
+            for target, step in plan.items():
+                if not step["stale"]:
+                    results[target] = {"label": step["label"], "error": None, "seconds": 0, "skipped": True}
+                    continue
+                label, function = available_targets[target]
+                futures[executor.submit(run_download_target, label, function, ods_dir)] = target
+            for future in concurrent.futures.as_completed(futures):
+                target = futures[future]
+                results[target] = future.result()
+                record_target_state(ods_dir, target, results[target], plan[target]["fingerprint"])
+
+        results = {target: results[target] for target in plan}
+        print_download_summary(results)
+        try:
+            with stage("manifest"):
+                update_manifest(ods_dir)
+        except Exception as e:
+            print(f"Error updating manifest: {e}")
+    print(f"Timings and transfers were logged to {event_log_path}")
+    return results
+
+def get_download_targets():
+    """Return the available download targets.
+
+    Maps the target name used on the command line to a tuple of a
+    human readable label and the function that downloads the target.
+    Targets added with register_download_target come after the built in ones.
+    """
+    targets = {
+        "r": ("R", download_r),
+        "rstudio": ("RStudio", download_rstudio),
+        "r-packages": ("R packages", download_r_packages),
+        "lessons": ("lessons", download_lessons),
+        "python": ("Python", download_python),
+        "python-packages": ("Python packages", download_python_packages)
+    }
+    for name, target in _registered_targets.items():
+        targets[name] = (target["label"], target["function"])
+    return targets
+
+def register_download_target(name, label, function, directory=None, fingerprint=None):
+    """Add a download target, which can then be selected by name and is part of "all".
 
+    Keyword arguments:
+    name -- Name of the target used on the command line
+    label -- Human readable name of the target
+    function -- Function downloading the target, called with ods_dir
+    directory -- Directory the target saves its files in, relative to ods_dir
+    fingerprint -- Function returning the fingerprint of the target (see
+                   plan_download_targets), called with ods_dir. Targets
+                   without a directory and fingerprint are downloaded every time.
+    """
+    _registered_targets[name] = {"label": label, "function": function,
+                                 "directory": directory, "fingerprint": fingerprint}
+
+def register_installer(product, directory=None, versions=None, platforms=None, keep=None,
+                       index_urls=None, label=None):
+    """Add a product to INSTALLER_MATRIX, or change the settings of one already in it.
+
+    New products are also added as a download target named product. Their
+    installers are found by matching the links on index_urls against the
+    patterns of the platforms, as for the built in products.
+
+    Keyword arguments:
+    product -- Name of the product, e.g., "quarto"
+    directory -- Directory to save the installers in, relative to ods_dir
+    versions -- Versions to download, e.g., ["1.5.57"] or ["latest"]
+    platforms -- List of dictionaries with the "os", "arch" and file name
+                 "pattern" of each installer, "{version}" in the pattern
+                 matches the version
+    keep -- Number of versions of each installer to keep (see prune_installers)
+    index_urls -- Pages linking to the installers, "{version}" is replaced by the version
+    label -- Human readable name of the product (defaults to product)
+    """
+    settings = {"directory": directory, "versions": versions, "platforms": platforms,
+                "keep": keep, "index_urls": index_urls}
+    settings = {key: value for key, value in settings.items() if value is not None}
+    if product in INSTALLER_MATRIX:
+        INSTALLER_MATRIX[product] = {**INSTALLER_MATRIX[product], **settings}
+        return
+    missing = [key for key in ["directory", "platforms", "index_urls"] if key not in settings]
+    if missing:
+        raise ValueError(f"Installer {product} needs {', '.join(missing)}")
+    INSTALLER_MATRIX[product] = {"versions": ["latest"], "keep": 2, **settings}
+    if directory not in ARTIFACT_DIRS:
+        ARTIFACT_DIRS.append(directory)
+    register_download_target(product, label or product,
+                             functools.partial(download_installer_matrix, products=[product]),
+                             directory, functools.partial(get_installers_fingerprint, product=product))
+
+def register_package_set(package_type, name, packages):
+    """Add a named set of packages, which can be added by name like the sets in PACKAGE_SETS.
+
+    Keyword arguments:
+    package_type -- "r-packages" or "python-packages"
+    name -- Name of the set, e.g., "geospatial"
+    packages -- Names of the packages in the set
+    """
+    if package_type not in PACKAGE_SETS:
+        raise ValueError(f"Unknown package type: {package_type}")
+    PACKAGE_SETS[package_type][name] = list(packages)
+
+def register_lesson_source(name, lessons, wget_args):
+    """Add a source of lessons, which are downloaded with the other lessons.
+
+    Keyword arguments:
+    name -- Name of the source, used as the directory of its lessons
+    lessons -- URLs of the lessons
+    wget_args -- Arguments used to mirror the lessons (see get_lesson_sources)
+    """
+    _registered_lesson_sources[name] = {"wget_args": list(wget_args), "lessons": list(lessons)}
+
+def load_sources(path):
+    """Add the installers, package sets and lessons declared in a sources file.
+
+    The file is a JSON object with any of the sections "installers",
+    mapping products to the arguments of register_installer, "package-sets",
+    mapping "r-packages" and "python-packages" to dictionaries of package
+    sets, and "lessons", mapping sources to their "lessons" and "wget_args".
+    Returns the names of the download targets added.
+
+    Keyword arguments:
+    path -- Path of the sources file
+    """
+    with open(path) as sources_file:
+        sources = json.load(sources_file)
+    unknown = set(sources) - {"installers", "package-sets", "lessons"}
+    if unknown:
+        raise ValueError(f"Unknown sections in {path}: {', '.join(sorted(unknown))}")
+    targets = set(_registered_targets)
+    for product, settings in sources.get("installers", {}).items():
+        register_installer(product, **settings)
+    for package_type, package_sets in sources.get("package-sets", {}).items():
+        for name, packages in package_sets.items():
+            register_package_set(package_type, name, packages)
+    for name, source in sources.get("lessons", {}).items():
+        register_lesson_source(name, source["lessons"], source["wget_args"])
+    return [name for name in _registered_targets if name not in targets]
+
+def run_download_target(label, function, ods_dir):
+    """Run a single download function, recording failures instead of raising.
+
+    Keyword arguments:
+    label -- Human readable name of the target
+    function -- Download function to call with ods_dir
+    ods_dir -- Directory to save installers and lesson materials
+    """
+    start_time = time.perf_counter()
+    error = None
     try:
-        download_python(ods_dir)
+        with stage(label):
+            function(ods_dir)
     except Exception as e:
-        print(f"Error downloading Python: {e}")
+        error = e
+        print(f"Error downloading {label}: {e}")
+    return {"label": label,
+            "error": error,
+            "seconds": time.perf_counter() - start_time}
+
+def print_download_summary(results):
+    """Print the outcome and duration of each download target.
+
+    Keyword arguments:
+    results -- Dictionary of results returned by run_download_target
+    """
+    print("\nDownload summary:")
+    for result in results.values():
+        status = "failed" if result["error"] else "up to date" if result.get("skipped") else "ok"
+        print(f"  {result['label']}: {status} ({result['seconds']:.1f}s)")
+    failures = [result for result in results.values() if result["error"]]
+    print(f"{len(results) - len(failures)} succeeded, {len(failures)} failed")
+
+def select_download_targets(targets):
+    """Return the names of the targets to download, in order and without duplicates.
+
+    Keyword arguments:
+    targets -- Names of targets to download, "all" selects every target
+    """
+    available_targets = get_download_targets()
+    selected_targets = []
+    for target in targets:
+        if target == "all":
+            selected_targets.extend(available_targets)
+        elif target in available_targets:
+            selected_targets.append(target)
+        else:
+            raise ValueError(f"Unknown download target: {target}")
+    return list(dict.fromkeys(selected_targets))
+
+def plan_download_targets(ods_dir, targets, max_workers=DEFAULT_MAX_WORKERS, force=False):
+    """Work out which targets need to be downloaded again.
 
+    The fingerprint of each target (the resolved versions and the
+    validators of the upstream files it depends on) is worked out at the
+    same time for all targets and compared to the one saved in the state
+    file after its last successful download. A target is stale if its last
+    download failed, its files are missing, its fingerprint changed or
+    could not be worked out, or it was downloaded more than STATE_MAX_AGE
+    seconds ago. Returns a dictionary mapping each target to its "label",
+    whether it is "stale", the "reason" and its "fingerprint".
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    targets -- Names of targets to download, "all" selects every target
+    max_workers -- Maximum number of fingerprints to work out at the same time
+    force -- Mark every target as stale
+    """
+    available_targets = get_download_targets()
+    fingerprints = get_target_fingerprints()
+    selected_targets = select_download_targets(targets)
+    state = read_state(ods_dir)
+
+    def get_fingerprint(target):
+        if target not in fingerprints:
+            return None
+        try:
+            return fingerprints[target][1](ods_dir)
+        except Exception:
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        target_fingerprints = dict(zip(selected_targets, executor.map(get_fingerprint, selected_targets)))
+
+    plan = {}
+    for target in selected_targets:
+        fingerprint = target_fingerprints[target]
+        previous = state["targets"].get(target)
+        output_dir = Path(ods_dir, fingerprints[target][0]) if target in fingerprints else None
+        if force:
+            reason = "forced"
+        elif previous is None or previous.get("last_success") is None:
+            reason = "never downloaded"
+        elif previous.get("error"):
+            reason = "last download failed"
+        elif output_dir is None or not output_dir.is_dir() or not any(output_dir.iterdir()):
+            reason = "files missing"
+        elif fingerprint is None:
+            reason = "could not check upstream"
+        elif fingerprint != previous.get("fingerprint"):
+            reason = "upstream changed"
+        elif time.time() - previous["last_success"] > STATE_MAX_AGE:
+            reason = "last downloaded over a week ago"
+        else:
+            reason = None
+        plan[target] = {"label": available_targets[target][0],
+                        "stale": reason is not None,
+                        "reason": reason or "up to date",
+                        "fingerprint": fingerprint}
+    return plan
+
+def print_download_plan(plan):
+    """Print which targets will be downloaded and why.
+
+    Keyword arguments:
+    plan -- Dictionary returned by plan_download_targets
+    """
+    print("Download plan:")
+    for step in plan.values():
+        action = "download" if step["stale"] else "skip"
+        print(f"  {step['label']}: {action} ({step['reason']})")
+
+def get_target_fingerprints():
+    """Return how to check whether each download target is up to date.
+
+    Maps the target name to a tuple of the directory its files are saved
+    in, relative to ods_dir, and a function returning its fingerprint.
+    """
+    fingerprints = {
+        "r": ("R", functools.partial(get_installers_fingerprint, product="r")),
+        "rstudio": ("rstudio", functools.partial(get_installers_fingerprint, product="rstudio")),
+        "r-packages": ("miniCRAN", get_r_packages_fingerprint),
+        "lessons": ("lessons", get_lessons_fingerprint),
+        "python": ("python", functools.partial(get_installers_fingerprint, product="python")),
+        "python-packages": ("pypi", get_python_packages_fingerprint)
+    }
+    for name, target in _registered_targets.items():
+        if target["directory"] is not None and target["fingerprint"] is not None:
+            fingerprints[name] = (target["directory"], target["fingerprint"])
+    return fingerprints
+
+def get_installers_fingerprint(ods_dir, product):
+    """Return the links to the installers of a product in INSTALLER_MATRIX."""
+    return {"installers": sorted(installer["url"] for installer in resolve_installer_matrix(ods_dir, [product]))}
+
+def get_r_packages_fingerprint(ods_dir):
+    """Return the R version and the CRAN versions of the mirrored R packages and all their dependencies.
+
+    Packages added to the mirror (e.g., with the add command) are included.
+    """
+    packages = set(DEFAULT_R_PACKAGES)
+    packages_path = Path(ods_dir, "miniCRAN", "src", "contrib", "PACKAGES")
+    if packages_path.exists():
+        with open(packages_path) as packages_file:
+            packages.update(record["Package"] for record in parse_dcf(packages_file))
+    records = resolve_r_dependencies(packages, get_cran_packages_index("src/contrib", ods_dir))
+    return {"packages": {record["Package"]: record["Version"] for record in records},
+            "r_version": find_r_current_version(f"{CRAN_URL}bin/windows/base/", ods_dir)}
+
+def get_python_packages_fingerprint(ods_dir):
+    """Return the Python versions, platforms and files pip resolves for the mirrored packages.
+
+    The default packages are resolved along with every project already in
+    the mirror, so dependencies and packages added with the add command are
+    included and a new release of any of them changes the fingerprint. If
+    pip cannot report what it would install, the validators of the PyPI
+    pages of these projects are used instead.
+    """
+    pypi_dir = Path(ods_dir, "pypi")
+    mirrored = [path.parent.name for path in pypi_dir.glob("*/index.html")] if pypi_dir.is_dir() else []
+    packages = sorted(set(DEFAULT_PYTHON_PACKAGES) | set(mirrored))
+    python_versions = get_python_releases(ods_dir)
+    # download_python_packages only mirrors Windows packages on Windows
+    platforms = ["win_amd64"] if sys.platform == "win32" else PYTHON_PACKAGE_PLATFORMS
+    if not pip_supports_report():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_fetch.HTTP_POOL_SIZE) as executor:
+            validators = list(executor.map(get_url_validators,
+                                           [f"{PYPI_INDEX_URL or 'https://pypi.org/simple/'}{package}/"
+                                            for package in packages]))
+        return {"python_versions": python_versions,
+                "platforms": platforms,
+                "packages": dict(zip(packages, validators))}
+    jobs = [(platform, python_version) for platform in platforms for python_version in python_versions]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+        resolved = list(executor.map(lambda job: resolve_python_packages(packages, *job), jobs))
+    return {"python_versions": python_versions,
+            "platforms": platforms,
+            "files": sorted({package_file["filename"] for package_files in resolved
+                             for package_file in package_files})}
+
+def get_lessons_fingerprint(ods_dir):
+    """Return the validators of the landing page of every lesson."""
+    lessons = [lesson for source in get_lesson_sources().values() for lesson in source["lessons"]]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_fetch.HTTP_POOL_SIZE) as executor:
+        return dict(zip(lessons, executor.map(get_url_validators, lessons)))
+
+def get_url_validators(url):
+    """Return the ETag and Last-Modified headers of a URL from a HEAD request.
+
+    Raises ValueError if the server sends neither, since changes to the URL
+    cannot then be detected.
+
+    Keyword arguments:
+    url -- Link to check
+    """
+    response = get_session().head(url, allow_redirects=True)
+    response.raise_for_status()
+    validators = {"etag": response.headers.get("ETag"),
+                  "last_modified": response.headers.get("Last-Modified")}
+    if not any(validators.values()):
+        raise ValueError(f"{url} has no ETag or Last-Modified header")
+    return validators
+
+def read_state(ods_dir):
+    """Return the state of previous downloads, or an empty state if there is none.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    """
     try:
-        download_python_packages(ods_dir)
-    except Exception as e:
-        print(f"Error downloading Python packages: {e}")
+        with open(Path(get_ods_state_dir(ods_dir), STATE_FILENAME)) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {"version": 1, "targets": {}}
+
+def record_target_state(ods_dir, target, result, fingerprint):
+    """Save the outcome of downloading a target in the state file.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    target -- Name of the target
+    result -- Dictionary returned by run_download_target
+    fingerprint -- Fingerprint of the target worked out before it was downloaded
+    """
+    with _state_lock:
+        state = read_state(ods_dir)
+        entry = state["targets"].setdefault(target, {"last_success": None, "fingerprint": None})
+        entry.update(last_attempt=time.time(),
+                     seconds=result["seconds"],
+                     error=str(result["error"]) if result["error"] else None)
+        if result["error"] is None:
+            # The fingerprint was worked out before downloading, so upstream
+            # changes made during the download are picked up next time
+            entry.update(last_success=entry["last_attempt"], fingerprint=fingerprint)
+        write_json_atomically(Path(get_ods_state_dir(ods_dir), STATE_FILENAME), state)
 
 def download_and_save_installer(latest_version_url, destination_path):
     """Download and save installer in user given path.
@@ -92,35 +726,413 @@ def download_and_save_installer(latest_version_url, destination_path):
     destination_path -- Path to save installer
     """
     if not os.path.exists(destination_path):
-                print("****Downloading file: ", destination_path)    
-                urllib.request.urlretrieve(latest_version_url, destination_path) 
+        download_file(latest_version_url, destination_path)
     else:
-        print("File not being downloaded")
+        report_event("file_skipped", url=latest_version_url, path=str(destination_path))
+
+def download_file(url, destination_path,
+                  parts=DEFAULT_DOWNLOAD_PARTS,
+                  parallel_threshold=PARALLEL_DOWNLOAD_THRESHOLD):
+    """Download a file so that it only appears at destination_path once complete.
+
+    Data is written to a ".part" file next to the destination which is resumed
+    with an HTTP Range request if an earlier download was interrupted. The
+    ETag or Last-Modified date of the file is saved in a ".part.validator"
+    file and sent as If-Range, so a file that changed upstream is downloaded
+    again from the start instead of being joined to the old part. Files
+    larger than parallel_threshold are fetched as several byte ranges at the
+    same time when the server supports it. The complete file is then renamed
+    into place.
+
+    Keyword arguments:
+    url -- Link to download the file from
+    destination_path -- Path to save the file
+    parts -- Number of byte ranges to download in parallel
+    parallel_threshold -- Minimum size in bytes to download in parallel
+    """
+    destination_path = Path(destination_path)
+    partial_path = Path(str(destination_path) + ".part")
+    validator_path = Path(f"{partial_path}.validator")
+    size, accepts_ranges, validator = get_download_info(url)
+    range_paths = [Path(f"{partial_path}.{part}") for part in range(parts)]
+    previous_validator = validator_path.read_text() if validator_path.exists() else None
+    if validator is None or previous_validator != validator:
+        # Parts of another version of the file (or of an unknown one) cannot be resumed
+        for path in [partial_path, *range_paths]:
+            if path.exists():
+                path.unlink()
+    if validator is None:
+        if validator_path.exists():
+            validator_path.unlink()
+    elif previous_validator != validator:
+        validator_path.write_text(validator)
+
+    use_parallel_ranges = (accepts_ranges and size is not None and parts > 1
+                           and size >= parallel_threshold
+                           and not partial_path.exists())
+    with track_transfer(url, destination_path, size) as transfer:
+        for attempt in itertools.count():
+            try:
+                if use_parallel_ranges:
+                    part_size = -(-size // parts)
+                    ranges = [(start, min(start + part_size, size) - 1)
+                              for start in range(0, size, part_size)]
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                        futures = [executor.submit(download_range, url, range_path, start, end, True, transfer,
+                                                   validator)
+                                   for range_path, (start, end) in zip(range_paths, ranges)]
+                        for future in futures:
+                            future.result()
+                else:
+                    end = size - 1 if size is not None else None
+                    download_range(url, partial_path, 0, end, resume=accepts_ranges, transfer=transfer,
+                                   validator=validator)
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                # The session retries failed requests, this retries transfers
+                # cut off part way, resuming from the bytes already saved
+                if attempt >= _fetch.FETCH_RETRIES or isinstance(e, _fetch.CircuitOpenError) or not accepts_ranges:
+                    raise
+                transfer["retries"] += 1
+                delay = _fetch.get_retry_delay(attempt)
+                report_event("retry", url=url, attempt=attempt + 1, delay=delay, reason=str(e))
+                time.sleep(delay)
+        if use_parallel_ranges:
+            # An interrupted join leaves a valid prefix in partial_path which
+            # the next attempt resumes as a single stream
+            with open(partial_path, "wb") as partial_file:
+                for range_path in range_paths[:len(ranges)]:
+                    with open(range_path, "rb") as range_file:
+                        shutil.copyfileobj(range_file, partial_file, DOWNLOAD_CHUNK_SIZE)
+
+        downloaded_size = partial_path.stat().st_size
+        if size is not None and downloaded_size != size:
+            raise IOError(f"Incomplete download of {url}: "
+                          f"expected {size} bytes, got {downloaded_size}")
+        os.replace(partial_path, destination_path)
+    for path in [*range_paths, validator_path]:
+        if path.exists():
+            path.unlink()
+
+def download_range(url, partial_path, start, end, resume=True, transfer=None, validator=None):
+    """Download bytes start to end (inclusive) of url into partial_path.
+
+    Bytes already present in partial_path are kept and only the remaining
+    part of the range is requested. The body is saved as sent, without
+    decoding any Content-Encoding.
+
+    Keyword arguments:
+    url -- Link to download the file from
+    partial_path -- Path of the temporary file holding this range
+    start -- Offset of the first byte of the range
+    end -- Offset of the last byte of the range, None for the end of the file
+    resume -- Whether the server supports continuing with a Range request
+    transfer -- Transfer from track_transfer to report progress to
+    validator -- ETag or Last-Modified date the bytes in partial_path were
+                 downloaded with, sent as If-Range so the whole file is sent
+                 again if it changed
+    """
+    partial_path = Path(partial_path)
+    offset = partial_path.stat().st_size if partial_path.exists() and resume else 0
+    if end is not None and start + offset > end + 1:
+        offset = 0
+    if end is not None and start + offset == end + 1:
+        return
+
+    headers = {"Accept-Encoding": "identity"}
+    if start + offset > 0 or end is not None and resume:
+        range_end = "" if end is None else str(end)
+        headers["Range"] = f"bytes={start + offset}-{range_end}"
+        if validator is not None:
+            headers["If-Range"] = validator
+    with get_session().get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            if start > 0:
+                raise IOError(f"{url} changed during the download or the server ignored the byte range request")
+            offset = 0
+        mode = "ab" if offset else "wb"
+        if transfer is not None:
+            report_transfer_progress(transfer, 0, resumed_bytes=offset)
+        with open(partial_path, mode) as partial_file:
+            for chunk in _fetch.iter_raw_content(response, DOWNLOAD_CHUNK_SIZE):
+                partial_file.write(chunk)
+                if transfer is not None:
+                    report_transfer_progress(transfer, len(chunk))
+
+def get_download_info(url):
+    """Return the size of a download, whether the server accepts byte ranges and its validator.
 
+    The size is None when the server does not report it. The validator is
+    the ETag of the file, or its Last-Modified date if it has no strong
+    ETag (weak ETags cannot be used with If-Range), or None if it has neither.
+
+    Keyword arguments:
+    url -- Link to download the file from
+    """
+    try:
+        response = get_session().head(url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+        response.raise_for_status()
+    except requests.RequestException:
+        return None, False, None
+    size = response.headers.get("Content-Length")
+    size = int(size) if size and size.isdigit() else None
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    etag = response.headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+    return size, accepts_ranges, validator
 
 def download_r(ods_dir):
-    """Download most recent version of R installer (mac and windows) from CRAN
+    """Download the R installers in INSTALLER_MATRIX (Windows and macOS) from CRAN.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers
+    """
+    download_installer_matrix(ods_dir, ["r"])
+
+def download_installer_matrix(ods_dir, products=None, max_workers=DEFAULT_MAX_WORKERS):
+    """Download the installers in INSTALLER_MATRIX and prune old versions.
+
+    The installers of every product, version, operating system and
+    architecture are found in one pass, fetching the index pages at the
+    same time, and then downloaded at the same time. Installers already
+    downloaded are skipped. Afterwards only the newest versions of each
+    installer are kept (see prune_installers). Returns the installers as
+    returned by find_installers.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers
+    products -- Products to download, e.g., ["r", "python"] (defaults to all of INSTALLER_MATRIX)
+    max_workers -- Maximum number of index pages or installers to fetch at the same time
+    """
+    if products is None:
+        products = list(INSTALLER_MATRIX)
+    with stage("discover installers"):
+        installers = resolve_installer_matrix(ods_dir, products, max_workers)
+    for product in products:
+        Path(ods_dir, INSTALLER_MATRIX[product]["directory"]).mkdir(parents=True, exist_ok=True)
+    with stage("download installers"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            downloads = [executor.submit(download_and_save_installer, installer["url"],
+                                         Path(ods_dir, installer["path"]))
+                         for installer in installers]
+            for future in downloads:
+                future.result()
+    python_installers = [installer for installer in installers if installer["product"] == "python"]
+    for version in sorted({installer["version"] for installer in python_installers}):
+        record_python_checksums(ods_dir, version,
+                                [installer for installer in python_installers if installer["version"] == version])
+    for product in products:
+        removed = prune_installers(ods_dir, product, installers)
+        if removed:
+            print(f"Removed {len(removed)} old {product} installers: {', '.join(path.name for path in removed)}")
+    return installers
+
+def resolve_installer_matrix(ods_dir=None, products=None, max_workers=DEFAULT_MAX_WORKERS):
+    """Return the installers of every version of the products in INSTALLER_MATRIX.
+
+    The versions are looked up at the same time and each index page is
+    only fetched once. Installers listed under several versions (e.g.,
+    "3.12" and "3.12.7") are only returned once.
+
+    Keyword arguments:
+    ods_dir -- Directory whose metadata cache is used
+    products -- Products to look up (defaults to all of INSTALLER_MATRIX)
+    max_workers -- Maximum number of versions to look up at the same time
+    """
+    if products is None:
+        products = list(INSTALLER_MATRIX)
+    jobs = [(product, version) for product in products for version in INSTALLER_MATRIX[product]["versions"]]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        found = list(executor.map(lambda job: find_installers(job[0], job[1], ods_dir), jobs))
+    installers = {}
+    for installer in itertools.chain.from_iterable(found):
+        installers.setdefault(installer["path"], installer)
+    return list(installers.values())
+
+def find_installers(product, version, ods_dir=None):
+    """Return the installers of one version of a product for each of its platforms.
+
+    The installers are found by matching the links on the index pages of
+    the release against the file name pattern of each platform, choosing
+    the newest file if several match (e.g., builds for several macOS
+    versions). Returns a list of dictionaries with the "product",
+    "version", "os", "arch", "url" and "path" (relative to ods_dir) of
+    each installer. Platforms without an installer for this version, and
+    index pages that do not exist, are skipped with a warning.
+
+    Keyword arguments:
+    product -- Product in INSTALLER_MATRIX, e.g., "python"
+    version -- Version from the matrix, e.g., "3.12", "3.12.7" or "latest"
+    ods_dir -- Directory whose metadata cache is used
+    """
+    matrix_entry = INSTALLER_MATRIX[product]
+    release, index_urls = find_installer_release(product, version, ods_dir)
+    links = []
+    for index_url in index_urls:
+        page = fetch_metadata_if_exists(index_url, ods_dir)
+        if page is None:
+            warnings.warn(f"No {product} {release or version} installers listed at {index_url}")
+            continue
+        links.extend(urllib.parse.urljoin(index_url, link) for link in HREF_PATTERN.findall(page))
+    installers = []
+    for platform in matrix_entry["platforms"]:
+        pattern = get_installer_pattern(platform, release)
+        matches = {}
+        for link in links:
+            file_name = posixpath.basename(urllib.parse.urlsplit(link).path)
+            match = pattern.fullmatch(file_name)
+            if match:
+                matches[file_name] = (link, release or match.group("version"))
+        if not matches:
+            warnings.warn(f"No {product} {release or version} installer for {platform['os']} "
+                          f"{platform['arch']} found at {', '.join(index_urls)}")
+            continue
+        file_name = max(matches, key=version_key)
+        url, installer_version = matches[file_name]
+        installers.append({"product": product, "version": installer_version,
+                           "os": platform["os"], "arch": platform["arch"], "url": url,
+                           "path": f"{matrix_entry['directory']}/{file_name}"})
+    if not installers:
+        raise ValueError(f"No {product} {version} installers found at {', '.join(index_urls)}")
+    return installers
+
+def find_installer_release(product, version, ods_dir=None):
+    """Return the release a version in INSTALLER_MATRIX refers to and the pages listing its installers.
+
+    The release is None if it is only known from the installer file names
+    (e.g., the latest RStudio release). Products with "index_urls" (see
+    register_installer) are looked up on those pages.
+
+    Keyword arguments:
+    product -- Product in INSTALLER_MATRIX
+    version -- Version from the matrix, e.g., "3.12", "3.12.7" or "latest"
+    ods_dir -- Directory whose metadata cache is used
+    """
+    matrix_entry = INSTALLER_MATRIX[product]
+    if "index_urls" in matrix_entry:
+        release = None if version == "latest" else version
+        return release, [url.replace("{version}", version) for url in matrix_entry["index_urls"]]
+    if product == "python":
+        if version.count(".") >= 2:
+            return version, [f"{PYTHON_URL}ftp/python/{version}/"]
+        return find_python_installer_release(version, ods_dir)
+    if product == "r":
+        macosx_url = f"{CRAN_URL}bin/macosx/"
+        windows_url = f"{CRAN_URL}bin/windows/base/"
+        if version == "latest":
+            return find_r_current_version(macosx_url, ods_dir).replace("R-", ""), [windows_url, macosx_url]
+        release = version if version.count(".") >= 2 else get_r_version(version, ods_dir)
+        # Only the current Windows release is in bin/windows/base/, older ones have their own directory
+        if f"R-{release}-win.exe" not in fetch_metadata(windows_url, ods_dir):
+            windows_url = f"{windows_url}old/{release}/"
+        # Older releases are only listed in the directories of each macOS build
+        build_dirs = {urllib.parse.urljoin(macosx_url, posixpath.dirname(link) + "/")
+                      for link in HREF_PATTERN.findall(fetch_metadata(macosx_url, ods_dir))
+                      if R_VERSION_PATTERN.search(link)}
+        return release, [windows_url, *sorted(build_dirs)]
+    if product == "rstudio":
+        return (None if version == "latest" else version), [RSTUDIO_DOWNLOAD_URL]
+    raise ValueError(f"Unknown installer product {product}")
+
+def find_python_installer_release(minor_version, ods_dir=None):
+    """Return the latest release of a Python minor version that has installers, and the page listing them.
+
+    Once a Python version only gets security fixes its releases are source
+    only, so the releases are checked newest first until one lists an
+    installer for a platform in INSTALLER_MATRIX.
+
+    Keyword arguments:
+    minor_version -- Python minor version, e.g., "3.12"
+    ods_dir -- Directory whose metadata cache is used
+    """
+    url = f"{PYTHON_URL}ftp/python/"
+    releases = {release for release in PYTHON_VERSION_LINK_PATTERN.findall(fetch_metadata(url, ods_dir))
+                if release.startswith(minor_version + ".")}
+    for release in sorted(releases, key=version_key, reverse=True):
+        release_url = f"{url}{release}/"
+        page = fetch_metadata_if_exists(release_url, ods_dir)
+        if page is None:
+            continue
+        file_names = [posixpath.basename(urllib.parse.urlsplit(link).path) for link in HREF_PATTERN.findall(page)]
+        if any(get_installer_pattern(platform, release).fullmatch(file_name)
+               for platform in INSTALLER_MATRIX["python"]["platforms"] for file_name in file_names):
+            return release, [release_url]
+    raise ValueError(f"No Python {minor_version} release with installers found at {url}")
+
+def get_installer_pattern(platform, version=None):
+    """Return the regular expression matching the installer file names of a platform.
 
     Keyword arguments:
-    destination_path -- Path to save installers
+    platform -- Platform from INSTALLER_MATRIX
+    version -- Version to match (defaults to any version, captured as the "version" group)
     """
-    destination_path = Path(Path(ods_dir), Path("R"))
-    if not os.path.isdir(destination_path):
-        os.makedirs(destination_path)
+    version_pattern = re.escape(version) if version else f"(?P<version>{INSTALLER_VERSION_PATTERN})"
+    return re.compile(platform["pattern"].replace("{version}", version_pattern))
+
+def prune_installers(ods_dir, product, installers, keep=None):
+    """Delete all but the newest versions of each installer of a product.
 
-    latest_version_url = "https://cloud.r-project.org/bin/macosx/"
-    r_current_version = find_r_current_version(latest_version_url)
-    download_r_windows(r_current_version, ods_dir)
-    download_r_macosx(r_current_version, ods_dir)
+    For each platform only the keep newest versions are kept, as well as
+    the versions in installers (those in INSTALLER_MATRIX). Files not
+    matching any platform of the product are left alone. Returns the paths
+    of the deleted files.
 
+    Keyword arguments:
+    ods_dir -- Directory containing the installers
+    product -- Product in INSTALLER_MATRIX
+    installers -- Installers just downloaded, as returned by find_installers
+    keep -- Number of versions to keep (defaults to the "keep" of the product,
+            None or 0 to keep every version)
+    """
+    matrix_entry = INSTALLER_MATRIX[product]
+    if keep is None:
+        keep = matrix_entry.get("keep")
+    directory = Path(ods_dir, matrix_entry["directory"])
+    if not keep or not directory.is_dir():
+        return []
+    current = {installer["path"] for installer in installers}
+    removed = []
+    for platform in matrix_entry["platforms"]:
+        pattern = get_installer_pattern(platform)
+        versions = {}
+        for path in sorted(directory.iterdir()):
+            match = pattern.fullmatch(path.name)
+            if match and path.is_file():
+                versions.setdefault(match.group("version"), []).append(path)
+        newest = sorted(versions, key=version_key, reverse=True)[:keep]
+        for version, paths in versions.items():
+            for path in paths:
+                if version not in newest and f"{matrix_entry['directory']}/{path.name}" not in current:
+                    path.unlink()
+                    removed.append(path)
+    return removed
 
-def download_lessons(ods_dir):
+def download_lessons(ods_dir, max_workers=DEFAULT_MAX_WORKERS, host_limits=None, lesson_sources=None,
+                     engine=None, deduplicate=True):
     """Downloads the workshop lessons as rendered HTML.
+
+    Lessons are mirrored with wget or the built-in mirror_website, several at
+    the same time. The output of each download is saved in a log file and
+    lessons that failed are reported. Text files are then precompressed for
+    serve_ods_dir and files shared by several lessons are linked together by
+    deduplicate_files.
+
     Keyword arguments:
-    destination_path -- Path to save rendered HTML lessons
+    ods_dir -- Directory to save rendered HTML lessons
+    max_workers -- Maximum number of lessons to download at the same time
+    host_limits -- Dictionary mapping host names to the maximum number of lessons
+                   downloaded from that host at the same time (defaults to
+                   DEFAULT_HOST_LIMIT for hosts not listed)
+    lesson_sources -- Lessons to download (defaults to get_lesson_sources())
+    engine -- "wget" or "python" (defaults to "wget" when it is installed)
+    deduplicate -- Link identical files across lessons to save space
     """
+    if engine is None:
+        engine = "wget" if shutil.which('wget') else "python"
 
-    if not shutil.which('wget'):
+    if engine == "wget" and not shutil.which('wget'):
         warnings.warn("""wget not detected so not downloading lessons.
 
         wget needs to be installed on your computer to clone lesson websites.
@@ -132,143 +1144,633 @@ def download_lessons(ods_dir):
         """)
         return
 
-    dc_lessons = ["https://datacarpentry.org/ecology-workshop/",
-                  "https://datacarpentry.org/spreadsheet-ecology-lesson/",
-                  "http://datacarpentry.org/OpenRefine-ecology-lesson/",
-                  "https://datacarpentry.org/R-ecology-lesson/",
-                  "https://datacarpentry.org/python-ecology-lesson/",
-                  "https://datacarpentry.org/sql-ecology-lesson/"]
-    lc_lessons = ["https://librarycarpentry.org/lc-overview/",
-                  "https://librarycarpentry.org/lc-data-intro/",
-                  "https://librarycarpentry.org/lc-shell/",
-                  "https://librarycarpentry.org/lc-open-refine/",
-                  "https://librarycarpentry.org/lc-git/",
-                  ]
-
+    if lesson_sources is None:
+        lesson_sources = get_lesson_sources()
+    host_limits = dict(host_limits or {})
     lesson_path = Path(Path(ods_dir), Path("lessons"))
-    if not os.path.isdir(lesson_path):
-        os.makedirs(lesson_path)
-
-    for lesson in dc_lessons:
-        print(f"Downloading lesson from {lesson}")
-        subprocess.run(["wget", "-r", "-k", "-N", "-c", "--no-parent", "--no-host-directories",
-                        "-P", Path(lesson_path, "data-carpentry"), lesson],
-                       stdout=subprocess.DEVNULL,
-                       stderr=subprocess.STDOUT)
-        
-    for lesson in lc_lessons:
-        print(f"Downloading lesson from {lesson}")
-        subprocess.run(["wget", "-r", "-k", "-N", "-c", "--no-parent", "--no-host-directories",
-                        "-P", Path(lesson_path, "library-carpentry"), lesson],
-                       stdout=subprocess.DEVNULL,
-                       stderr=subprocess.STDOUT)
-
-    sc_lessons = ["http://swcarpentry.github.io/shell-novice",
-                  "http://swcarpentry.github.io/git-novice",
-                  "http://swcarpentry.github.io/python-novice-inflammation",
-                  "http://swcarpentry.github.io/python-novice-gapminder",
-                  "http://swcarpentry.github.io/r-novice-inflammation",
-                  "http://swcarpentry.github.io/r-novice-gapminder",
-                  "http://swcarpentry.github.io/shell-novice-es",
-                  "http://swcarpentry.github.io/git-novice-es",
-                  "http://swcarpentry.github.io/r-novice-gapminder-es"]
-
-    # Software Carpentry lessons have external CSS so requires a more expansive search & rewriting to get all necessary files
-    for lesson in sc_lessons:
-        print(f"Downloading lesson from {lesson}")
-        subprocess.run(["wget", "-p", "-r", "-k", "-N", "-c", "-E", "-H", "-D",
-                        "swcarpentry.github.io", "-K", "--no-parent", "--no-host-directories",
-                        "-P", Path(lesson_path, "software-carpentry"), lesson],
-                       stdout = subprocess.DEVNULL,
-                       stderr = subprocess.STDOUT)
-        
-    add_lesson_index_page(lesson_path)
+    log_path = Path(get_ods_state_dir(ods_dir), "logs", "lessons")
+    for path in [lesson_path, log_path]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    host_semaphores = {}
+    jobs = []
+    for source, source_info in lesson_sources.items():
+        for lesson in source_info["lessons"]:
+            host = urllib.parse.urlparse(lesson).hostname
+            if host not in host_semaphores:
+                host_semaphores[host] = threading.Semaphore(host_limits.get(host, DEFAULT_HOST_LIMIT))
+            jobs.append((source, lesson, source_info["wget_args"], host_semaphores[host]))
+
+    with stage("mirror lessons"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            if engine == "wget":
+                futures = [executor.submit(run_wget, lesson, wget_args, Path(lesson_path, source), log_path, semaphore)
+                           for source, lesson, wget_args, semaphore in jobs]
+            else:
+                crawl_state_path = Path(get_ods_state_dir(ods_dir), "cache", "lessons")
+                futures = [executor.submit(run_lesson_mirror, lesson, wget_args, Path(lesson_path, source),
+                                           log_path, semaphore, crawl_state_path)
+                           for source, lesson, wget_args, semaphore in jobs]
+            results = [future.result() for future in futures]
+
+    with stage("index lessons"):
+        add_lesson_index_page(lesson_path)
+    with stage("precompress lessons"):
+        precompress_files(lesson_path)
+    if deduplicate:
+        with stage("deduplicate lessons"):
+            saved = deduplicate_files(lesson_path)
+        if saved["files"]:
+            print(f"Linked {saved['files']} identical lesson files, "
+                  f"saving {saved['bytes_saved'] / 1e6:.1f} MB")
+
+    failures = [result for result in results if result["returncode"] not in (0, 8)]
+    for result in results:
+        if result["returncode"] == 8:
+            print(f"Some pages of {result['url']} could not be downloaded, see {result['log']}")
+    for result in failures:
+        print(f"Failed to download {result['url']}: {result['error']}, see {result['log']}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(results)} lessons failed to download")
+    return results
+
+def get_lesson_sources():
+    """Return the lessons to download, grouped by source.
+
+    Maps each source (e.g., "data-carpentry") to the wget arguments used to
+    mirror its lessons and the list of lesson URLs. Software Carpentry lessons
+    have external CSS so require a more expansive search & rewriting to get
+    all necessary files. Sources added with register_lesson_source come
+    after the packaged ones.
+    """
+    lessons_file = importlib_resources.files("offlinedatasci") / "lessons.json"
+    return {**json.loads(lessons_file.read_text()), **_registered_lesson_sources}
+
+def run_wget(url, wget_args, destination_path, log_path, semaphore):
+    """Mirror a website with wget, saving its output to a log file.
+
+    Returns a dictionary with the url, wget's return code, a description of
+    the error, the path of the log file and the number of seconds taken.
+
+    Keyword arguments:
+    url -- Link to the website
+    wget_args -- Arguments controlling how wget mirrors the website
+    destination_path -- Directory to save the website in
+    log_path -- Directory to save the log file in
+    semaphore -- Semaphore limiting the number of downloads from the same host
+    """
+    log_file_path = get_lesson_log_path(log_path, url)
+    with semaphore:
+        report_event("lesson_start", url=url, log=str(log_file_path))
+        start_time = time.perf_counter()
+        with open(log_file_path, "w") as log_file:
+            process = subprocess.run(["wget", *WGET_RETRY_ARGS, *wget_args, "-P", destination_path, url],
+                                     stdout=log_file,
+                                     stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - start_time
+    result = {"url": url,
+              "returncode": process.returncode,
+              "error": WGET_EXIT_CODES.get(process.returncode, f"exit code {process.returncode}"),
+              "log": log_file_path,
+              "seconds": seconds}
+    report_event("lesson_end", **result)
+    return result
+
+def get_lesson_log_path(log_path, url):
+    """Return the path of the log file for downloading a lesson.
+
+    Keyword arguments:
+    log_path -- Directory to save log files in
+    url -- Link to the lesson
+    """
+    file_name = re.sub(r"[^A-Za-z0-9.-]+", "_", url.split("://", 1)[-1]).strip("_")
+    return Path(log_path, file_name + ".log")
+
+def run_lesson_mirror(url, wget_args, destination_path, log_path, semaphore, crawl_state_path):
+    """Mirror a lesson with mirror_website, using the options of its wget arguments.
+
+    Returns the same dictionary as run_wget, using wget's exit codes for
+    failures: 4 if the lesson could not be downloaded at all and 8 if some
+    of its pages could not be downloaded.
+
+    Keyword arguments:
+    url -- Link to the lesson
+    wget_args -- wget arguments for the lesson, translated by get_mirror_options
+    destination_path -- Directory to save the lesson in
+    log_path -- Directory to save the log file in
+    semaphore -- Semaphore limiting the number of downloads from the same host
+    crawl_state_path -- Directory to save the validators of downloaded pages in
+    """
+    log_file_path = get_lesson_log_path(log_path, url)
+    state_path = Path(crawl_state_path, log_file_path.stem + ".json")
+    with semaphore:
+        report_event("lesson_start", url=url, log=str(log_file_path))
+        start_time = time.perf_counter()
+        with open(log_file_path, "w") as log_file:
+            try:
+                failed = mirror_website(url, destination_path, state_path=state_path,
+                                        log_file=log_file, **get_mirror_options(wget_args))
+                returncode = 8 if failed else 0
+            except Exception as e:
+                log_file.write(f"Failed to download {url}: {e}\n")
+                returncode = 4
+        seconds = time.perf_counter() - start_time
+    result = {"url": url,
+              "returncode": returncode,
+              "error": WGET_EXIT_CODES[returncode],
+              "log": log_file_path,
+              "seconds": seconds}
+    report_event("lesson_end", **result)
+    return result
+
+def get_mirror_options(wget_args):
+    """Translate wget arguments into keyword arguments for mirror_website.
+
+    Keyword arguments:
+    wget_args -- wget arguments such as those in lessons.json
+    """
+    span_domains = None
+    if "-H" in wget_args and "-D" in wget_args:
+        span_domains = wget_args[wget_args.index("-D") + 1].split(",")
+    return {"span_domains": span_domains,
+            "page_requisites": "-p" in wget_args,
+            "adjust_extension": "-E" in wget_args}
+
+def mirror_website(url, destination_path, span_domains=None, page_requisites=False,
+                   adjust_extension=False, max_depth=5, max_connections=8,
+                   state_path=None, log_file=None):
+    """Mirror a website for offline browsing without wget.
+
+    Does the job of wget -r -k -N --no-parent --no-host-directories: pages
+    below url are crawled up to max_depth links deep, saved in
+    destination_path and their links rewritten to point at the local copies.
+    Pages are requested concurrently through the shared HTTP session. When
+    state_path is given, the validators of each page are saved there and used
+    to only download pages that changed since the last run.
+
+    Returns the list of URLs that could not be downloaded. Raises an
+    exception if url itself could not be downloaded.
+
+    Keyword arguments:
+    url -- Link to the website
+    destination_path -- Directory to save the website in
+    span_domains -- Other domains to download from, like wget -H -D
+    page_requisites -- Also download images, stylesheets and scripts outside
+                       of url, like wget -p
+    adjust_extension -- Add .html/.css to file names without them, like wget -E
+    max_depth -- Maximum number of links to follow from url
+    max_connections -- Maximum number of requests at the same time
+    state_path -- JSON file to save page validators in
+    log_file -- File to write the status of each URL to
+    """
+    return asyncio.run(crawl_website(url, Path(destination_path), span_domains, page_requisites,
+                                     adjust_extension, max_depth, max_connections,
+                                     state_path, log_file))
+
+async def crawl_website(start_url, destination_path, span_domains, page_requisites,
+                        adjust_extension, max_depth, max_connections, state_path, log_file):
+    """Crawl a website for mirror_website, see its documentation for the arguments."""
+    loop = asyncio.get_running_loop()
+    state = {}
+    if state_path is not None and Path(state_path).exists():
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+    new_state = {}
+    allowed_hosts = [urllib.parse.urlparse(start_url).hostname] + list(span_domains or [])
+    connections = asyncio.Semaphore(max_connections)
+    mirrored = {}
+    fresh_pages = []
+    failed = []
+    seen = set()
+    parent_path = []
+
+    def mark_seen(url):
+        # A directory and its index.html are the same page
+        seen.add(url)
+        if url.endswith("/"):
+            seen.add(url + "index.html")
+
+    def is_allowed(link, requisite, depth):
+        parsed = urllib.parse.urlparse(link)
+        if parsed.scheme not in ("http", "https") or not any(
+                parsed.hostname == host or (parsed.hostname or "").endswith("." + host)
+                for host in allowed_hosts):
+            return False
+        if requisite and page_requisites:
+            return True
+        return depth <= max_depth and parsed.path.startswith(parent_path[0])
+
+    async def visit(url, depth, requisite):
+        try:
+            async with connections:
+                page = await loop.run_in_executor(executor, fetch_website_page, url, destination_path,
+                                                  state.get(url), adjust_extension)
+        except Exception as e:
+            if log_file is not None:
+                log_file.write(f"{url}: {e}\n")
+            if depth == 0:
+                raise
+            failed.append(url)
+            return
+        if log_file is not None:
+            log_file.write(f"{url}: {page['status']} {page['path']}\n")
+        new_state[url] = {key: page[key] for key in ["url", "path", "links", "etag", "last_modified"]}
+        for mirrored_url in {url, page["url"]}:
+            mirrored[mirrored_url] = page["path"]
+            if mirrored_url.endswith("/"):
+                mirrored[mirrored_url + "index.html"] = page["path"]
+        if page["status"] != 304:
+            fresh_pages.append(page)
+        if depth == 0:
+            parent_path.append(urllib.parse.urlparse(page["url"]).path.rsplit("/", 1)[0] + "/")
+        mark_seen(page["url"])
+        if requisite and not page["path"].endswith(".css"):
+            return
+        children = []
+        for link, link_requisite in page["links"]:
+            if link not in seen and is_allowed(link, link_requisite, depth + 1):
+                mark_seen(link)
+                children.append(visit(link, depth + 1, link_requisite))
+        await asyncio.gather(*children)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_connections) as executor:
+        mark_seen(start_url)
+        await visit(start_url, 0, False)
+
+    for page in fresh_pages:
+        rewrite_page_links(Path(destination_path, page["path"]), page["url"], page["path"], mirrored)
+    if state_path is not None:
+        write_json_atomically(state_path, new_state)
+    return failed
+
+def fetch_website_page(url, destination_path, previous, adjust_extension):
+    """Download one page of a website for mirror_website.
+
+    Sends a conditional request if the page was downloaded before and is
+    still on disk. Returns a dictionary with the final "url" after
+    redirects, the HTTP "status", the local "path", the "links" found in
+    the page and its "etag" and "last_modified" validators.
+
+    Keyword arguments:
+    url -- Link to the page
+    destination_path -- Directory the website is saved in
+    previous -- What this function returned for url in the last run, or None
+    adjust_extension -- Add .html/.css to file names without them
+    """
+    headers = {}
+    if previous is not None and Path(destination_path, previous["path"]).exists():
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+    response = get_session().get(url, headers=headers)
+    if response.status_code == 304 and headers:
+        return dict(previous, status=304)
+    response.raise_for_status()
+
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+    relative_path = get_mirror_path(response.url, content_type, adjust_extension)
+    local_path = Path(destination_path, relative_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = Path(f"{local_path}.{threading.get_ident()}.tmp")
+    temporary_path.write_bytes(response.content)
+    os.replace(temporary_path, local_path)
+    last_modified = response.headers.get("Last-Modified")
+    if last_modified:
+        modified_time = email.utils.parsedate_to_datetime(last_modified).timestamp()
+        os.utime(local_path, (modified_time, modified_time))
+
+    links = []
+    if content_type == "text/html":
+        links = find_html_links(response.text, response.url)
+    elif content_type == "text/css":
+        links = [(link, True) for link in find_css_links(response.text, response.url)]
+    return {"url": response.url,
+            "status": response.status_code,
+            "path": relative_path,
+            "links": links,
+            "etag": response.headers.get("ETag"),
+            "last_modified": last_modified}
+
+def get_mirror_path(url, content_type, adjust_extension):
+    """Return the local path, relative to the mirror directory, of a URL.
+
+    Keyword arguments:
+    url -- Link to the page
+    content_type -- MIME type of the page
+    adjust_extension -- Add .html/.css to file names without them
+    """
+    path = urllib.parse.unquote(urllib.parse.urlparse(url).path)
+    if path.endswith("/") or not path:
+        path += "index.html"
+    path = posixpath.normpath("/" + path).lstrip("/")
+    if adjust_extension:
+        if content_type == "text/html" and not re.search(r"\.html?$", path, re.IGNORECASE):
+            path += ".html"
+        elif content_type == "text/css" and not path.lower().endswith(".css"):
+            path += ".css"
+    return path
+
+def find_html_links(html, page_url):
+    """Return the links in an HTML page as (url, is_page_requisite) tuples.
+
+    Keyword arguments:
+    html -- Text of the page
+    page_url -- Link to the page, used to resolve relative links
+    """
+    soup = bs.BeautifulSoup(html, 'lxml')
+    base = soup.find("base", href=True)
+    base_url = urllib.parse.urljoin(page_url, base["href"]) if base else page_url
+    links = []
+    for tag_name, attribute in LINK_ATTRIBUTES:
+        for tag in soup.find_all(tag_name, attrs={attribute: True}):
+            link = urllib.parse.urljoin(base_url, tag[attribute].strip())
+            links.append((urllib.parse.urldefrag(link)[0], tag_name != "a"))
+    for style in soup.find_all("style"):
+        links.extend((link, True) for link in find_css_links(style.get_text(), base_url))
+    return links
+
+def find_css_links(css, stylesheet_url):
+    """Return the URLs of the files referenced by a stylesheet.
+
+    Keyword arguments:
+    css -- Text of the stylesheet
+    stylesheet_url -- Link to the stylesheet, used to resolve relative links
+    """
+    return [urllib.parse.urldefrag(urllib.parse.urljoin(stylesheet_url, match.group(2)))[0]
+            for match in CSS_URL_PATTERN.finditer(css)
+            if not match.group(2).startswith("data:")]
+
+def rewrite_page_links(local_path, page_url, page_path, mirrored):
+    """Rewrite the links of a downloaded page so that it works offline.
+
+    Links to mirrored URLs become relative links to the local copies and
+    other relative links become absolute, like wget -k.
+
+    Keyword arguments:
+    local_path -- Path of the downloaded page
+    page_url -- Link the page was downloaded from
+    page_path -- Path of the page relative to the mirror directory
+    mirrored -- Dictionary mapping mirrored URLs to their paths relative to the mirror directory
+    """
+    page_dir = posixpath.dirname(page_path)
+
+    def convert(link, base_url):
+        if link.startswith(("#", "data:", "mailto:", "javascript:")):
+            return link
+        absolute_link, fragment = urllib.parse.urldefrag(urllib.parse.urljoin(base_url, link))
+        if absolute_link in mirrored:
+            relative_link = posixpath.relpath(mirrored[absolute_link], page_dir or ".")
+            return relative_link + ("#" + fragment if fragment else "")
+        return urllib.parse.urljoin(base_url, link)
+
+    def convert_css(css, base_url):
+        return CSS_URL_PATTERN.sub(
+            lambda match: match.group(0).replace(match.group(2), convert(match.group(2), base_url)), css)
+
+    if local_path.suffix.lower() == ".css":
+        local_path.write_text(convert_css(local_path.read_text(errors="replace"), page_url))
+        return
+    if local_path.suffix.lower() not in (".html", ".htm"):
+        return
+    soup = bs.BeautifulSoup(local_path.read_bytes(), 'lxml')
+    base = soup.find("base", href=True)
+    base_url = urllib.parse.urljoin(page_url, base["href"]) if base else page_url
+    if base is not None:
+        base.decompose()
+    for tag_name, attribute in LINK_ATTRIBUTES:
+        for tag in soup.find_all(tag_name, attrs={attribute: True}):
+            tag[attribute] = convert(tag[attribute].strip(), base_url)
+    for style in soup.find_all("style"):
+        style.string = convert_css(style.get_text(), base_url)
+    local_path.write_text(str(soup), encoding="utf-8")
 
 def download_rstudio(ods_dir):
-    """Download RStudio installers"""
-    baseurl = 'https://www.rstudio.com/products/rstudio/download/#download'
-    destination_path = Path(Path(ods_dir), Path("rstudio"))
-    if not os.path.isdir(destination_path):
-        os.makedirs(destination_path)
-    fp = requests.get(baseurl)
-    web_content = fp.content
-    soup = bs.BeautifulSoup(web_content, 'lxml')
-    links = soup.find_all('a')
-    for link in links:
-        if link.has_attr('href') and (".exe" in link['href'] or ".dmg" in link['href']):
-            url = str(link['href'])
-            download_and_save_installer(url, Path(Path(destination_path), Path(os.path.basename(url))))
+    """Download the RStudio installers in INSTALLER_MATRIX.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers
+    """
+    download_installer_matrix(ods_dir, ["rstudio"])
 
 def download_python(ods_dir):
-    """Download Python installers
+    """Download the Python installers in INSTALLER_MATRIX.
 
     Keyword arguments:
     ods_dir -- Directory to save installers
     """
-    version = get_python_version()
-    download_urls = [f"https://www.python.org/ftp/python/{version}/python-{version}.exe",
-                     f"https://www.python.org/ftp/python/{version}/python-{version}-amd64.exe",
-                     f"https://www.python.org/ftp/python/{version}/python-{version}-arm64.exe",
-                     f"https://www.python.org/ftp/python/{version}/python-{version}-macos11.pkg"
-    ]
-    #TODO: dynamically check for macos version (at some point it won't be macos11)
-
-    destination_path = Path(Path(ods_dir), Path("python"))
-    if not os.path.isdir(destination_path):
-        os.makedirs(destination_path)
-    for url in download_urls:
-        destination_path2 = Path(Path(destination_path), Path(os.path.basename(url)))
-        download_and_save_installer(url, destination_path2)
-
-def find_r_current_version(url):
+    download_installer_matrix(ods_dir, ["python"])
+
+def record_python_checksums(ods_dir, version, installers):
+    """Record the checksums python.org publishes for the installers of a Python release.
+
+    Keyword arguments:
+    ods_dir -- Directory containing the installers
+    version -- Python release, e.g., "3.12.10"
+    installers -- Installers of the release, as returned by find_installers
+    """
+    try:
+        checksums = get_python_checksums(version, ods_dir)
+    except Exception as e:
+        warnings.warn(f"Could not get checksums for Python {version}: {e}")
+    else:
+        record_upstream_checksums(ods_dir, {
+            installer["path"]: checksums[posixpath.basename(installer["path"])]
+            for installer in installers if posixpath.basename(installer["path"]) in checksums})
+
+def fetch_metadata(url, ods_dir=None, ttl=METADATA_CACHE_TTL):
+    """Return the text of an index page, requesting it at most once per run.
+
+    See iter_metadata_lines for how pages are cached.
+
+    Keyword arguments:
+    url -- Link to the index page
+    ods_dir -- Directory holding the on disk cache (no disk cache if None)
+    ttl -- Number of seconds a cached page is used without revalidating it
+    """
+    with contextlib.closing(iter_metadata_lines(url, ods_dir, ttl)) as lines:
+        return "\n".join(lines)
+
+def fetch_metadata_if_exists(url, ods_dir=None):
+    """Return the text of an index page like fetch_metadata, or None if the page does not exist (404).
+
+    Keyword arguments:
+    url -- Link to the index page
+    ods_dir -- Directory holding the on disk cache (no disk cache if None)
+    """
+    try:
+        return fetch_metadata(url, ods_dir)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        return None
+
+def iter_metadata_lines(url, ods_dir=None, ttl=METADATA_CACHE_TTL):
+    """Yield the lines of an index page, requesting it at most once per run.
+
+    Pages are also cached on disk in ods_dir along with their ETag and
+    Last-Modified validators. A cached page younger than ttl seconds is used
+    without any request, older pages are revalidated with a conditional
+    request and only downloaded again if they changed.
+
+    The page is streamed, so callers can stop parsing as soon as they found
+    what they need. The rest of the page is then still read and cached when
+    the generator is closed, so only complete pages are ever cached. Callers
+    that stop early should close the generator, e.g. with contextlib.closing.
+
+    Keyword arguments:
+    url -- Link to the index page
+    ods_dir -- Directory holding the on disk cache (no disk cache if None)
+    ttl -- Number of seconds a cached page is used without revalidating it
+    """
+    with _session_lock:
+        url_lock = _metadata_locks.setdefault(url, threading.RLock())
+    with url_lock:
+        cache_path = None
+        if ods_dir is not None:
+            cache_key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+            cache_path = Path(get_ods_state_dir(ods_dir), "cache", "metadata", cache_key + ".json")
+
+        response = None
+        entry = _metadata_cache.get(url)
+        if entry is None:
+            if cache_path is not None and cache_path.exists():
+                with open(cache_path) as cache_file:
+                    entry = json.load(cache_file)
+                if not entry.get("complete"):
+                    entry = None
+            if entry is None or time.time() - entry["fetched"] >= ttl:
+                headers = {}
+                if entry is not None and entry.get("etag"):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry is not None and entry.get("last_modified"):
+                    headers["If-Modified-Since"] = entry["last_modified"]
+                response = get_session().get(url, headers=headers, stream=True)
+                if response.status_code == 304 and entry is not None:
+                    response.close()
+                    response = None
+                    entry["fetched"] = time.time()
+                    save_metadata_entry(entry, cache_path)
+                else:
+                    response.raise_for_status()
+            else:
+                _metadata_cache[url] = entry
+        if response is None:
+            yield from entry["lines"]
+            return
+
+        entry = {"url": url,
+                 "etag": response.headers.get("ETag"),
+                 "last_modified": response.headers.get("Last-Modified"),
+                 "fetched": time.time(),
+                 "lines": [],
+                 "complete": False}
+        with response:
+            if response.encoding is None:
+                response.encoding = "utf-8"
+            lines = response.iter_lines(decode_unicode=True)
+            try:
+                for line in lines:
+                    entry["lines"].append(line)
+                    yield line
+            except GeneratorExit:
+                # Read the rest of the page so that later callers do not request it again
+                try:
+                    entry["lines"].extend(lines)
+                except requests.RequestException:
+                    raise GeneratorExit
+                save_metadata_entry(entry, cache_path)
+                raise
+            save_metadata_entry(entry, cache_path)
+
+def save_metadata_entry(entry, cache_path=None):
+    """Mark a completely read index page as cached for the rest of the run and on disk.
+
+    Keyword arguments:
+    entry -- Cache entry of the page, as built by iter_metadata_lines
+    cache_path -- Path of the on disk cache entry (no disk cache if None)
+    """
+    entry["complete"] = True
+    _metadata_cache[entry["url"]] = entry
+    if cache_path is not None:
+        write_json_atomically(cache_path, entry)
+
+def clear_metadata_cache():
+    """Forget the index pages fetched during this run."""
+    with _session_lock:
+        _metadata_cache.clear()
+
+def get_session():
+    """Return the pooled HTTP session shared by all downloads in this run.
+
+    Every request made with it follows the fetch policy (see fetch.FetchSession).
+    """
+    return _fetch.get_session()
+
+def get_ods_state_dir(ods_dir):
+    """Return the directory holding offlinedatasci's own bookkeeping files.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    """
+    return Path(Path(ods_dir), Path(".offlinedatasci"))
+
+def write_json_atomically(path, data):
+    """Write data as JSON so that path is never left half written.
+
+    Keyword arguments:
+    path -- Path of the JSON file
+    data -- JSON serializable data to write
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = Path(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temporary_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temporary_path, path)
+
+def find_r_current_version(url, ods_dir=None):
     """Determine the most recent version of R from CRAN
 
     Keyword arguments:
     url -- CRAN r-project URL
+    ods_dir -- Directory holding the index page cache
     """
-    version_regex = "(R\-\d+\.\d+\.\d)+\-(?:x86_64|arm64|win)\.(?:exe|pkg)"
-    urlfile = requests.get(url)
-    for line in urlfile:
-        decoded = line.decode("utf-8") 
-        match = re.findall(version_regex, decoded)
-        if (match):
-            r_current_version = match[0].strip(".exe").strip(".pkg")
-            return r_current_version
-    return None
+    with contextlib.closing(iter_metadata_lines(url, ods_dir)) as lines:
+        return parse_r_version(lines)
 
-def download_r_windows(r_current_version, ods_dir):
-    """Download the most recent version of R installer for Windows from CRAN.
+def get_r_version(minor_version, ods_dir=None):
+    """Determine the latest release of an R minor version from CRAN.
+
+    The current release is listed in bin/windows/base/ and earlier ones in
+    bin/windows/base/old/.
 
     Keyword arguments:
-    r_current_version -- The most recent version of R
-    ods_dir -- Directory to save R installers
+    minor_version -- R minor version to find the latest release of, e.g., "4.4"
+    ods_dir -- Directory holding the index page cache
     """
-    baseurl = "https://cloud.r-project.org/bin/windows/base/"
-    download_path = baseurl + r_current_version + "-win.exe"
-    destination_path = Path(Path(ods_dir), Path("R"), Path(r_current_version + "-win.exe"))
-    if not os.path.exists(destination_path):
-        print("****Downloading file: ", destination_path)
-        urllib.request.urlretrieve(download_path, destination_path)
+    url = f"{CRAN_URL}bin/windows/base/"
+    versions = [match.replace("R-", "") for match in R_VERSION_PATTERN.findall(fetch_metadata(url, ods_dir))]
+    versions += R_OLD_VERSION_LINK_PATTERN.findall(fetch_metadata(f"{url}old/", ods_dir))
+    versions = [version for version in versions if version.startswith(minor_version + ".")]
+    if not versions:
+        raise ValueError(f"No R {minor_version} release found at {url}")
+    return max(versions, key=version_key)
 
-def download_r_macosx(r_current_version, ods_dir):
-    """Download the most recent version of R installer for MacOSX from CRAN.
+def parse_r_version(lines):
+    """Return the first R version linked from a CRAN page, or None.
+
+    Stops reading lines as soon as a version is found.
 
     Keyword arguments:
-    r_current_version -- The most recent version of R
-    ods_dir -- Directory to save R installers
+    lines -- Iterable of lines of a CRAN bin page
     """
-    baseurl = "https://cloud.r-project.org/bin/macosx/"
-    download_path_arm64 = baseurl + "big-sur-arm64/base/" + r_current_version + "-arm64.pkg"
-    destination_path_arm64 = Path(Path(ods_dir), Path("R"), Path(r_current_version + "-arm64.pkg"))
-    if not os.path.exists(destination_path_arm64):
-        print("****Downloading file: ", destination_path_arm64)
-        urllib.request.urlretrieve(download_path_arm64, destination_path_arm64)
-
-    download_path_x86_64 = baseurl + "big-sur-x86_64/base/" + r_current_version + "-x86_64.pkg"
-    destination_path_x86_64 = Path(Path(ods_dir), Path("R"), Path(r_current_version + "-x86_64.pkg"))
-    if not os.path.exists(destination_path_x86_64):
-        print("****Downloading file: ", destination_path_x86_64)
-        urllib.request.urlretrieve(download_path_x86_64, destination_path_x86_64)
+    for line in lines:
+        match = R_VERSION_PATTERN.search(line)
+        if match:
+            return match.group(1)
+    return None
 
 def get_ods_dir(directory=Path.home()):
     """Get path to save downloads, create if it does not exist.
@@ -282,15 +1784,59 @@ def get_ods_dir(directory=Path.home()):
         Path.mkdir(folder_path, parents=True)
     return str(folder_path)
 
-def get_python_version(minor_version = "3.12"):
-    """Determine the Python version from the Python homepage."""
-    url = "https://www.python.org/ftp/python/"
-    response = requests.get(url)
-    soup = bs.BeautifulSoup(response.text, 'html.parser')
-    versions = [a.text for a in soup.find_all('a') if a.text.startswith(minor_version)]
-    latest_version = sorted(versions, reverse=True)[0].strip('/')
+def get_python_version(minor_version = "3.12", ods_dir = None):
+    """Determine the Python version from the Python homepage.
+
+    Keyword arguments:
+    minor_version -- Python minor version to find the latest release of
+    ods_dir -- Directory holding the index page cache
+    """
+    url = f"{PYTHON_URL}ftp/python/"
+    with contextlib.closing(iter_metadata_lines(url, ods_dir)) as lines:
+        latest_version = parse_python_version(lines, minor_version)
+    if latest_version is None:
+        raise ValueError(f"No Python {minor_version} release found at {url}")
+    return latest_version
+
+def parse_python_version(lines, minor_version):
+    """Return the latest release of minor_version listed in the python.org FTP index.
+
+    Versions are compared numerically. The listing is sorted by name so reading
+    stops at the first entry after the releases of minor_version.
+
+    Keyword arguments:
+    lines -- Iterable of lines of the python.org FTP index
+    minor_version -- Python minor version, e.g., "3.12"
+    """
+    prefix = minor_version + "."
+    latest_version = None
+    for line in lines:
+        for version in PYTHON_VERSION_LINK_PATTERN.findall(line):
+            if version.startswith(prefix):
+                if latest_version is None or version_key(version) > version_key(latest_version):
+                    latest_version = version
+            elif latest_version is not None:
+                return latest_version
     return latest_version
 
+def get_python_releases(ods_dir=None):
+    """Return the Python releases the versions in INSTALLER_MATRIX refer to.
+
+    Keyword arguments:
+    ods_dir -- Directory holding the index page cache
+    """
+    releases = [find_installer_release("python", version, ods_dir)[0]
+                for version in INSTALLER_MATRIX["python"]["versions"]]
+    return sorted(set(releases), key=version_key)
+
+def version_key(version):
+    """Return a key that sorts dotted version strings numerically.
+
+    Keyword arguments:
+    version -- Version string such as "3.12.10"
+    """
+    return tuple(int(part) for part in re.findall(r"\d+", version))
+
 def table_parse_version_info(row,oscolnum,hrefcolnum):
     """Parse and return software information from table.
 
@@ -308,14 +1854,21 @@ def table_parse_version_info(row,oscolnum,hrefcolnum):
     return {"osver": os, "version": link_inner_html, "url": link_url}        
 
 def download_r_packages(ods_dir,
-                      py_library_reqs = ["tidyverse", "RSQLite"],
-                      r_version = None):
+                      py_library_reqs = DEFAULT_R_PACKAGES,
+                      r_version = None,
+                      engine = None):
     """Creating partial CRAN mirror of workshop libraries.
 
     Keyword arguments:
     ods_dir -- Directory to create CRAN mirror
+    py_library_reqs -- Names of the R packages to mirror
+    r_version -- R version to mirror binary packages for (defaults to the latest release)
+    engine -- "r" to use the miniCRAN R package, "python" to build the mirror
+              without R (defaults to "r" when Rscript is available)
     """
-    if not shutil.which('Rscript'):
+    if engine is None:
+        engine = "r" if shutil.which('Rscript') else "python"
+    if engine == "r" and not shutil.which('Rscript'):
         warnings.warn("""Rscript not detected so not installing miniCRAN.
 
         R needs to be installed on your computer to clone lesson websites.
@@ -325,33 +1878,175 @@ def download_r_packages(ods_dir,
         return
     
     if r_version is None:
-        r_version = find_r_current_version("https://cloud.r-project.org/bin/windows/base/")
+        r_version = find_r_current_version(f"{CRAN_URL}bin/windows/base/", ods_dir)
     
     r_major_minor_version_nums = r_version.replace('R-', '').split('.')
     r_major_minor_version = '.'.join(r_major_minor_version_nums[:2])
 
-    minicranpath = importlib_resources.files("offlinedatasci") / "miniCran.R"
-    custom_library_string = ' '.join(py_library_reqs)
-    subprocess.run(["Rscript", minicranpath, ods_dir, custom_library_string, r_major_minor_version])
+    if engine == "python":
+        mirror_cran_packages(ods_dir, py_library_reqs, r_major_minor_version)
+    else:
+        minicranpath = importlib_resources.files("offlinedatasci") / "miniCran.R"
+        custom_library_string = ' '.join(py_library_reqs)
+        subprocess.run(["Rscript", minicranpath, ods_dir, custom_library_string, r_major_minor_version,
+                        CRAN_URL])
+    precompress_files(Path(ods_dir, "miniCRAN"))
+    try:
+        record_cran_checksums(ods_dir)
+    except Exception as e:
+        warnings.warn(f"Could not get checksums for CRAN packages: {e}")
+
+def mirror_cran_packages(ods_dir, packages, r_version, types = None,
+                         max_workers = DEFAULT_MAX_WORKERS):
+    """Create or update the miniCRAN mirror without R.
+
+    Fetches the CRAN PACKAGES index of each repository type once, solves the
+    dependencies of the packages in Python, downloads the missing files of
+    all types at the same time and writes the PACKAGES and PACKAGES.gz
+    indexes of the mirror.
+
+    Keyword arguments:
+    ods_dir -- Directory to create CRAN mirror
+    packages -- Names of the R packages to mirror
+    r_version -- Major and minor R version to mirror binary packages for, e.g., "4.4"
+    types -- Repository types to mirror (defaults to all of CRAN_REPO_TYPES)
+    max_workers -- Maximum number of downloads to run at the same time
+    """
+    if types is None:
+        types = list(CRAN_REPO_TYPES)
+    minicran_path = Path(Path(ods_dir), Path("miniCRAN"))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        repo_dirs = {repo_type: CRAN_REPO_TYPES[repo_type][0].format(r_version=r_version)
+                     for repo_type in types}
+        with stage("CRAN indexes"):
+            indexes = {repo_type: executor.submit(get_cran_packages_index, repo_dir, ods_dir)
+                       for repo_type, repo_dir in repo_dirs.items()}
+            indexes = {repo_type: index.result() for repo_type, index in indexes.items()}
+
+        with stage("download R packages"):
+            downloads = []
+            mirrored_records = {}
+            for repo_type, repo_dir in repo_dirs.items():
+                extension = CRAN_REPO_TYPES[repo_type][1]
+                local_repo_path = Path(minicran_path, repo_dir)
+                local_repo_path.mkdir(parents=True, exist_ok=True)
+                records = resolve_r_dependencies(packages, indexes[repo_type])
+                mirrored_records[repo_type] = records
+                for record in records:
+                    file_name = f"{record['Package']}_{record['Version']}{extension}"
+                    if not Path(local_repo_path, file_name).exists():
+                        downloads.append(executor.submit(download_and_save_installer,
+                                                         f"{CRAN_URL}{repo_dir}/{file_name}",
+                                                         Path(local_repo_path, file_name)))
+            for future in downloads:
+                future.result()
+
+    for repo_type, repo_dir in repo_dirs.items():
+        write_cran_packages_index(Path(minicran_path, repo_dir),
+                                  mirrored_records[repo_type],
+                                  CRAN_REPO_TYPES[repo_type][1])
+
+def get_cran_packages_index(repo_dir, ods_dir=None):
+    """Return the records of a CRAN PACKAGES index keyed by package name.
+
+    Keyword arguments:
+    repo_dir -- Path of the repository relative to the CRAN root, e.g., "src/contrib"
+    ods_dir -- Directory holding the index page cache
+    """
+    with contextlib.closing(iter_metadata_lines(f"{CRAN_URL}{repo_dir}/PACKAGES", ods_dir)) as lines:
+        return {record["Package"]: record for record in parse_dcf(lines)}
+
+def resolve_r_dependencies(packages, index):
+    """Return the index records of packages and everything they depend on.
 
+    Follows the Depends, Imports and LinkingTo fields, like miniCRAN's pkgDep
+    with suggests = FALSE. Packages included with R are left out.
+
+    Keyword arguments:
+    packages -- Names of the R packages
+    index -- CRAN PACKAGES index as returned by get_cran_packages_index
+    """
+    records = {}
+    to_visit = list(packages)
+    while to_visit:
+        package = to_visit.pop()
+        if package in records or package in R_BASE_PACKAGES:
+            continue
+        if package not in index:
+            warnings.warn(f"R package {package} is not available from CRAN")
+            continue
+        records[package] = index[package]
+        for field in ["Depends", "Imports", "LinkingTo"]:
+            for dependency in index[package].get(field, "").split(","):
+                dependency = re.sub(r"\(.*?\)", "", dependency).strip()
+                if dependency:
+                    to_visit.append(dependency)
+    return [records[package] for package in sorted(records)]
+
+def write_cran_packages_index(repo_path, records, extension):
+    """Write the PACKAGES and PACKAGES.gz indexes of a local CRAN repository.
+
+    Packages already in the index are kept unless one of records replaces them,
+    in which case the file of the older version is removed.
+
+    Keyword arguments:
+    repo_path -- Directory of the local repository
+    records -- CRAN PACKAGES records of the packages added to the repository
+    extension -- File extension of packages in this repository, e.g., ".zip"
+    """
+    repo_path = Path(repo_path)
+    packages_path = Path(repo_path, "PACKAGES")
+    existing_records = {}
+    if packages_path.exists():
+        with open(packages_path) as packages_file:
+            existing_records = {record["Package"]: record for record in parse_dcf(packages_file)}
+    for record in records:
+        previous = existing_records.get(record["Package"])
+        if previous is not None and previous["Version"] != record["Version"]:
+            old_file = Path(repo_path, f"{previous['Package']}_{previous['Version']}{extension}")
+            if old_file.exists():
+                old_file.unlink()
+        existing_records[record["Package"]] = record
+    packages_text = "\n".join(
+        "".join(f"{field}: {value}\n" for field, value in record.items())
+        for package, record in sorted(existing_records.items())
+        if Path(repo_path, f"{package}_{record['Version']}{extension}").exists())
+    write_if_changed(packages_path, packages_text)
+    with gzip.open(Path(repo_path, "PACKAGES.gz.tmp"), "wt") as packages_gz:
+        packages_gz.write(packages_text)
+    os.replace(Path(repo_path, "PACKAGES.gz.tmp"), Path(repo_path, "PACKAGES.gz"))
 
-def download_python_packages(ods_dir,py_library_reqs = [ "matplotlib", "notebook","numpy", "pandas"] ):
+def download_python_packages(ods_dir,py_library_reqs = DEFAULT_PYTHON_PACKAGES,
+                             platforms = None, python_versions = None,
+                             max_workers = DEFAULT_MAX_WORKERS):
     """Creating partial PyPI mirror of workshop libraries.
 
+    pip resolves the packages for every platform and Python version at the
+    same time. Files shared between platforms, such as pure Python wheels,
+    are downloaded once. Only files not already in the mirror are downloaded
+    and only the index pages of projects with new files are written again.
+    Unfinished downloads are kept in the state directory, not in
+    pythonlibraries, so an interrupted run cannot break the mirror.
+
     Keyword arguments:
     ods_dir -- Directory to save partial Pypi mirror
+    py_library_reqs -- Names of the packages to mirror
+    platforms -- pip platform tags to mirror (defaults to PYTHON_PACKAGE_PLATFORMS)
+    python_versions -- Python versions to mirror (defaults to the Python releases in INSTALLER_MATRIX)
+    max_workers -- Maximum number of resolves and downloads to run at the same time
     """
-    python_version = get_python_version()
+    if python_versions is None:
+        python_versions = get_python_releases(ods_dir)
+    if platforms is None:
+        platforms = PYTHON_PACKAGE_PLATFORMS
     download_dir = Path(Path(ods_dir), Path("pythonlibraries"))
     pypi_dir = Path(Path(ods_dir), Path("pypi"))
-    parameters = {
-        'pip': 'pip3',
-        'dest': download_dir,
-        'pkgs': py_library_reqs,
-        'python_version': python_version,
-        'allow_binary': True
-    }
-    if sys.platform == 'win32':
+    staging_dir = Path(get_ods_state_dir(ods_dir), "partial", "pythonlibraries")
+    if not os.path.isdir(download_dir):
+        os.makedirs(download_dir)
+    # Earlier versions left unfinished downloads in download_dir, which pypi_mirror cannot read
+    remove_partial_files(download_dir)
+    if sys.platform == 'win32' and any(platform != 'win_amd64' for platform in platforms):
         # pip download does not currently work for other OSs on Windows
         # Therefore we don't download mac and Linux packages on Windows
         # See https://github.com/pypa/pip/issues/11664
@@ -360,30 +2055,802 @@ def download_python_packages(ods_dir,py_library_reqs = [ "matplotlib", "notebook
         pip cannot currently download macos and Linux packages on Windows.
         See https://github.com/pypa/pip/issues/11664
         """)
+        platforms = ['win_amd64']
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        if pip_supports_report():
+            with stage("resolve Python packages"):
+                resolves = [executor.submit(resolve_python_packages, py_library_reqs, platform, python_version)
+                            for platform in platforms for python_version in python_versions]
+                package_files = {}
+                for future in resolves:
+                    for package_file in future.result():
+                        package_files.setdefault(package_file["filename"], package_file)
+            new_files = [package_file for filename, package_file in sorted(package_files.items())
+                         if not Path(download_dir, filename).exists()]
+            remove_partial_files(staging_dir, keep=[package_file["filename"] for package_file in new_files])
+            downloads = [functools.partial(download_python_package_file, package_file, download_dir,
+                                           staging_dir)
+                         for package_file in new_files]
+        else:
+            # pip is too old to report what it would install, so let it download everything
+            downloads = [functools.partial(pypi_mirror.download, pip='pip3', dest=download_dir,
+                                           pkgs=py_library_reqs, index_url=PYPI_INDEX_URL,
+                                           platform=[platform], python_version=python_version,
+                                           allow_binary=True)
+                         for platform in platforms for python_version in python_versions]
+        with stage("download Python packages"):
+            for future in [executor.submit(download) for download in downloads]:
+                future.result()
+    with stage("update PyPI mirror"):
+        update_pypi_mirror(download_dir, pypi_dir)
+        precompress_files(pypi_dir)
+
+@functools.lru_cache(maxsize=None)
+def pip_supports_report(pip="pip3"):
+    """Check whether pip can report what it would install (pip 22.2 or later).
+
+    Keyword arguments:
+    pip -- pip executable to check
+    """
+    output = subprocess.run([pip, "--version"], check=True, capture_output=True, text=True).stdout
+    return version_key(output.split()[1]) >= version_key("22.2")
+
+def resolve_python_packages(packages, platform, python_version, pip="pip3"):
+    """Return the files pip would install for packages on a platform.
+
+    Uses pip's installation report so nothing is downloaded except package metadata.
+    Returns a list of dictionaries with the "url", "filename" and "sha256" of each file.
+
+    Keyword arguments:
+    packages -- Names of the packages to resolve
+    platform -- pip platform tag, e.g., "win_amd64"
+    python_version -- Python version to resolve wheels for
+    pip -- pip executable to use
+    """
+    with tempfile.TemporaryDirectory() as report_dir:
+        report_path = Path(report_dir, "report.json")
+        index_args = ["--index-url", PYPI_INDEX_URL] if PYPI_INDEX_URL else []
+        subprocess.run([pip, "install", "--dry-run", "--ignore-installed", "--quiet",
+                        "--report", report_path, "--target", Path(report_dir, "target"),
+                        "--only-binary", ":all:", "--platform", platform,
+                        "--python-version", python_version, *index_args, *packages],
+                       check=True)
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+    package_files = []
+    for item in report["install"]:
+        download_info = item["download_info"]
+        hashes = download_info.get("archive_info", {}).get("hashes", {})
+        url = download_info["url"]
+        package_files.append({"url": url,
+                              "filename": urllib.parse.unquote(url.rsplit("/", 1)[-1]),
+                              "sha256": hashes.get("sha256")})
+    return package_files
+
+def download_python_package_file(package_file, download_dir, staging_dir=None):
+    """Download a file resolved by resolve_python_packages and check its SHA-256.
+
+    Keyword arguments:
+    package_file -- Dictionary with the "url", "filename" and "sha256" of the file
+    download_dir -- Directory to save the file
+    staging_dir -- Directory to download the file to before it is checked and
+                   moved to download_dir (defaults to download_dir)
+    """
+    if staging_dir is None:
+        staging_dir = download_dir
+    os.makedirs(staging_dir, exist_ok=True)
+    destination_path = Path(staging_dir, package_file["filename"])
+    if package_file["url"].startswith("file:"):
+        source_path = urllib.request.url2pathname(urllib.parse.urlparse(package_file["url"]).path)
+        with track_transfer(package_file["url"], destination_path, os.path.getsize(source_path)) as transfer:
+            shutil.copyfile(source_path, str(destination_path) + ".part")
+            os.replace(str(destination_path) + ".part", destination_path)
+            report_transfer_progress(transfer, os.path.getsize(destination_path))
     else:
-        pypi_mirror.download(platform = ['manylinux_2_17_x86_64'], **parameters)
-        pypi_mirror.download(platform = ['macosx_10_12_x86_64'], **parameters)
-    pypi_mirror.download(platform = ['win_amd64'], **parameters)
-    mirror_creation_parameters = {
-        'download_dir': download_dir,
-        'mirror_dir': pypi_dir,
-        'copy': True
-    }
-    pypi_mirror.create_mirror(**mirror_creation_parameters)
+        download_file(package_file["url"], destination_path)
+    if package_file["sha256"] and hash_file(destination_path)["sha256"] != package_file["sha256"]:
+        destination_path.unlink()
+        raise IOError(f"SHA-256 of {package_file['filename']} does not match the package index")
+    os.replace(destination_path, Path(download_dir, package_file["filename"]))
+
+def remove_partial_files(directory, keep=()):
+    """Delete the unfinished downloads (".part" files) in a directory.
+
+    Returns the paths of the deleted files.
+
+    Keyword arguments:
+    directory -- Directory holding the downloads
+    keep -- Names of the files whose unfinished downloads are kept so they can be resumed
+    """
+    if not os.path.isdir(directory):
+        return []
+    keep = set(keep)
+    removed = []
+    for path in sorted(Path(directory).iterdir()):
+        match = PARTIAL_FILE_PATTERN.fullmatch(path.name)
+        if match and match.group("name") not in keep and path.is_file():
+            path.unlink()
+            removed.append(path)
+    return removed
+
+def update_pypi_mirror(download_dir, pypi_dir):
+    """Add the files in download_dir to the PyPI mirror in pypi_dir.
+
+    Files are hard linked into the mirror when both directories are on the
+    same file system and copied otherwise. The core metadata of each wheel is
+    saved next to it (PEP 658) so pip can resolve dependencies without
+    downloading whole wheels. Only the index pages of projects with new files
+    are written again.
+
+    Keyword arguments:
+    download_dir -- Directory with the downloaded wheels
+    pypi_dir -- Directory of the PyPI mirror
+    """
+    # Hashes are stored next to each file so existing files are not hashed again
+    pypi_mirror.create_metadata_files(str(download_dir))
+    packages = sorted(pypi_mirror.list_pkgs(str(download_dir), False),
+                      key=lambda package: package.metadata.norm_name)
+    project_names = []
+    for norm_name, project_packages in itertools.groupby(packages, lambda package: package.metadata.norm_name):
+        project_packages = list(project_packages)
+        pypi_mirror.fix_pkg_names(project_packages)
+        project_names.append((norm_name, project_packages[0].metadata.name))
+        project_dir = Path(pypi_dir, norm_name)
+        project_dir.mkdir(parents=True, exist_ok=True)
+        new_files = False
+        metadata_hashes = {}
+        for package in project_packages:
+            mirror_path = Path(project_dir, os.path.basename(package.file))
+            if not mirror_path.exists():
+                link_or_copy(package.file, mirror_path)
+                new_files = True
+            if mirror_path.suffix == ".whl" and not Path(f"{mirror_path}.metadata").exists():
+                new_files = True
+            metadata_hashes[mirror_path.name] = write_wheel_metadata(mirror_path)
+        if new_files or not Path(project_dir, "index.html").exists():
+            write_if_changed(Path(project_dir, "index.html"),
+                             generate_project_html(project_packages, metadata_hashes))
+    write_if_changed(Path(pypi_dir, "index.html"), pypi_mirror.generate_root_html(project_names))
+
+def write_wheel_metadata(wheel_path):
+    """Save the core metadata of a wheel next to it as <wheel>.metadata (PEP 658).
+
+    Returns the SHA-256 of the metadata file, or None if wheel_path is not a
+    wheel or has no METADATA file.
+
+    Keyword arguments:
+    wheel_path -- Path of the wheel in the PyPI mirror
+    """
+    metadata_path = Path(f"{wheel_path}.metadata")
+    if metadata_path.exists():
+        return hashlib.sha256(metadata_path.read_bytes()).hexdigest()
+    if Path(wheel_path).suffix != ".whl":
+        return None
+    try:
+        with zipfile.ZipFile(wheel_path) as wheel:
+            metadata_names = [name for name in wheel.namelist()
+                              if re.fullmatch(r"[^/]+\.dist-info/METADATA", name)]
+            if len(metadata_names) != 1:
+                return None
+            metadata = wheel.read(metadata_names[0])
+    except zipfile.BadZipFile:
+        return None
+    temporary_path = Path(f"{metadata_path}.tmp")
+    temporary_path.write_bytes(metadata)
+    os.replace(temporary_path, metadata_path)
+    return hashlib.sha256(metadata).hexdigest()
+
+def generate_project_html(packages, metadata_hashes):
+    """Return the simple index page of a project in the PyPI mirror.
+
+    Like pypi_mirror.generate_pkg_html, but links to the metadata of each
+    wheel with the data-core-metadata attribute of PEP 658/714.
+
+    Keyword arguments:
+    packages -- pypi_mirror packages of the project
+    metadata_hashes -- Dictionary mapping file names to the SHA-256 of their
+                       metadata file, or None if they have none
+    """
+    anchors = []
+    for package in packages:
+        file_name = os.path.basename(package.file)
+        attributes = ""
+        if metadata_hashes.get(file_name):
+            metadata_hash = f"sha256={metadata_hashes[file_name]}"
+            attributes = f' data-dist-info-metadata="{metadata_hash}" data-core-metadata="{metadata_hash}"'
+        anchors.append(f'<a href="{html.escape(file_name)}#sha256={package.metadata.sha256}"{attributes}>'
+                       f'{html.escape(file_name)}</a><br/>')
+    project_name = html.escape(packages[0].metadata.name)
+    anchors = "\n    ".join(anchors)
+    return f"""<!DOCTYPE html>
+<html>
+  <head>
+    <title>Links for {project_name}</title>
+  </head>
+  <body>
+    <h1>Links for {project_name}</h1>
+    {anchors}
+  </body>
+</html>"""
+
+def precompress_files(directory, patterns=PRECOMPRESS_PATTERNS, min_size=PRECOMPRESS_MIN_SIZE):
+    """Write compressed siblings of the text files in directory for serve_ods_dir.
+
+    Each matching file gets a ".gz" sibling, and a ".br" sibling if the
+    optional brotli package is installed. Siblings are given the
+    modification time of their file, so they are only written again when
+    the file changes. Siblings that would not be smaller are not written.
+    Returns the number of siblings written.
+
+    Keyword arguments:
+    directory -- Directory to precompress
+    patterns -- Glob patterns of the file names to precompress
+    min_size -- Size in bytes below which files are not worth compressing
+    """
+    encoders = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    brotli = get_brotli()
+    if brotli is not None:
+        encoders.append((".br", lambda data: brotli.compress(data, quality=11)))
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [directory_name for directory_name in dirs if not directory_name.startswith(".")]
+        for file_name in files:
+            if not any(fnmatch.fnmatchcase(file_name, pattern) for pattern in patterns):
+                continue
+            path = Path(root, file_name)
+            stat = path.stat()
+            if stat.st_size < min_size:
+                continue
+            data = None
+            for extension, compress in encoders:
+                compressed_path = Path(f"{path}{extension}")
+                if compressed_path.exists() and compressed_path.stat().st_mtime_ns == stat.st_mtime_ns:
+                    continue
+                if data is None:
+                    data = path.read_bytes()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    compressed_path.unlink(missing_ok=True)
+                    continue
+                temporary_path = Path(f"{compressed_path}.{threading.get_ident()}.tmp")
+                temporary_path.write_bytes(compressed)
+                os.utime(temporary_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.replace(temporary_path, compressed_path)
+                written += 1
+    return written
+
+def deduplicate_files(directory, min_size=DEDUPLICATE_MIN_SIZE, workers=None):
+    """Replace identical files under directory with links to a single copy.
+
+    Only files of the same size are hashed. Duplicates become hard links to
+    the most recently modified copy, or symbolic links where hard links are
+    not supported, and are left alone if neither is possible. Files are
+    written to with os.replace or wget --unlink afterwards, so updating one
+    lesson never changes the files of another. Returns a dictionary with the
+    number of "files" linked and the "bytes_saved".
+
+    Keyword arguments:
+    directory -- Directory to deduplicate
+    min_size -- Size in bytes below which files are not worth linking
+    workers -- Number of threads used for hashing (defaults to the number of CPUs)
+    """
+    files_by_size = {}
+    for root, dirs, files in os.walk(directory):
+        for file_name in files:
+            path = Path(root, file_name)
+            if path.is_symlink() or file_name.endswith(".tmp"):
+                continue
+            stat = path.stat()
+            if stat.st_size >= min_size:
+                inodes = files_by_size.setdefault(stat.st_size, {})
+                inodes.setdefault((stat.st_dev, stat.st_ino), path.relative_to(directory).as_posix())
+    candidates = [relative_path for inodes in files_by_size.values() if len(inodes) > 1
+                  for relative_path in inodes.values()]
+    entries = hash_files(directory, candidates, {relative_path: ["sha256"] for relative_path in candidates},
+                         workers)
+
+    duplicates = {}
+    for relative_path, entry in entries.items():
+        duplicates.setdefault((entry["size"], entry["sha256"]), []).append(relative_path)
+    linked_files = 0
+    bytes_saved = 0
+    for (size, sha256), relative_paths in duplicates.items():
+        relative_paths.sort(key=lambda relative_path: entries[relative_path]["mtime"], reverse=True)
+        for relative_path in relative_paths[1:]:
+            if replace_with_link(Path(directory, relative_paths[0]), Path(directory, relative_path)):
+                linked_files += 1
+                bytes_saved += size
+    return {"files": linked_files, "bytes_saved": bytes_saved}
+
+def replace_with_link(source_path, destination_path):
+    """Replace destination_path with a hard link, or else a symbolic link, to source_path.
+
+    Returns whether the file was replaced.
+
+    Keyword arguments:
+    source_path -- File to link to
+    destination_path -- Identical file to replace
+    """
+    temporary_path = Path(f"{destination_path}.{threading.get_ident()}.tmp")
+    try:
+        os.link(source_path, temporary_path)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(source_path, destination_path.parent), temporary_path)
+        except OSError:
+            return False
+    os.replace(temporary_path, destination_path)
+    return True
+
+def link_or_copy(source_path, destination_path):
+    """Hard link source_path to destination_path, copying if a link is not possible.
+
+    Keyword arguments:
+    source_path -- Existing file
+    destination_path -- Path of the new file
+    """
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+
+def write_if_changed(path, text):
+    """Write text to path unless the file already contains it.
+
+    Returns whether the file was written.
+
+    Keyword arguments:
+    path -- Path of the file to write
+    text -- Contents of the file
+    """
+    path = Path(path)
+    if path.exists() and path.read_text() == text:
+        return False
+    temporary_path = Path(f"{path}.tmp")
+    temporary_path.write_text(text)
+    os.replace(temporary_path, path)
+    return True
+
+def get_python_checksums(version, ods_dir=None):
+    """Return the checksums python.org publishes for the files of a release.
+
+    Returns a dictionary mapping file names to (algorithm, digest) tuples,
+    preferring SHA-256 over MD5 when the release page lists both.
+
+    Keyword arguments:
+    version -- Python version, e.g., "3.12.10"
+    ods_dir -- Directory holding the index page cache
+    """
+    url = f"{PYTHON_URL}downloads/release/python-{version.replace('.', '')}/"
+    soup = bs.BeautifulSoup(fetch_metadata(url, ods_dir), 'lxml')
+    checksums = {}
+    for table in soup.find_all("table"):
+        headers = [header.text.strip().lower().replace("-", "") for header in table.find_all("th")]
+        for algorithm, label in [("sha256", "sha256"), ("md5", "md5")]:
+            matches = [number for number, header in enumerate(headers) if label in header]
+            if matches:
+                digest_column = matches[0]
+                break
+        else:
+            continue
+        for row in table.find_all("tr"):
+            columns = row.find_all("td")
+            if len(columns) <= digest_column or columns[0].a is None:
+                continue
+            file_info = table_parse_version_info(row, 1, 0)
+            digest = columns[digest_column].text.strip().lower()
+            checksums[os.path.basename(file_info["url"])] = (algorithm, digest)
+    return checksums
+
+def parse_dcf(lines):
+    """Yield the records of a Debian control file (e.g., a CRAN PACKAGES file) as dictionaries.
+
+    Keyword arguments:
+    lines -- Iterable of lines of the file
+    """
+    record = {}
+    field = None
+    for line in lines:
+        if not line.strip():
+            if record:
+                yield record
+            record = {}
+            field = None
+        elif line[0] in " \t" and field is not None:
+            record[field] += " " + line.strip()
+        elif ":" in line:
+            field, value = line.split(":", 1)
+            record[field] = value.strip()
+    if record:
+        yield record
+
+def record_cran_checksums(ods_dir):
+    """Record the MD5 sums CRAN publishes for the packages in the miniCRAN mirror.
+
+    Keyword arguments:
+    ods_dir -- Directory containing the miniCRAN mirror
+    """
+    minicran_path = Path(Path(ods_dir), Path("miniCRAN"))
+    extensions = {"src": ".tar.gz", "windows": ".zip", "macosx": ".tgz"}
+    checksums = {}
+    for packages_path in minicran_path.glob("**/PACKAGES"):
+        repo_dir = packages_path.parent.relative_to(minicran_path).as_posix()
+        extension = extensions.get(repo_dir.split("/")[1] if repo_dir.startswith("bin/") else "src")
+        if extension is None:
+            continue
+        with contextlib.closing(iter_metadata_lines(f"{CRAN_URL}{repo_dir}/PACKAGES", ods_dir)) as lines:
+            for record in parse_dcf(lines):
+                file_name = f"{record['Package']}_{record['Version']}{extension}"
+                if "MD5sum" in record and Path(packages_path.parent, file_name).exists():
+                    checksums[f"miniCRAN/{repo_dir}/{file_name}"] = ("md5", record["MD5sum"].lower())
+    record_upstream_checksums(ods_dir, checksums)
+
+def record_upstream_checksums(ods_dir, checksums):
+    """Store checksums published upstream in the manifest so files can be checked against them.
+
+    Keyword arguments:
+    ods_dir -- Directory containing the manifest
+    checksums -- Dictionary mapping paths relative to ods_dir to (algorithm, digest) tuples
+    """
+    with _manifest_lock:
+        manifest = read_manifest(ods_dir)
+        for relative_path, (algorithm, digest) in checksums.items():
+            manifest["upstream"][relative_path] = {algorithm: digest}
+        write_json_atomically(Path(ods_dir, MANIFEST_FILENAME), manifest)
+
+def read_manifest(ods_dir):
+    """Return the manifest of ods_dir, or an empty manifest if there is none.
+
+    Keyword arguments:
+    ods_dir -- Directory containing the manifest
+    """
+    manifest_path = Path(ods_dir, MANIFEST_FILENAME)
+    if not manifest_path.exists():
+        return {"version": 1, "files": {}, "upstream": {}}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+def list_artifacts(ods_dir):
+    """Return the paths, relative to ods_dir, of all downloaded files.
+
+    Unfinished downloads (".part" files) are not included.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    """
+    artifacts = []
+    for artifact_dir in ARTIFACT_DIRS:
+        for root, dirs, files in os.walk(Path(ods_dir, artifact_dir)):
+            for file_name in files:
+                if PARTIAL_FILE_PATTERN.fullmatch(file_name):
+                    continue
+                artifacts.append(Path(root, file_name).relative_to(ods_dir).as_posix())
+    return sorted(artifacts)
+
+def hash_file(path, algorithms=("sha256",)):
+    """Return the hex digests of a file, reading it in chunks.
+
+    Keyword arguments:
+    path -- Path of the file to hash
+    algorithms -- Names of the hashlib algorithms to compute
+    """
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(HASH_CHUNK_SIZE), b""):
+            for file_hash in hashes.values():
+                file_hash.update(chunk)
+    return {algorithm: file_hash.hexdigest() for algorithm, file_hash in hashes.items()}
+
+def hash_files(ods_dir, relative_paths, algorithms, workers=None):
+    """Hash several files in parallel across CPU cores.
+
+    hashlib releases the GIL while hashing, so threads are used rather
+    than processes, which are unsafe to fork from the download threads.
+    Returns a dictionary mapping each path to its manifest entry.
+
+    Keyword arguments:
+    ods_dir -- Directory the paths are relative to
+    relative_paths -- Paths of the files to hash
+    algorithms -- Dictionary mapping each path to the algorithms to compute
+    workers -- Number of threads to use (defaults to the number of CPUs)
+    """
+    paths = [Path(ods_dir, relative_path) for relative_path in relative_paths]
+    algorithm_lists = [algorithms[relative_path] for relative_path in relative_paths]
+    if len(paths) > 1 and workers != 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            digests = list(executor.map(hash_file, paths, algorithm_lists))
+    else:
+        digests = list(map(hash_file, paths, algorithm_lists))
+    entries = {}
+    for relative_path, path, digest in zip(relative_paths, paths, digests):
+        stat = path.stat()
+        entries[relative_path] = dict(digest, size=stat.st_size, mtime=stat.st_mtime)
+    return entries
+
+def needs_hashing(ods_dir, relative_path, entry, upstream):
+    """Check whether a file changed since its manifest entry was recorded.
+
+    Keyword arguments:
+    ods_dir -- Directory the path is relative to
+    relative_path -- Path of the file
+    entry -- Manifest entry of the file, or None
+    upstream -- Checksums published upstream for the file, or None
+    """
+    if entry is None or any(algorithm not in entry for algorithm in upstream or {}):
+        return True
+    stat = Path(ods_dir, relative_path).stat()
+    return stat.st_size != entry["size"] or stat.st_mtime != entry["mtime"]
+
+def update_manifest(ods_dir, workers=None):
+    """Record the size, mtime and SHA-256 of every downloaded file in the manifest.
+
+    Only files whose size or mtime changed since the last update are hashed.
+    Returns the paths whose contents do not match the checksums published upstream.
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    workers -- Number of threads used for hashing (defaults to the number of CPUs)
+    """
+    with _manifest_lock:
+        manifest = read_manifest(ods_dir)
+        artifacts = list_artifacts(ods_dir)
+        to_hash = [relative_path for relative_path in artifacts
+                   if needs_hashing(ods_dir, relative_path, manifest["files"].get(relative_path),
+                                    manifest["upstream"].get(relative_path))]
+        algorithms = {relative_path: ["sha256", *manifest["upstream"].get(relative_path, {})]
+                      for relative_path in to_hash}
+        manifest["files"] = {relative_path: manifest["files"][relative_path]
+                             for relative_path in artifacts if relative_path not in to_hash}
+        manifest["files"].update(hash_files(ods_dir, to_hash, algorithms, workers))
+        write_json_atomically(Path(ods_dir, MANIFEST_FILENAME), manifest)
+    mismatches = find_upstream_mismatches(manifest)
+    for relative_path in mismatches:
+        warnings.warn(f"{relative_path} does not match the checksum published upstream")
+    return mismatches
+
+def find_upstream_mismatches(manifest):
+    """Return the paths in the manifest that do not match their upstream checksums.
+
+    Keyword arguments:
+    manifest -- Manifest as returned by read_manifest
+    """
+    mismatches = []
+    for relative_path, upstream in manifest["upstream"].items():
+        entry = manifest["files"].get(relative_path)
+        if entry is None:
+            continue
+        if any(entry.get(algorithm) != digest for algorithm, digest in upstream.items()):
+            mismatches.append(relative_path)
+    return mismatches
+
+def verify_manifest(ods_dir, workers=None):
+    """Check the downloaded files against the manifest.
+
+    Only files whose size or mtime changed are hashed again. Returns a
+    dictionary with lists of "missing" files, "modified" files whose
+    contents changed, "untracked" files not in the manifest and files
+    which do not match the checksums published "upstream".
+
+    Keyword arguments:
+    ods_dir -- Directory to save installers and lesson materials
+    workers -- Number of threads used for hashing (defaults to the number of CPUs)
+    """
+    with _manifest_lock:
+        manifest = read_manifest(ods_dir)
+        artifacts = set(list_artifacts(ods_dir))
+        missing = sorted(set(manifest["files"]) - artifacts)
+        untracked = sorted(artifacts - set(manifest["files"]))
+        to_hash = [relative_path for relative_path, entry in manifest["files"].items()
+                   if relative_path in artifacts
+                   and needs_hashing(ods_dir, relative_path, entry, None)]
+        algorithms = {relative_path: [algorithm for algorithm in manifest["files"][relative_path]
+                                      if algorithm not in ("size", "mtime")]
+                      for relative_path in to_hash}
+        modified = []
+        for relative_path, entry in hash_files(ods_dir, to_hash, algorithms, workers).items():
+            if entry["sha256"] != manifest["files"][relative_path]["sha256"]:
+                modified.append(relative_path)
+            else:
+                manifest["files"][relative_path] = entry
+        write_json_atomically(Path(ods_dir, MANIFEST_FILENAME), manifest)
+    return {"missing": missing,
+            "modified": sorted(modified),
+            "untracked": untracked,
+            "upstream": find_upstream_mismatches(manifest)}
+
+def export_ods_dir(ods_dir, output_path, since=None, compression=None, level=None, workers=None):
+    """Write ods_dir, or the files changed since a previous export, to a single compressed tar archive.
+
+    Copying one archive to each machine and unpacking it there is much
+    faster than copying the many small files of the mirrors and lessons.
+    The manifest is brought up to date first and is included in the
+    archive, so the copy can be checked with verify_manifest and the
+    manifest can be passed as since for the next export. The files removed
+    since are then listed, one per line, in a removed.txt member so they
+    can be deleted from the copies. Files are streamed into the archive,
+    hard linked copies are only stored once and zstd compression runs on
+    several threads. Returns a dictionary with the "path" of the archive,
+    its "size", the "files" in it and the files "removed" since the
+    previous export.
+
+    Keyword arguments:
+    ods_dir -- Directory to export
+    output_path -- Path of the archive. Its extension (.tar.zst, .tar.gz,
+                   .tar.xz or .tar) chooses the compression, otherwise the
+                   extension of the compression is added.
+    since -- Manifest of a previous export, only files added or changed since are exported
+    compression -- "zst", "gz", "xz" or "none" (defaults to the extension of
+                   output_path, or zst if the zstandard package is installed
+                   and gz if it is not)
+    level -- Compression level (defaults to the default level of the compression)
+    workers -- Number of threads used for zstd compression and hashing
+               (defaults to the number of CPUs)
+    """
+    output_path = Path(output_path)
+    suffix_compression = next((name for name, suffix in EXPORT_SUFFIXES.items()
+                               if output_path.name.endswith(suffix)), None)
+    if compression is None:
+        compression = suffix_compression or ("zst" if get_zstandard() else "gz")
+    if compression not in EXPORT_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if suffix_compression is None:
+        output_path = output_path.with_name(output_path.name + EXPORT_SUFFIXES[compression])
+    part_path = output_path.with_name(output_path.name + ".part")
+    start_time = time.perf_counter()
+    with stage("export"):
+        update_manifest(ods_dir, workers)
+        files, removed = list_export_files(ods_dir, since, exclude=[output_path])
+        with open(part_path, "wb") as output_file, \
+                open_compressed_stream(output_file, compression, level, workers) as stream, \
+                tarfile.open(fileobj=stream, mode="w|", copybufsize=DOWNLOAD_CHUNK_SIZE) as archive:
+            for relative_path in files:
+                archive.add(Path(ods_dir, relative_path), arcname=relative_path, recursive=False)
+            if since is not None:
+                removed_list = "".join(f"{relative_path}\n" for relative_path in removed).encode("utf-8")
+                removed_info = tarfile.TarInfo(EXPORT_REMOVED_FILENAME)
+                removed_info.size = len(removed_list)
+                removed_info.mtime = time.time()
+                archive.addfile(removed_info, io.BytesIO(removed_list))
+        os.replace(part_path, output_path)
+    size = output_path.stat().st_size
+    print(f"Exported {len(files)} files to {output_path} ({format_bytes(size)}) "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    if removed:
+        print(f"{len(removed)} files were removed since the previous export "
+              f"(listed in {EXPORT_REMOVED_FILENAME} in the archive)")
+    return {"path": output_path, "size": size, "files": files, "removed": removed}
+
+def list_export_files(ods_dir, since=None, exclude=()):
+    """Return the files to export and the files removed since a previous export.
+
+    Both are lists of paths relative to ods_dir. offlinedatasci's own
+    bookkeeping files, unfinished downloads and earlier exports (archives
+    with an EXPORT_SUFFIXES extension outside ARTIFACT_DIRS) are not
+    exported. If since
+    is given, files with the same SHA-256 in since and in the manifest of
+    ods_dir are left out. Files outside ARTIFACT_DIRS, which are not in the
+    manifest, are always exported.
+
+    Keyword arguments:
+    ods_dir -- Directory to export
+    since -- Manifest of a previous export
+    exclude -- Paths of files not to export, e.g., the archive itself
+    """
+    state_dir = get_ods_state_dir(ods_dir)
+    exclude = {os.path.abspath(path) for path in exclude}
+    files = []
+    for root, dirs, file_names in os.walk(ods_dir):
+        dirs[:] = sorted(directory for directory in dirs if Path(root, directory) != state_dir)
+        for file_name in sorted(file_names):
+            path = os.path.join(root, file_name)
+            if PARTIAL_FILE_PATTERN.fullmatch(file_name) or os.path.abspath(path) in exclude:
+                continue
+            relative_path = Path(path).relative_to(ods_dir).as_posix()
+            if (relative_path.split("/")[0] not in ARTIFACT_DIRS
+                    and file_name.endswith(tuple(EXPORT_SUFFIXES.values()))):
+                continue
+            files.append(relative_path)
+    if since is None:
+        return files, []
+    with open(since) as manifest_file:
+        previous = json.load(manifest_file)["files"]
+    current = read_manifest(ods_dir)["files"]
+    changed = [relative_path for relative_path in files
+               if relative_path not in current
+               or previous.get(relative_path, {}).get("sha256") != current[relative_path]["sha256"]]
+    return changed, sorted(set(previous) - set(current))
+
+def open_compressed_stream(output_file, compression, level=None, workers=None):
+    """Return a writable stream compressing everything written to it into output_file.
+
+    Closing the stream does not close output_file.
+
+    Keyword arguments:
+    output_file -- Binary file to write the compressed data to
+    compression -- "zst", "gz", "xz" or "none"
+    level -- Compression level (defaults to the default level of the compression)
+    workers -- Number of threads used for zstd compression (defaults to the number of CPUs)
+    """
+    if compression == "zst":
+        zstandard = get_zstandard()
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package "
+                               "(pip install offlinedatasci[zstd])")
+        threads = -1 if workers is None else workers if workers > 1 else 0
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level, threads=threads)
+        return compressor.stream_writer(output_file, closefd=False)
+    if compression == "gz":
+        return gzip.GzipFile(fileobj=output_file, mode="wb", compresslevel=6 if level is None else level)
+    if compression == "xz":
+        return lzma.LZMAFile(output_file, "wb", preset=6 if level is None else level)
+    return contextlib.nullcontext(output_file)
+
+def get_brotli():
+    """Return the optional brotli module, or None if it is not installed.
+
+    It is imported on first use so that importing offlinedatasci stays fast.
+    """
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def get_zstandard():
+    """Return the optional zstandard module, or None if it is not installed.
+
+    It is imported on first use so that importing offlinedatasci stays fast.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def serve_ods_dir(ods_dir, host="0.0.0.0", port=DEFAULT_SERVE_PORT, quiet=False):
+    """Serve the mirrors, installers and lessons in ods_dir over HTTP until interrupted.
+
+    pip can install from http://<host>:<port>/pypi/ and R from
+    http://<host>:<port>/miniCRAN.
+
+    Keyword arguments:
+    ods_dir -- Directory with the downloaded installers and lesson materials
+    host -- Address to listen on (all interfaces by default)
+    port -- Port to listen on
+    quiet -- Do not log each request
+    """
+    server = make_ods_server(ods_dir, host, port, quiet)
+    server_host = socket.gethostname() if host in ("", "0.0.0.0", "::") else host
+    base_url = f"http://{server_host}:{server.server_address[1]}"
+    print(f"Serving {ods_dir} at {base_url}/")
+    print(f"  Python packages: pip install --index-url {base_url}/pypi/ --trusted-host {server_host} <package>")
+    print(f'  R packages: install.packages("<package>", repos = "{base_url}/miniCRAN")')
+    print(f"  Lessons: {base_url}/lessons/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def make_ods_server(ods_dir, host="0.0.0.0", port=DEFAULT_SERVE_PORT, quiet=False):
+    """Return an OdsHTTPServer for ods_dir that has not started serving yet.
+
+    Keyword arguments:
+    ods_dir -- Directory to serve
+    host -- Address to listen on
+    port -- Port to listen on, or 0 for any free port
+    quiet -- Do not log each request
+    """
+    from .server import OdsHTTPServer, OdsRequestHandler
+    handler = functools.partial(OdsRequestHandler, directory=str(ods_dir))
+    server = OdsHTTPServer((host, port), handler)
+    server.quiet = quiet
+    return server
 
 def get_default_packages(package_type):
-    packages = { 
-        "r-packages": {
-            "data-carpentry": ["tidyverse", "RSQLite"],
-            "data-science": ["dplyr", "ggplot2", "shiny", "lubridate", "knitr", "esquisse", "mlr3", "knitr", "DT"]
-        },
-        "python-packages": {
-            "data-carpentry": ["pandas", "notebook", "numpy", "matplotlib", "plotnine"], 
-            "software-carpentry": ["matplotlib", "notebook", "numpy", "pandas"] ,
-            "data-science": ["scipy", "numpy", "pandas", "matplotlib", "keras", "scikit-learn", "beautifulsoup4", "seaborn","torch"]
-        }
-    }
-    return packages[package_type]
+    return PACKAGE_SETS[package_type]
 
 
 def package_selection(language, custom_package_list):
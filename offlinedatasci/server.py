@@ -0,0 +1,214 @@
+"""The HTTP server behind `offlinedatasci serve`.
+
+Kept apart from main so that http.server is only imported when serving.
+"""
+import email.utils
+import gzip
+import http.server
+import io
+import os
+import re
+import threading
+import urllib.parse
+
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/plain", "text/javascript",
+                      "application/javascript", "application/json", "image/svg+xml"}
+COMPRESS_CACHE_SIZE = 16 * 1024 * 1024
+COMPRESS_MAX_SIZE = 1024 * 1024
+
+_gzip_cache = {}
+_gzip_cache_lock = threading.Lock()
+
+class OdsHTTPServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server that accepts bursts of connections from a classroom."""
+    daemon_threads = True
+    request_queue_size = 128
+    quiet = False
+
+class OdsRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler for ods_dir.
+
+    Adds to SimpleHTTPRequestHandler keep-alive connections, ETag and
+    Last-Modified validators with 304 responses, single byte ranges, brotli
+    or gzip encoding (using the precompressed ".br" or ".gz" siblings written
+    by precompress_files when there are some) and sendfile for file bodies.
+    Hidden files such as .offlinedatasci are not served.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 60
+
+    def send_head(self):
+        self.body_range = None
+        url_path = urllib.parse.urlsplit(self.path).path
+        if any(part.startswith(".") for part in urllib.parse.unquote(url_path).split("/")):
+            self.send_error(404, "File not found")
+            return None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not url_path.endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", url_path + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            if not os.path.isfile(os.path.join(path, "index.html")):
+                return self.list_directory(path)
+            path = os.path.join(path, "index.html")
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+        return self.send_file(path)
+
+    def send_file(self, path):
+        content_type = self.guess_type(path)
+        stat = os.stat(path)
+        body_path, encoding, body = path, None, None
+        compressible = content_type in COMPRESSIBLE_TYPES and not path.endswith(".gz")
+        if compressible:
+            for name, extension in [("br", ".br"), ("gzip", ".gz")]:
+                compressed_path = path + extension
+                if (self.accepts_encoding(name) and os.path.isfile(compressed_path)
+                        and os.stat(compressed_path).st_mtime >= stat.st_mtime):
+                    body_path, encoding = compressed_path, name
+                    break
+            else:
+                if self.accepts_encoding("gzip") and stat.st_size <= COMPRESS_MAX_SIZE:
+                    body, encoding = gzip_file_contents(path, stat.st_mtime_ns, stat.st_size), "gzip"
+        body_stat = os.stat(body_path)
+        size = len(body) if body is not None else body_stat.st_size
+        etag = f'"{body_stat.st_mtime_ns:x}-{size:x}{"-" + encoding if encoding else ""}"'
+        last_modified = self.date_time_string(int(stat.st_mtime))
+
+        if self.is_not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            if compressible:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        byte_range = None
+        if body is None and self.headers.get("Range") and self.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_byte_range(self.headers["Range"], size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+        if byte_range is None:
+            self.send_response(200)
+            start, length = 0, size
+        else:
+            self.send_response(206)
+            start, length = byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.send_header("Content-Range", f"bytes {byte_range[0]}-{byte_range[1]}/{size}")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        if body is None:
+            self.send_header("Accept-Ranges", "bytes")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if body is not None:
+            return io.BytesIO(body)
+        self.body_range = (start, length)
+        return open(body_path, "rb")
+
+    def accepts_encoding(self, encoding):
+        for coding in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, parameters = coding.partition(";")
+            if name.strip().lower() == encoding:
+                return parameters.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+        return False
+
+    def is_not_modified(self, etag, mtime):
+        if "If-None-Match" in self.headers:
+            tags = [tag.strip() for tag in self.headers["If-None-Match"].split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def guess_type(self, path):
+        if os.path.basename(path) == "PACKAGES" or path.endswith(".metadata"):
+            return "text/plain"
+        return super().guess_type(path)
+
+    def copyfile(self, source, outputfile):
+        if self.body_range is None:
+            return super().copyfile(source, outputfile)
+        start, length = self.body_range
+        self.connection.sendfile(source, offset=start, count=length)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def parse_byte_range(range_header, size):
+    """Return the first and last byte of a single byte range request.
+
+    Returns None for headers that cannot be honoured, such as multiple
+    ranges, so that the whole file is sent, and raises ValueError if the
+    range is outside the file.
+
+    Keyword arguments:
+    range_header -- Value of the Range header, e.g., "bytes=0-499"
+    size -- Size of the file in bytes
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", range_header)
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise ValueError(f"Range {range_header} is not satisfiable")
+        return max(0, size - suffix_length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError(f"Range {range_header} is not satisfiable")
+    if last < first:
+        return None
+    return first, last
+
+def gzip_file_contents(path, mtime_ns, size):
+    """Return the gzip compressed contents of a file.
+
+    Cached on the file's modification time and size, so files served
+    repeatedly are only compressed once while they are unchanged. The
+    least recently used bodies are dropped once the cache holds more than
+    COMPRESS_CACHE_SIZE bytes, so the memory used stays small on hosts
+    such as a Raspberry Pi.
+
+    Keyword arguments:
+    path -- Path of the file
+    mtime_ns -- Modification time of the file in nanoseconds
+    size -- Size of the file in bytes
+    """
+    key = (path, mtime_ns, size)
+    with _gzip_cache_lock:
+        if key in _gzip_cache:
+            _gzip_cache[key] = _gzip_cache.pop(key)
+            return _gzip_cache[key]
+    with open(path, "rb") as body_file:
+        body = gzip.compress(body_file.read(), mtime=0)
+    with _gzip_cache_lock:
+        _gzip_cache[key] = body
+        cached_bytes = sum(len(cached) for cached in _gzip_cache.values())
+        while cached_bytes > COMPRESS_CACHE_SIZE:
+            cached_bytes -= len(_gzip_cache.pop(next(iter(_gzip_cache))))
+    return body
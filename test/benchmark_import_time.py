@@ -0,0 +1,64 @@
+"""Measure how long importing offlinedatasci and starting the command line take.
+
+Run with ``python test/benchmark_import_time.py [repeats]``. Each command is
+run in a new interpreter and the best wall time is reported, along with the
+cumulative import time of the slowest modules (from ``python -X importtime``)
+and whether any of the larger dependencies were imported.
+"""
+import os
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["airium", "asyncio", "brotli", "bs4", "http.server", "importlib_resources", "lxml",
+                 "pypi_mirror", "requests", "zstandard"]
+COMMANDS = {
+    "python -c 'pass'": [sys.executable, "-c", "pass"],
+    "import offlinedatasci": [sys.executable, "-c", "import offlinedatasci"],
+    "offlinedatasci --help": [sys.executable, "-c", "import sys; sys.argv[0] = 'offlinedatasci'; "
+                              "from offlinedatasci.cli import main; main()", "--help"],
+}
+
+def best_time(command, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def slowest_imports(count=10):
+    """Return the cumulative time in microseconds of the slowest imports of offlinedatasci.main."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import offlinedatasci"],
+                            check=True, capture_output=True, text=True).stderr
+    children = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 2:
+            children.append((int(cumulative), name.strip()))
+        elif name.strip() == "offlinedatasci.main":
+            return sorted(children, reverse=True)[:count]
+        elif depth < 2:
+            children = []
+    return []
+
+def loaded_heavy_modules():
+    code = f"import offlinedatasci, sys; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # Compile offlinedatasci first so the first run is not slower than the others
+    subprocess.run([sys.executable, "-m", "compileall", "-q",
+                    os.path.join(os.path.dirname(__file__), "..", "offlinedatasci")])
+    for label, command in COMMANDS.items():
+        print(f"{label:25} {best_time(command, repeats) * 1000:7.1f} ms")
+    print("Slowest imports of offlinedatasci.main:")
+    for cumulative, name in slowest_imports():
+        print(f"  {name:30} {cumulative / 1000:7.1f} ms")
+    heavy = loaded_heavy_modules()
+    print(f"Larger dependencies imported: {', '.join(heavy) if heavy else 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare the built-in lesson mirror with wget on a local fixture site.
+
+Run with ``python test/benchmark_lesson_mirroring.py [pages] [latency_ms]``.
+A lesson-like site is generated and served with http.server, adding the
+given latency to every response. It is then mirrored with wget (if
+installed) and with mirror_website, reporting throughput and which files
+each of them downloaded.
+"""
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import functools
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from offlinedatasci.main import get_mirror_options, get_lesson_sources, mirror_website
+
+class SlowRequestHandler(SimpleHTTPRequestHandler):
+    latency = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        time.sleep(self.latency)
+        return super().send_head()
+
+def make_site(site_dir, pages):
+    lesson_dir = Path(site_dir, "lesson")
+    for directory in ["lesson/fig", "assets/css", "assets/fonts"]:
+        Path(site_dir, directory).mkdir(parents=True)
+    Path(site_dir, "assets/css/lesson.css").write_text(
+        "body { font-family: 'Lesson'; src: url('../fonts/lesson.woff'); }\n" * 50)
+    Path(site_dir, "assets/fonts/lesson.woff").write_bytes(b"\0" * 50000)
+    navigation = "".join(f'<li><a href="episode-{page}.html">Episode {page}</a></li>' for page in range(pages))
+    for page in ["index"] + [f"episode-{page}" for page in range(pages)]:
+        Path(lesson_dir, f"fig/{page}.png").write_bytes(b"\0" * 20000)
+        Path(lesson_dir, f"{page}.html").write_text(
+            f'<html><head><link rel="stylesheet" href="/assets/css/lesson.css"></head><body>'
+            f'<h1>{page}</h1><ul>{navigation}</ul><img src="fig/{page}.png">'
+            f'<p>{"Lesson text. " * 500}</p></body></html>')
+
+def list_files(directory):
+    return {path.relative_to(directory).as_posix() for path in Path(directory).rglob("*")
+            if path.is_file() and not path.name.endswith(".orig")}
+
+def run(name, mirror, destination):
+    start_time = time.perf_counter()
+    mirror(destination)
+    seconds = time.perf_counter() - start_time
+    files = list_files(destination)
+    size = sum(Path(destination, file_name).stat().st_size for file_name in files)
+    print(f"{name:8} {seconds:7.2f}s {len(files):5} files {size / 1e6:7.2f} MB "
+          f"{size / 1e6 / seconds:7.2f} MB/s")
+    return files
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    SlowRequestHandler.latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    wget_args = get_lesson_sources()["software-carpentry"]["wget_args"]
+    with tempfile.TemporaryDirectory() as work_dir:
+        make_site(Path(work_dir, "site"), pages)
+        handler = functools.partial(SlowRequestHandler, directory=str(Path(work_dir, "site")))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/lesson/index.html"
+        domain_args = [arg if arg != "swcarpentry.github.io" else "127.0.0.1" for arg in wget_args]
+
+        python_files = run("python", lambda destination: mirror_website(
+            url, destination, **get_mirror_options(domain_args)), Path(work_dir, "python"))
+        if shutil.which("wget"):
+            wget_files = run("wget", lambda destination: subprocess.run(
+                ["wget", *domain_args, "-P", destination, url],
+                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT), Path(work_dir, "wget"))
+            print(f"only downloaded by wget: {sorted(wget_files - python_files)}")
+            print(f"only downloaded by python: {sorted(python_files - wget_files)}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
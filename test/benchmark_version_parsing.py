@@ -0,0 +1,58 @@
+"""Compare version discovery against the saved fixture pages.
+
+Run with ``python test/benchmark_version_parsing.py``. Reports the time and
+peak memory of the streaming parsers against the previous BeautifulSoup based
+approach for the python.org FTP index and the CRAN macOS page.
+"""
+from pathlib import Path
+import timeit
+import tracemalloc
+import bs4 as bs
+import re
+from offlinedatasci.main import parse_python_version, parse_r_version
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+REPEATS = 200
+
+def soup_python_version(page, minor_version="3.12"):
+    soup = bs.BeautifulSoup(page, 'html.parser')
+    versions = [a.text for a in soup.find_all('a') if a.text.startswith(minor_version)]
+    return sorted(versions, reverse=True)[0].strip('/')
+
+def regex_r_version(page):
+    version_regex = r"(R\-\d+\.\d+\.\d)+\-(?:x86_64|arm64|win)\.(?:exe|pkg)"
+    for line in page.splitlines():
+        match = re.findall(version_regex, line)
+        if match:
+            return match[0]
+
+def measure(function):
+    seconds = min(timeit.repeat(function, number=REPEATS, repeat=3)) / REPEATS
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak_bytes
+
+def report(name, baseline, streaming):
+    (base_seconds, base_bytes), (stream_seconds, stream_bytes) = baseline, streaming
+    print(f"{name}:")
+    print(f"  previous:  {base_seconds * 1e6:9.1f} us {base_bytes / 1024:9.1f} KiB peak")
+    print(f"  streaming: {stream_seconds * 1e6:9.1f} us {stream_bytes / 1024:9.1f} KiB peak")
+    print(f"  speedup: {base_seconds / stream_seconds:.1f}x, "
+          f"memory: {base_bytes / max(stream_bytes, 1):.1f}x less")
+
+def main():
+    python_page = (FIXTURES_DIR / "python-ftp-index.html").read_text()
+    r_page = (FIXTURES_DIR / "cran-macosx.html").read_text()
+    python_lines = python_page.splitlines()
+    r_lines = r_page.splitlines()
+    report("python.org FTP index",
+           measure(lambda: soup_python_version(python_page)),
+           measure(lambda: parse_python_version(iter(python_lines), "3.12")))
+    report("CRAN macOS page",
+           measure(lambda: regex_r_version(r_page)),
+           measure(lambda: parse_r_version(iter(r_lines))))
+
+if __name__ == "__main__":
+    main()
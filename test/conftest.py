@@ -0,0 +1,58 @@
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+import functools
+import os
+import shutil
+import threading
+import pytest
+import offlinedatasci.fetch
+import offlinedatasci.main
+from upstream import UpstreamRequestHandler, make_upstream_site, PYTHON_VERSION, R_VERSION
+
+def pytest_addoption(parser):
+    parser.addoption("--upstream-latency", type=float, default=0,
+                     help="seconds the stand-in upstream server waits before each response")
+    parser.addoption("--upstream-bandwidth", type=float, default=None,
+                     help="bytes per second the stand-in upstream server sends (default: no limit)")
+
+@pytest.fixture(scope="session")
+def upstream_server(request, tmp_path_factory):
+    served_dir = tmp_path_factory.mktemp("upstream")
+    handler = functools.partial(UpstreamRequestHandler, directory=str(served_dir),
+                                latency=request.config.getoption("--upstream-latency"),
+                                bandwidth=request.config.getoption("--upstream-bandwidth"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    lesson_sources = make_upstream_site(served_dir, base_url)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield SimpleNamespace(directory=served_dir, url=base_url, lesson_sources=lesson_sources,
+                          python_version=PYTHON_VERSION, r_version=R_VERSION)
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def upstream(upstream_server, monkeypatch):
+    """Point offlinedatasci at the stand-in upstream server instead of the internet."""
+    base_url = upstream_server.url
+    monkeypatch.setattr("offlinedatasci.main.CRAN_URL", f"{base_url}/cran/")
+    monkeypatch.setattr("offlinedatasci.main.PYTHON_URL", f"{base_url}/python/")
+    monkeypatch.setattr("offlinedatasci.main.RSTUDIO_DOWNLOAD_URL", f"{base_url}/rstudio/download/")
+    monkeypatch.setattr("offlinedatasci.main.PYPI_INDEX_URL", f"{base_url}/pypi/")
+    monkeypatch.setattr("offlinedatasci.main.get_lesson_sources", lambda: upstream_server.lesson_sources)
+    monkeypatch.setitem(offlinedatasci.fetch.HOST_RATES, "127.0.0.1", (1000, 1000))
+    monkeypatch.setattr("offlinedatasci.fetch._host_buckets", {})
+    monkeypatch.setattr("offlinedatasci.fetch._host_circuits", {})
+    # Keep pip away from the indexes configured on this machine
+    for variable in list(os.environ):
+        if variable.startswith("PIP_"):
+            monkeypatch.delenv(variable)
+    monkeypatch.setenv("PIP_CONFIG_FILE", os.devnull)
+    monkeypatch.setenv("PIP_DISABLE_PIP_VERSION_CHECK", "1")
+    # The stand-in CRAN is complete enough for mirror_cran_packages but not for miniCRAN
+    which = shutil.which
+    monkeypatch.setattr(shutil, "which", lambda name, *args, **kwargs:
+                        None if name == "Rscript" else which(name, *args, **kwargs))
+    offlinedatasci.main.clear_metadata_cache()
+    yield upstream_server
+    offlinedatasci.main.clear_metadata_cache()
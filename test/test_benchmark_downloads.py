@@ -0,0 +1,116 @@
+"""Benchmark the downloads against the stand-in upstream server.
+
+Run with ``python -m pytest test/test_benchmark_downloads.py`` (requires
+pytest-benchmark). Each round downloads into a new directory with an empty
+metadata cache. Besides the wall time, the peak RSS of the test process and
+of its child processes (pip, wget) during the round and the bytes written to
+the download directory are saved in the extra_info of each benchmark. RSS is
+sampled from /proc, so it is only recorded on Linux. Use
+--upstream-latency and --upstream-bandwidth to imitate a slow connection,
+e.g. ``--upstream-latency 0.05 --upstream-bandwidth 5000000``.
+"""
+from pathlib import Path
+import itertools
+import os
+import threading
+import pytest
+import offlinedatasci.main
+from offlinedatasci import *
+
+pytest.importorskip("pytest_benchmark")
+
+ROUNDS = 3
+RSS_SAMPLE_INTERVAL = 0.01
+
+def get_rss(pid):
+    """Return the resident set size of a process in bytes and the ids of its child processes.
+
+    Threads that exit while they are listed are skipped. Raises
+    FileNotFoundError or ProcessLookupError if the process itself exited.
+    """
+    with open(f"/proc/{pid}/statm") as statm_file:
+        rss = int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as children_file:
+                children.extend(int(child) for child in children_file.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return rss, children
+
+class RssSampler:
+    """Record the peak RSS of this process and of all its descendants while the context is active.
+
+    Unlike ru_maxrss, which is the peak over the whole life of the process
+    (or of the largest child ever waited for), the peaks start from zero
+    each time the context is entered.
+    """
+
+    def __enter__(self):
+        self.peak_rss = 0
+        self.peak_rss_children = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while True:
+            try:
+                rss, pids = get_rss(os.getpid())
+            except (FileNotFoundError, ProcessLookupError):
+                rss, pids = 0, []
+            children_rss = 0
+            while pids:
+                try:
+                    child_rss, grandchildren = get_rss(pids.pop())
+                except (FileNotFoundError, ProcessLookupError):
+                    continue
+                children_rss += child_rss
+                pids.extend(grandchildren)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_rss_children = max(self.peak_rss_children, children_rss)
+            if self.stopped.wait(RSS_SAMPLE_INTERVAL):
+                return
+
+def get_bytes_written(directory):
+    """Return the size of the files in directory, counting hard linked files once."""
+    files = {}
+    for path in Path(directory).rglob("*"):
+        if path.is_file() and not path.is_symlink():
+            stat = path.stat()
+            files[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(files.values())
+
+@pytest.mark.parametrize("function", [download_all, download_r, download_rstudio, download_python,
+                                      download_python_packages, download_r_packages, download_lessons],
+                         ids=lambda function: function.__name__)
+def test_benchmark_download(benchmark, upstream, tmp_path, function):
+    round_numbers = itertools.count()
+    ods_dirs = []
+    samplers = []
+    measure_rss = os.path.exists(f"/proc/{os.getpid()}/task")
+
+    def setup():
+        offlinedatasci.main.clear_metadata_cache()
+        ods_dirs.append(tmp_path / f"round-{next(round_numbers)}")
+        return (str(ods_dirs[-1]),), {}
+
+    def run(ods_dir):
+        if not measure_rss:
+            return function(ods_dir)
+        with RssSampler() as sampler:
+            function(ods_dir)
+        samplers.append(sampler)
+
+    benchmark.pedantic(run, setup=setup, rounds=ROUNDS)
+    if samplers:
+        benchmark.extra_info["peak_rss"] = max(sampler.peak_rss for sampler in samplers)
+        benchmark.extra_info["peak_rss_children"] = max(sampler.peak_rss_children for sampler in samplers)
+    benchmark.extra_info["bytes_written"] = get_bytes_written(ods_dirs[-1])
+    assert benchmark.extra_info["bytes_written"] > 0
@@ -1,5 +1,70 @@
 from offlinedatasci import *
 from glob import glob
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+import email.utils
+import functools
+import gzip
+import hashlib
+import io
+import offlinedatasci.fetch
+import offlinedatasci.main
+import offlinedatasci.server
+import subprocess
+import sys
+import tarfile
+import threading
+import types
+import pytest
+from offlinedatasci.fetch import CircuitOpenError, TokenBucket
+from offlinedatasci.server import gzip_file_contents, parse_byte_range
+from upstream import make_wheel
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler that honours single byte range requests."""
+    requested_ranges = []
+    response_log = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def log_request(self, code="-", size="-"):
+        self.response_log.append((self.path, int(code)))
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+        self.requested_ranges.append(range_header)
+        size = os.path.getsize(path)
+        start, end = range_header.replace("bytes=", "").split("-")
+        start, end = int(start), int(end) if end else size - 1
+        payload = open(path, "rb").read()[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        return io.BytesIO(payload)
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+@pytest.fixture
+def file_server(tmp_path):
+    served_dir = tmp_path / "served"
+    served_dir.mkdir()
+    RangeRequestHandler.requested_ranges = []
+    RangeRequestHandler.response_log = []
+    handler = functools.partial(RangeRequestHandler, directory=str(served_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served_dir, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
 
 def test_download_r(tmp_path):
     download_r(tmp_path)
@@ -40,4 +105,779 @@ def check_for_empty_folders(folder):
 def test_download_lessons(tmp_path):
     download_lessons(tmp_path)
     empty_folders = check_for_empty_folders(f"{tmp_path}/lessons")
-    assert len(empty_folders) == 0, f"The following folders are empty: {empty_folders}"
\ No newline at end of file
+    assert len(empty_folders) == 0, f"The following folders are empty: {empty_folders}"
+
+def test_download_r_from_upstream(tmp_path, upstream):
+    download_r(tmp_path)
+    assert sorted(os.listdir(tmp_path / "R")) == [f"{upstream.r_version}-arm64.pkg",
+                                                  f"{upstream.r_version}-win.exe",
+                                                  f"{upstream.r_version}-x86_64.pkg"]
+
+def test_download_rstudio_from_upstream(tmp_path, upstream):
+    download_rstudio(tmp_path)
+    assert glob(f"{tmp_path}/rstudio/RStudio-*.dmg")
+    assert glob(f"{tmp_path}/rstudio/RStudio-*.exe")
+
+def test_download_python_from_upstream(tmp_path, upstream):
+    download_python(tmp_path)
+    assert len(os.listdir(tmp_path / "python")) == 4
+    assert f"python/python-{upstream.python_version}-amd64.exe" in read_manifest(tmp_path)["upstream"]
+    assert update_manifest(tmp_path) == []
+
+def test_download_installer_matrix(tmp_path, upstream, monkeypatch):
+    python_matrix = dict(INSTALLER_MATRIX["python"], versions=["3.12", "3.11.9"], keep=1)
+    monkeypatch.setitem(offlinedatasci.main.INSTALLER_MATRIX, "python", python_matrix)
+    (tmp_path / "python").mkdir()
+    for name in ["python-3.12.6-amd64.exe", "python-3.11.8-amd64.exe", "notes.txt"]:
+        (tmp_path / "python" / name).write_text("old")
+    with pytest.warns(UserWarning, match="No python 3.11.9 installer for windows arm64"):
+        installers = download_installer_matrix(tmp_path, ["python", "r"])
+    assert {(installer["product"], installer["version"]) for installer in installers} == {
+        ("python", "3.12.7"), ("python", "3.11.9"), ("r", upstream.r_version.replace("R-", ""))}
+    assert sorted(os.listdir(tmp_path / "python")) == [
+        "notes.txt",
+        "python-3.11.9-amd64.exe", "python-3.11.9-macos11.pkg", "python-3.11.9.exe",
+        "python-3.12.7-amd64.exe", "python-3.12.7-arm64.exe", "python-3.12.7-macos11.pkg", "python-3.12.7.exe"]
+    assert "python/python-3.11.9-macos11.pkg" in read_manifest(tmp_path)["upstream"]
+    assert len(os.listdir(tmp_path / "R")) == 3
+
+@pytest.mark.parametrize("version, release", [("4.4", "4.4.1"), ("4.4.1", "4.4.1"), ("4.4.0", "4.4.0"),
+                                              ("4.3", "4.3.3")])
+def test_find_pinned_r_installers(upstream, version, release):
+    installers = find_installers("r", version)
+    assert {installer["version"] for installer in installers} == {release}
+    assert sorted(posixpath.basename(installer["url"]) for installer in installers) == [
+        f"R-{release}-arm64.pkg", f"R-{release}-win.exe", f"R-{release}-x86_64.pkg"]
+
+def test_find_python_installers_skips_source_only_releases(upstream):
+    installers = find_installers("python", "3.12")
+    assert {installer["version"] for installer in installers} == {upstream.python_version}
+
+def test_find_r_installers_without_index_page(upstream):
+    with pytest.warns(UserWarning, match="No r 4.2.0 installers listed at .*/old/4.2.0/"):
+        with pytest.raises(ValueError, match="No r 4.2.0 installers found"):
+            find_installers("r", "4.2.0")
+
+def test_prune_installers_keeps_newest_versions(tmp_path):
+    (tmp_path / "R").mkdir()
+    for version in ["4.3.3", "4.4.0", "4.4.1", "4.10.0"]:
+        for suffix in ["win.exe", "arm64.pkg"]:
+            (tmp_path / "R" / f"R-{version}-{suffix}").write_text(version)
+    installers = [{"product": "r", "version": "4.3.3", "path": "R/R-4.3.3-win.exe"}]
+    removed = prune_installers(tmp_path, "r", installers, keep=2)
+    assert sorted(path.name for path in removed) == ["R-4.3.3-arm64.pkg", "R-4.4.0-arm64.pkg", "R-4.4.0-win.exe"]
+    assert sorted(os.listdir(tmp_path / "R")) == ["R-4.10.0-arm64.pkg", "R-4.10.0-win.exe", "R-4.3.3-win.exe",
+                                                  "R-4.4.1-arm64.pkg", "R-4.4.1-win.exe"]
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Undo the installers, package sets, lessons and targets registered by a test."""
+    main = offlinedatasci.main
+    monkeypatch.setattr(main, "INSTALLER_MATRIX", dict(main.INSTALLER_MATRIX))
+    monkeypatch.setattr(main, "ARTIFACT_DIRS", list(main.ARTIFACT_DIRS))
+    monkeypatch.setattr(main, "PACKAGE_SETS", {package_type: dict(package_sets)
+                                               for package_type, package_sets in main.PACKAGE_SETS.items()})
+    monkeypatch.setattr(main, "_registered_targets", {})
+    monkeypatch.setattr(main, "_registered_lesson_sources", {})
+
+def test_load_sources(tmp_path, registry):
+    sources_path = tmp_path / "sources.json"
+    sources_path.write_text(json.dumps({
+        "installers": {"python": {"versions": ["3.11", "3.12"], "keep": 3}},
+        "package-sets": {"r-packages": {"databases": ["RSQLite", "DBI"]}},
+        "lessons": {"local-carpentry": {"wget_args": ["-r", "-k"], "lessons": ["http://127.0.0.1/lesson/"]}}}))
+    assert load_sources(sources_path) == []
+    assert offlinedatasci.main.INSTALLER_MATRIX["python"]["versions"] == ["3.11", "3.12"]
+    assert offlinedatasci.main.INSTALLER_MATRIX["python"]["keep"] == 3
+    assert sorted(package_selection("r-packages", ["databases", "dplyr"])) == ["DBI", "RSQLite", "dplyr"]
+    lesson_sources = get_lesson_sources()
+    assert "data-carpentry" in lesson_sources
+    assert lesson_sources["local-carpentry"]["lessons"] == ["http://127.0.0.1/lesson/"]
+
+    sources_path.write_text(json.dumps({"installers": {"quarto": {"directory": "quarto"}}}))
+    with pytest.raises(ValueError, match="platforms, index_urls"):
+        load_sources(sources_path)
+    sources_path.write_text(json.dumps({"packages": {}}))
+    with pytest.raises(ValueError, match="Unknown sections"):
+        load_sources(sources_path)
+
+def test_registered_installer_from_upstream(tmp_path, upstream, registry):
+    sources_path = tmp_path / "sources.json"
+    sources_path.write_text(json.dumps({"installers": {"r-windows": {
+        "label": "R for Windows", "directory": "R-windows", "keep": 1,
+        "index_urls": [f"{upstream.url}/cran/bin/windows/base/"],
+        "platforms": [{"os": "windows", "arch": "x86_64", "pattern": r"R-{version}-win\.exe"}]}}}))
+    assert load_sources(sources_path) == ["r-windows"]
+    (tmp_path / "R-windows").mkdir()
+    (tmp_path / "R-windows" / "R-4.3.3-win.exe").write_text("old")
+    results = download_targets(tmp_path, ["r-windows"])
+    assert results["r-windows"]["label"] == "R for Windows"
+    assert results["r-windows"]["error"] is None
+    assert os.listdir(tmp_path / "R-windows") == ["R-4.4.1-win.exe"]
+    assert "R-windows/R-4.4.1-win.exe" in read_manifest(tmp_path)["files"]
+    assert plan_download_targets(tmp_path, ["r-windows"])["r-windows"]["stale"] is False
+
+def read_archive(path):
+    """Return the members of a tar archive and the contents of its regular files.
+
+    .tar.zst archives are decompressed with zstandard.
+    """
+    members = {}
+    contents = {}
+    with open(path, "rb") as archive_file:
+        if path.name.endswith(".tar.zst"):
+            archive_file = offlinedatasci.main.get_zstandard().ZstdDecompressor().stream_reader(archive_file)
+        with tarfile.open(fileobj=archive_file, mode="r|*") as archive:
+            for member in archive:
+                members[member.name] = member
+                if member.isfile():
+                    contents[member.name] = archive.extractfile(member).read()
+    return members, contents
+
+@pytest.mark.parametrize("compression", ["zst", "gz", "xz"])
+def test_export_ods_dir(tmp_path, compression):
+    if compression == "zst":
+        pytest.importorskip("zstandard")
+    ods_dir = tmp_path / "ods"
+    for relative_path in ["R/R-4.4.1-win.exe", "lessons/a/theme.css", "pypi/pandas/index.html",
+                          ".offlinedatasci/state.json", "python/python-3.12.7.exe.part"]:
+        (ods_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (ods_dir / relative_path).write_text(relative_path * 100)
+    (ods_dir / "lessons" / "b").mkdir()
+    os.link(ods_dir / "lessons" / "a" / "theme.css", ods_dir / "lessons" / "b" / "theme.css")
+
+    export = export_ods_dir(ods_dir, tmp_path / "kiosk", compression=compression, workers=2)
+    assert export["path"] == tmp_path / f"kiosk{EXPORT_SUFFIXES[compression]}"
+    members, contents = read_archive(export["path"])
+    assert sorted(members) == ["R/R-4.4.1-win.exe", "lessons/a/theme.css", "lessons/b/theme.css",
+                               "manifest.json", "pypi/pandas/index.html"]
+    assert members["lessons/b/theme.css"].islnk()
+    assert sorted(read_manifest(ods_dir)["files"]) == ["R/R-4.4.1-win.exe", "lessons/a/theme.css",
+                                                       "lessons/b/theme.css", "pypi/pandas/index.html"]
+
+    previous_manifest = tmp_path / "previous.json"
+    shutil.copy(ods_dir / MANIFEST_FILENAME, previous_manifest)
+    (ods_dir / "R" / "R-4.4.1-win.exe").write_text("updated installer")
+    (ods_dir / "python" / "python-3.12.7.exe").write_text("installer")
+    (ods_dir / "lessons" / "b" / "theme.css").unlink()
+    delta = export_ods_dir(ods_dir, ods_dir / f"delta{EXPORT_SUFFIXES[compression]}", since=previous_manifest)
+    assert delta["removed"] == ["lessons/b/theme.css"]
+    members, contents = read_archive(delta["path"])
+    assert sorted(members) == ["R/R-4.4.1-win.exe", "manifest.json", "python/python-3.12.7.exe", "removed.txt"]
+    assert contents["removed.txt"] == b"lessons/b/theme.css\n"
+
+    (ods_dir / "R" / "R-4.4.1-win.exe").write_text("another installer")
+    (ods_dir / "miniCRAN" / "src" / "contrib").mkdir(parents=True)
+    (ods_dir / "miniCRAN" / "src" / "contrib" / "DBI_1.2.3.tar.gz").write_text("package")
+    second_delta = export_ods_dir(ods_dir, tmp_path / "second", since=previous_manifest, compression=compression)
+    assert sorted(second_delta["files"]) == ["R/R-4.4.1-win.exe", "manifest.json",
+                                             "miniCRAN/src/contrib/DBI_1.2.3.tar.gz", "python/python-3.12.7.exe"]
+
+def test_download_python_packages_from_upstream(tmp_path, upstream):
+    download_python_packages(tmp_path, ["pandas"], platforms=["win_amd64"])
+    assert sorted(path.name for path in (tmp_path / "pythonlibraries").glob("*.whl")) == [
+        "numpy-1.0.0-py3-none-any.whl", "pandas-1.0.0-py3-none-any.whl", "python_dateutil-1.0.0-py3-none-any.whl"]
+    assert (tmp_path / "pypi" / "pandas" / "index.html").exists()
+
+def test_download_python_packages_after_interrupted_download(tmp_path, upstream):
+    staging_dir = tmp_path / ".offlinedatasci" / "partial" / "pythonlibraries"
+    staging_dir.mkdir(parents=True)
+    (staging_dir / "numpy-0.9.0-py3-none-any.whl.part").write_bytes(b"stale")
+    (tmp_path / "pythonlibraries").mkdir()
+    (tmp_path / "pythonlibraries" / "foo-1.0.0-py3-none-any.whl.part").write_bytes(b"left over")
+    download_python_packages(tmp_path, ["pandas"], platforms=["win_amd64"])
+    assert sorted(path.name for path in (tmp_path / "pythonlibraries").glob("*.whl")) == [
+        "numpy-1.0.0-py3-none-any.whl", "pandas-1.0.0-py3-none-any.whl", "python_dateutil-1.0.0-py3-none-any.whl"]
+    assert not list((tmp_path / "pythonlibraries").glob("*.part"))
+    assert list(staging_dir.iterdir()) == []
+
+def test_download_r_packages_from_upstream(tmp_path, upstream):
+    download_r_packages(tmp_path, ["RSQLite"], engine="python")
+    local_contrib = tmp_path / "miniCRAN" / "src" / "contrib"
+    assert sorted(path.name for path in local_contrib.glob("*.tar.gz")) == ["DBI_1.0.0.tar.gz",
+                                                                            "RSQLite_1.0.0.tar.gz",
+                                                                            "rlang_1.0.0.tar.gz"]
+    assert len(list((tmp_path / "miniCRAN" / "bin").glob("**/*.tgz"))) == 6
+    assert "miniCRAN/src/contrib/DBI_1.0.0.tar.gz" in read_manifest(tmp_path)["upstream"]
+
+def test_package_fingerprints_cover_dependencies_and_added_packages(tmp_path, upstream, monkeypatch):
+    monkeypatch.setattr("offlinedatasci.main.PYTHON_PACKAGE_PLATFORMS", ["win_amd64"])
+    monkeypatch.setattr("offlinedatasci.main.DEFAULT_R_PACKAGES", ["DBI"])
+    monkeypatch.setattr("offlinedatasci.main.DEFAULT_PYTHON_PACKAGES", ["numpy"])
+    download_r_packages(tmp_path, ["ggplot2"], engine="python")
+    assert get_r_packages_fingerprint(tmp_path)["packages"] == {"DBI": "1.0.0", "ggplot2": "1.0.0", "rlang": "1.0.0"}
+    download_python_packages(tmp_path, ["pandas"])
+    assert get_python_packages_fingerprint(tmp_path)["files"] == [
+        "numpy-1.0.0-py3-none-any.whl", "pandas-1.0.0-py3-none-any.whl", "python_dateutil-1.0.0-py3-none-any.whl"]
+
+def test_download_lessons_from_upstream(tmp_path, upstream):
+    results = download_lessons(tmp_path, engine="python")
+    assert [result["returncode"] for result in results] == [0, 0]
+    lesson_path = tmp_path / "lessons" / "data-carpentry" / "lessons"
+    assert (lesson_path / "shell-lesson" / "episode-4.html").exists()
+    theme_files = list(lesson_path.glob("*/assets/theme.css"))
+    assert len({path.stat().st_ino for path in theme_files}) == 1
+
+def test_download_all_from_upstream(tmp_path, upstream, monkeypatch):
+    monkeypatch.setattr("offlinedatasci.main.PYTHON_PACKAGE_PLATFORMS", ["win_amd64"])
+    results = download_all(tmp_path)
+    assert {target: result["error"] for target, result in results.items()} == dict.fromkeys(results)
+    assert all(os.listdir(tmp_path / directory) for directory in ARTIFACT_DIRS)
+    results = download_all(tmp_path)
+    assert all(result.get("skipped") for result in results.values())
+
+def test_download_targets_isolates_errors(tmp_path, monkeypatch):
+    calls = []
+    def succeed(ods_dir):
+        calls.append(ods_dir)
+    def fail(ods_dir):
+        raise RuntimeError("no network")
+    monkeypatch.setattr("offlinedatasci.main.get_download_targets",
+                        lambda: {"good": ("Good", succeed), "bad": ("Bad", fail)})
+    results = download_targets(tmp_path, ["all"], max_workers=2)
+    assert list(results) == ["good", "bad"]
+    assert results["good"]["error"] is None
+    assert isinstance(results["bad"]["error"], RuntimeError)
+    assert calls == [tmp_path]
+
+def test_download_targets_skips_up_to_date_targets(tmp_path, monkeypatch):
+    calls = []
+    upstream = {"version": "4.4.1"}
+    def download(ods_dir):
+        calls.append(upstream["version"])
+        (Path(ods_dir) / "R").mkdir(exist_ok=True)
+        (Path(ods_dir) / "R" / f"R-{upstream['version']}.pkg").write_text("installer")
+    monkeypatch.setattr("offlinedatasci.main.get_download_targets", lambda: {"r": ("R", download)})
+    monkeypatch.setattr("offlinedatasci.main.get_target_fingerprints",
+                        lambda: {"r": ("R", lambda ods_dir: dict(upstream))})
+    assert plan_download_targets(tmp_path, ["r"])["r"]["reason"] == "never downloaded"
+    download_targets(tmp_path, ["r"])
+    plan = plan_download_targets(tmp_path, ["r"])
+    assert plan["r"]["stale"] is False
+    assert download_targets(tmp_path, ["r"])["r"]["skipped"]
+    assert calls == ["4.4.1"]
+
+    upstream["version"] = "4.4.2"
+    assert plan_download_targets(tmp_path, ["r"])["r"]["reason"] == "upstream changed"
+    download_targets(tmp_path, ["r"])
+    assert calls == ["4.4.1", "4.4.2"]
+    shutil.rmtree(tmp_path / "R")
+    assert plan_download_targets(tmp_path, ["r"])["r"]["reason"] == "files missing"
+    assert plan_download_targets(tmp_path, ["r"], force=True)["r"]["stale"]
+    state = read_state(tmp_path)
+    assert state["targets"]["r"]["fingerprint"] == {"version": "4.4.2"}
+
+def test_download_file_parallel_ranges(tmp_path, file_server):
+    served_dir, base_url = file_server
+    payload = os.urandom(300000)
+    (served_dir / "installer.pkg").write_bytes(payload)
+    destination = tmp_path / "installer.pkg"
+    download_file(f"{base_url}/installer.pkg", destination, parts=3, parallel_threshold=1000)
+    assert destination.read_bytes() == payload
+    assert len(RangeRequestHandler.requested_ranges) == 3
+    assert not glob(f"{tmp_path}/installer.pkg.part*")
+
+def test_download_events_are_logged(tmp_path, file_server):
+    served_dir, base_url = file_server
+    (served_dir / "installer.pkg").write_bytes(os.urandom(100000))
+    log_path = tmp_path / "events.jsonl"
+    profile_dir = tmp_path / "profiles"
+    hook = cprofile_hook(profile_dir)
+    add_profiling_hook(hook)
+    try:
+        with event_log(log_path), progress_display(io.StringIO()) as display, stage("installers"):
+            download_file(f"{base_url}/installer.pkg", tmp_path / "installer.pkg", parts=2, parallel_threshold=1000)
+    finally:
+        remove_profiling_hook(hook)
+    events = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [event["event"] for event in events if event["event"] != "file_progress"] == [
+        "stage_start", "file_start", "file_end", "stage_end"]
+    file_end = events[-2]
+    assert file_end["bytes"] == 100000 and file_end["retries"] == 0 and file_end["error"] is None
+    assert file_end["throughput"] > 0
+    assert events[-1]["stage"] == "installers" and events[-1]["seconds"] > 0
+    assert display.files_done == 1 and display.bytes_done == 100000
+    assert (profile_dir / "installers.prof").exists()
+
+def test_event_log_keeps_only_the_previous_run(tmp_path):
+    log_path = tmp_path / "events.jsonl"
+    for run in range(3):
+        with event_log(log_path):
+            report_event("stage_start", stage=f"run {run}")
+    assert [json.loads(line)["stage"] for line in log_path.read_text().splitlines()] == ["run 2"]
+    previous_lines = (tmp_path / "events.1.jsonl").read_text().splitlines()
+    assert [json.loads(line)["stage"] for line in previous_lines] == ["run 1"]
+
+class FlakyRequestHandler(BaseHTTPRequestHandler):
+    """Handler answering 503 to the first failures requests."""
+    failures = 0
+    requests_seen = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        FlakyRequestHandler.requests_seen += 1
+        status = 503 if FlakyRequestHandler.requests_seen <= self.failures else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+def test_fetch_session_retries_server_errors(monkeypatch):
+    monkeypatch.setattr("offlinedatasci.fetch.FETCH_BACKOFF_BASE", 0.01)
+    FlakyRequestHandler.failures = 2
+    FlakyRequestHandler.requests_seen = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    events = []
+    add_event_listener(events.append)
+    try:
+        response = get_session().get(f"http://127.0.0.1:{server.server_address[1]}/")
+    finally:
+        remove_event_listener(events.append)
+        server.shutdown()
+        server.server_close()
+    assert response.status_code == 200
+    assert FlakyRequestHandler.requests_seen == 3
+    assert [event["reason"] for event in events if event["event"] == "retry"] == ["HTTP 503", "HTTP 503"]
+
+def test_fetch_session_circuit_breaker(monkeypatch):
+    monkeypatch.setattr("offlinedatasci.fetch.FETCH_RETRIES", 0)
+    monkeypatch.setattr("offlinedatasci.fetch.CIRCUIT_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr("offlinedatasci.fetch._host_circuits", {})
+    for attempt in range(2):
+        with pytest.raises(requests.ConnectionError) as error:
+            get_session().get("http://127.0.0.1:9/")
+        assert not isinstance(error.value, CircuitOpenError)
+    with pytest.raises(CircuitOpenError):
+        get_session().get("http://127.0.0.1:9/")
+
+def test_import_does_not_load_heavy_dependencies():
+    code = ("import sys, offlinedatasci; "
+            "print([name for name in ['airium', 'asyncio', 'brotli', 'bs4', 'http.server', 'lxml', 'pypi_mirror', 'requests', 'zstandard'] "
+            "if name in sys.modules])")
+    assert subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                          text=True).stdout.strip() == "[]"
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(20, 1)
+    start_time = time.perf_counter()
+    for request in range(5):
+        bucket.acquire()
+    assert time.perf_counter() - start_time >= 0.19
+
+def test_download_file_resumes_partial_download(tmp_path, file_server):
+    served_dir, base_url = file_server
+    payload = os.urandom(50000)
+    (served_dir / "installer.exe").write_bytes(payload)
+    destination = tmp_path / "installer.exe"
+    (tmp_path / "installer.exe.part").write_bytes(payload[:20000])
+    last_modified = email.utils.formatdate((served_dir / "installer.exe").stat().st_mtime, usegmt=True)
+    (tmp_path / "installer.exe.part.validator").write_text(last_modified)
+    download_file(f"{base_url}/installer.exe", destination)
+    assert destination.read_bytes() == payload
+    assert RangeRequestHandler.requested_ranges == ["bytes=20000-49999"]
+    assert not glob(f"{tmp_path}/installer.exe.part*")
+
+def test_download_file_restarts_when_file_changed(tmp_path, file_server):
+    served_dir, base_url = file_server
+    payload = os.urandom(50000)
+    (served_dir / "installer.exe").write_bytes(payload)
+    destination = tmp_path / "installer.exe"
+    (tmp_path / "installer.exe.part").write_bytes(os.urandom(20000))
+    (tmp_path / "installer.exe.part.validator").write_text("Mon, 01 Jan 2024 00:00:00 GMT")
+    download_file(f"{base_url}/installer.exe", destination)
+    assert destination.read_bytes() == payload
+    assert RangeRequestHandler.requested_ranges == ["bytes=0-49999"]
+
+class GzipEncodingRequestHandler(BaseHTTPRequestHandler):
+    """Handler sending a gzip file with Content-Encoding: gzip, as some servers do for .tar.gz files."""
+    body = gzip.compress(b"tarball" * 1000)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.do_HEAD()
+        self.wfile.write(self.body)
+
+def test_download_file_keeps_content_encoding(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GzipEncodingRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        download_file(f"http://127.0.0.1:{server.server_address[1]}/data.tar.gz", tmp_path / "data.tar.gz")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert (tmp_path / "data.tar.gz").read_bytes() == GzipEncodingRequestHandler.body
+
+def test_fetch_metadata_caches_and_revalidates(tmp_path, file_server):
+    served_dir, base_url = file_server
+    (served_dir / "index.html").write_text("R-4.4.1-win.exe")
+    url = f"{base_url}/index.html"
+    clear_metadata_cache()
+    assert fetch_metadata(url, tmp_path) == "R-4.4.1-win.exe"
+    assert fetch_metadata(url, tmp_path) == "R-4.4.1-win.exe"
+    assert RangeRequestHandler.response_log == [("/index.html", 200)]
+    clear_metadata_cache()
+    fetch_metadata(url, tmp_path)
+    assert len(RangeRequestHandler.response_log) == 1
+    clear_metadata_cache()
+    assert fetch_metadata(url, tmp_path, ttl=0) == "R-4.4.1-win.exe"
+    assert RangeRequestHandler.response_log[-1] == ("/index.html", 304)
+    clear_metadata_cache()
+
+def test_parse_python_version_compares_numerically():
+    with open(FIXTURES_DIR / "python-ftp-index.html") as index_page:
+        assert parse_python_version(index_page, "3.12") == "3.12.11"
+    with open(FIXTURES_DIR / "python-ftp-index.html") as index_page:
+        assert parse_python_version(index_page, "3.1") == "3.1.5"
+
+def test_find_r_current_version_stops_early(tmp_path, file_server):
+    served_dir, base_url = file_server
+    shutil.copy(FIXTURES_DIR / "cran-macosx.html", served_dir / "macosx.html")
+    url = f"{base_url}/macosx.html"
+    clear_metadata_cache()
+    assert find_r_current_version(url, tmp_path) == "R-4.4.10"
+    assert offlinedatasci.main._metadata_cache[url]["complete"]
+    assert fetch_metadata(url, tmp_path).endswith("</html>")
+    assert len(RangeRequestHandler.response_log) == 1
+    clear_metadata_cache()
+    assert fetch_metadata(url, tmp_path).endswith("</html>")
+    assert len(RangeRequestHandler.response_log) == 1
+    clear_metadata_cache()
+
+def test_manifest_detects_changed_files(tmp_path):
+    (tmp_path / "R").mkdir()
+    (tmp_path / "python").mkdir()
+    (tmp_path / "R" / "R-4.4.1-win.exe").write_bytes(b"installer")
+    (tmp_path / "python" / "python-3.12.10.exe").write_bytes(b"python")
+    (tmp_path / "python" / "python-3.12.10.pkg.part").write_bytes(b"partial")
+    record_upstream_checksums(tmp_path, {"python/python-3.12.10.exe": ("md5", "0" * 32)})
+    mismatches = update_manifest(tmp_path, workers=2)
+    assert mismatches == ["python/python-3.12.10.exe"]
+    manifest = read_manifest(tmp_path)
+    assert sorted(manifest["files"]) == ["R/R-4.4.1-win.exe", "python/python-3.12.10.exe"]
+    assert manifest["files"]["R/R-4.4.1-win.exe"]["sha256"] == hashlib.sha256(b"installer").hexdigest()
+
+    (tmp_path / "R" / "R-4.4.1-win.exe").write_bytes(b"corrupted")
+    (tmp_path / "python" / "python-3.12.10.exe").unlink()
+    (tmp_path / "R" / "R-4.4.1-arm64.pkg").write_bytes(b"new")
+    problems = verify_manifest(tmp_path)
+    assert problems["modified"] == ["R/R-4.4.1-win.exe"]
+    assert problems["missing"] == ["python/python-3.12.10.exe"]
+    assert problems["untracked"] == ["R/R-4.4.1-arm64.pkg"]
+
+def test_parse_dcf():
+    lines = ["Package: RSQLite", "Version: 2.3.7", "Imports: bit64, blob (>= 1.2.0),", "        DBI", "",
+             "Package: DBI", "Version: 1.2.3"]
+    records = list(parse_dcf(lines))
+    assert records[0]["Imports"] == "bit64, blob (>= 1.2.0), DBI"
+    assert records[1] == {"Package": "DBI", "Version": "1.2.3"}
+
+def test_update_pypi_mirror_is_incremental(tmp_path):
+    download_dir = tmp_path / "pythonlibraries"
+    pypi_dir = tmp_path / "pypi"
+    download_dir.mkdir()
+    make_wheel(download_dir, "six", "1.16.0")
+    make_wheel(download_dir, "numpy", "2.0.0", "cp312-cp312-win_amd64")
+    update_pypi_mirror(download_dir, pypi_dir)
+    assert (pypi_dir / "six" / "six-1.16.0-py3-none-any.whl").stat().st_nlink == 2
+    assert 'href="six/index.html"' in (pypi_dir / "index.html").read_text()
+    six_index_mtime = (pypi_dir / "six" / "index.html").stat().st_mtime_ns
+
+    make_wheel(download_dir, "numpy", "2.0.1", "cp312-cp312-win_amd64")
+    update_pypi_mirror(download_dir, pypi_dir)
+    assert "numpy-2.0.1" in (pypi_dir / "numpy" / "index.html").read_text()
+    assert (pypi_dir / "six" / "index.html").stat().st_mtime_ns == six_index_mtime
+
+@pytest.fixture
+def ods_server(tmp_path):
+    ods_dir = tmp_path / "ods"
+    ods_dir.mkdir()
+    server = make_ods_server(ods_dir, "127.0.0.1", 0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield ods_dir, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_serve_ods_dir(ods_server):
+    ods_dir, base_url = ods_server
+    (ods_dir / "lessons").mkdir()
+    (ods_dir / "lessons" / "index.html").write_text("<h1>Lessons</h1>" * 100)
+    (ods_dir / ".offlinedatasci").mkdir()
+    (ods_dir / ".offlinedatasci" / "state.json").write_text("{}")
+    (ods_dir / "R").mkdir()
+    (ods_dir / "R" / "R-4.4.1-win.exe").write_bytes(bytes(range(256)) * 4)
+
+    response = requests.get(f"{base_url}/lessons/")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.text == "<h1>Lessons</h1>" * 100
+    response = requests.get(f"{base_url}/lessons/", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert requests.get(f"{base_url}/lessons", allow_redirects=False).headers["Location"] == "/lessons/"
+    assert requests.get(f"{base_url}/.offlinedatasci/state.json").status_code == 404
+
+    installer_url = f"{base_url}/R/R-4.4.1-win.exe"
+    response = requests.get(installer_url, headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 1000-1023/1024"
+    assert response.content == bytes(range(232, 256))
+    assert requests.get(installer_url, headers={"Range": "bytes=2000-"}).status_code == 416
+    response = requests.get(installer_url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and len(response.content) == 1024
+
+def test_serve_pypi_mirror_to_pip(ods_server, tmp_path):
+    ods_dir, base_url = ods_server
+    download_dir = tmp_path / "pythonlibraries"
+    download_dir.mkdir()
+    make_wheel(download_dir, "six", "1.16.0")
+    update_pypi_mirror(download_dir, ods_dir / "pypi")
+    subprocess.run([sys.executable, "-m", "pip", "download", "--isolated", "--no-deps",
+                    "--index-url", f"{base_url}/pypi/", "-d", tmp_path / "downloads", "six"],
+                   check=True, capture_output=True)
+    assert (tmp_path / "downloads" / "six-1.16.0-py3-none-any.whl").exists()
+
+def test_parse_byte_range():
+    assert parse_byte_range("bytes=0-499", 1000) == (0, 499)
+    assert parse_byte_range("bytes=500-", 1000) == (500, 999)
+    assert parse_byte_range("bytes=-100", 1000) == (900, 999)
+    assert parse_byte_range("bytes=0-9,20-29", 1000) is None
+    with pytest.raises(ValueError):
+        parse_byte_range("bytes=1000-", 1000)
+
+def test_update_pypi_mirror_writes_wheel_metadata(tmp_path):
+    download_dir = tmp_path / "pythonlibraries"
+    pypi_dir = tmp_path / "pypi"
+    download_dir.mkdir()
+    make_wheel(download_dir, "six", "1.16.0")
+    update_pypi_mirror(download_dir, pypi_dir)
+    metadata = (pypi_dir / "six" / "six-1.16.0-py3-none-any.whl.metadata").read_bytes()
+    assert metadata.startswith(b"Metadata-Version: 2.1\nName: six\n")
+    metadata_hash = hashlib.sha256(metadata).hexdigest()
+    assert f'data-core-metadata="sha256={metadata_hash}"' in (pypi_dir / "six" / "index.html").read_text()
+
+def test_precompress_files(tmp_path):
+    (tmp_path / "index.html").write_text("<p>Lesson</p>" * 100)
+    (tmp_path / "small.css").write_text("p {}")
+    (tmp_path / "plot.png").write_bytes(b"png" * 1000)
+    assert precompress_files(tmp_path) == (2 if offlinedatasci.main.get_brotli() else 1)
+    assert gzip.decompress((tmp_path / "index.html.gz").read_bytes()) == (tmp_path / "index.html").read_bytes()
+    assert not (tmp_path / "small.css.gz").exists()
+    assert not (tmp_path / "plot.png.gz").exists()
+    assert precompress_files(tmp_path) == 0
+    (tmp_path / "index.html").write_text("<p>Updated lesson</p>" * 100)
+    precompress_files(tmp_path)
+    assert gzip.decompress((tmp_path / "index.html.gz").read_bytes()) == (tmp_path / "index.html").read_bytes()
+
+def test_serve_precompressed_files(ods_server):
+    brotli = pytest.importorskip("brotli")
+    ods_dir, base_url = ods_server
+    (ods_dir / "pypi" / "six").mkdir(parents=True)
+    index = "<a href='six-1.16.0-py3-none-any.whl'>six-1.16.0-py3-none-any.whl</a>\n" * 50
+    (ods_dir / "pypi" / "six" / "index.html").write_text(index)
+    precompress_files(ods_dir / "pypi")
+    response = requests.get(f"{base_url}/pypi/six/index.html", headers={"Accept-Encoding": "br"}, stream=True)
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.raw.read()).decode() == index
+
+def test_precompress_files_keeps_cran_packages_index(tmp_path):
+    contrib_dir = tmp_path / "miniCRAN" / "src" / "contrib"
+    contrib_dir.mkdir(parents=True)
+    (contrib_dir / "PACKAGES").write_text("Package: DBI\nVersion: 1.2.3\n\n" * 50)
+    # Written by CRAN tooling with its own compression level and timestamp
+    packages_gz = gzip.compress((contrib_dir / "PACKAGES").read_bytes(), compresslevel=6, mtime=1)
+    (contrib_dir / "PACKAGES.gz").write_bytes(packages_gz)
+    assert precompress_files(tmp_path / "miniCRAN") == 0
+    assert (contrib_dir / "PACKAGES.gz").read_bytes() == packages_gz
+    assert not (contrib_dir / "PACKAGES.br").exists()
+
+def test_gzip_file_contents_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr("offlinedatasci.server._gzip_cache", {})
+    monkeypatch.setattr("offlinedatasci.server.COMPRESS_CACHE_SIZE", 2500)
+    paths = []
+    for name in ["a.html", "b.html", "c.html"]:
+        paths.append(tmp_path / name)
+        paths[-1].write_bytes(os.urandom(1000))
+    bodies = [gzip_file_contents(str(path), path.stat().st_mtime_ns, 1000) for path in paths]
+    assert gzip.decompress(bodies[0]) == paths[0].read_bytes()
+    assert list(offlinedatasci.server._gzip_cache) == [(str(path), path.stat().st_mtime_ns, 1000)
+                                                     for path in paths[1:]]
+
+def test_download_python_packages_fetches_shared_files_once(tmp_path, monkeypatch):
+    wheel_dir = tmp_path / "wheels"
+    wheel_dir.mkdir()
+    shared = make_wheel(wheel_dir, "six", "1.16.0")
+    def resolve(packages, platform, python_version):
+        platform_wheel = make_wheel(wheel_dir, "numpy", "2.0.0", f"cp312-cp312-{platform}")
+        return [{"url": wheel.as_uri(), "filename": wheel.name, "sha256": None}
+                for wheel in [shared, platform_wheel]]
+    downloaded = []
+    def download(package_file, download_dir, staging_dir=None):
+        downloaded.append(package_file["filename"])
+        shutil.copy(package_file["url"].replace("file://", ""), download_dir)
+    monkeypatch.setattr("offlinedatasci.main.resolve_python_packages", resolve)
+    monkeypatch.setattr("offlinedatasci.main.download_python_package_file", download)
+    download_python_packages(tmp_path, ["numpy", "six"],
+                             platforms=["win_amd64", "manylinux_2_17_x86_64"],
+                             python_versions=["3.12"])
+    assert sorted(downloaded) == ["numpy-2.0.0-cp312-cp312-manylinux_2_17_x86_64.whl",
+                                  "numpy-2.0.0-cp312-cp312-win_amd64.whl",
+                                  "six-1.16.0-py3-none-any.whl"]
+    assert glob(f"{tmp_path}/pypi/numpy/*.whl")
+
+def test_download_python_packages_pip_failures(tmp_path, monkeypatch):
+    mirrored = []
+    monkeypatch.setattr("offlinedatasci.main.pypi_mirror", types.SimpleNamespace(
+        download=lambda **kwargs: mirrored.append(kwargs)))
+    monkeypatch.setattr("offlinedatasci.main.PYPI_INDEX_URL", "http://127.0.0.1/simple/")
+    def resolve(packages, platform, python_version):
+        raise subprocess.CalledProcessError(1, ["pip3"])
+    monkeypatch.setattr("offlinedatasci.main.resolve_python_packages", resolve)
+    monkeypatch.setattr("offlinedatasci.main.pip_supports_report", lambda: True)
+    with pytest.raises(subprocess.CalledProcessError):
+        download_python_packages(tmp_path, ["numpy"], platforms=["win_amd64"], python_versions=["3.12"])
+    assert mirrored == []
+
+    monkeypatch.setattr("offlinedatasci.main.pip_supports_report", lambda: False)
+    monkeypatch.setattr("offlinedatasci.main.update_pypi_mirror", lambda download_dir, pypi_dir: None)
+    download_python_packages(tmp_path, ["numpy"], platforms=["win_amd64"], python_versions=["3.12"])
+    assert [kwargs["index_url"] for kwargs in mirrored] == ["http://127.0.0.1/simple/"]
+
+def test_mirror_cran_packages_without_r(tmp_path, file_server, monkeypatch):
+    served_dir, base_url = file_server
+    contrib = served_dir / "src" / "contrib"
+    contrib.mkdir(parents=True)
+    (contrib / "PACKAGES").write_text(
+        "Package: RSQLite\nVersion: 2.3.7\nDepends: R (>= 3.1.0)\nImports: DBI (>= 1.2.0),\n    methods\n\n"
+        "Package: DBI\nVersion: 1.2.3\nDepends: methods, R (>= 3.0.0)\nMD5sum: 0123\n\n"
+        "Package: shiny\nVersion: 1.9.1\n")
+    for tarball in ["RSQLite_2.3.7.tar.gz", "DBI_1.2.3.tar.gz", "shiny_1.9.1.tar.gz"]:
+        (contrib / tarball).write_bytes(tarball.encode())
+    monkeypatch.setattr("offlinedatasci.main.CRAN_URL", f"{base_url}/")
+    clear_metadata_cache()
+    mirror_cran_packages(tmp_path, ["RSQLite"], "4.4", types=["source"])
+    clear_metadata_cache()
+    local_contrib = tmp_path / "miniCRAN" / "src" / "contrib"
+    assert sorted(path.name for path in local_contrib.glob("*.tar.gz")) == ["DBI_1.2.3.tar.gz", "RSQLite_2.3.7.tar.gz"]
+    records = list(parse_dcf((local_contrib / "PACKAGES").read_text().splitlines()))
+    assert [record["Package"] for record in records] == ["DBI", "RSQLite"]
+    assert gzip.decompress((local_contrib / "PACKAGES.gz").read_bytes()).decode() == (local_contrib / "PACKAGES").read_text()
+
+def test_download_lessons_reports_failures(tmp_path, file_server):
+    served_dir, base_url = file_server
+    (served_dir / "shell-lesson").mkdir()
+    (served_dir / "shell-lesson" / "index.html").write_text('<a href="episode.html">Episode</a>')
+    (served_dir / "shell-lesson" / "episode.html").write_text("<h1>Episode</h1>")
+    lesson_sources = {"test-carpentry": {
+        "wget_args": ["-r", "-k", "-N", "--no-parent", "--no-host-directories"],
+        "lessons": [f"{base_url}/shell-lesson/", "http://127.0.0.1:9/unreachable-lesson/"]}}
+    with pytest.raises(RuntimeError, match="1 of 2 lessons failed"):
+        download_lessons(tmp_path, max_workers=2, host_limits={"127.0.0.1": 1},
+                         lesson_sources=lesson_sources)
+    assert (tmp_path / "lessons" / "test-carpentry" / "shell-lesson" / "episode.html").exists()
+    assert (tmp_path / "lessons" / "index.html").exists()
+    assert glob(f"{tmp_path}/.offlinedatasci/logs/lessons/*unreachable-lesson.log")
+
+def test_lesson_sources_are_packaged():
+    lesson_sources = get_lesson_sources()
+    assert set(lesson_sources) == {"data-carpentry", "library-carpentry", "software-carpentry"}
+    assert all(source["lessons"] for source in lesson_sources.values())
+
+def test_deduplicate_files(tmp_path):
+    theme = b"theme" * 1000
+    for lesson in ["shell-novice", "git-novice", "r-novice"]:
+        (tmp_path / lesson / "assets").mkdir(parents=True)
+        (tmp_path / lesson / "assets" / "theme.css").write_bytes(theme)
+        (tmp_path / lesson / "assets" / "small.js").write_bytes(b"small")
+        (tmp_path / lesson / "index.html").write_bytes(lesson.encode() * 1000)
+    saved = deduplicate_files(tmp_path, workers=1)
+    assert saved == {"files": 2, "bytes_saved": 2 * len(theme)}
+    theme_files = list(tmp_path.glob("*/assets/theme.css"))
+    assert len({path.stat().st_ino for path in theme_files}) == 1
+    assert all(path.read_bytes() == theme for path in theme_files)
+    assert len({path.stat().st_ino for path in tmp_path.glob("*/index.html")}) == 3
+    assert deduplicate_files(tmp_path, workers=1) == {"files": 0, "bytes_saved": 0}
+
+def test_add_lesson_index_page(tmp_path):
+    lesson_path = tmp_path / "lessons"
+    for source, lesson in [("software-carpentry", "shell-novice"), ("data-carpentry", "R-ecology-lesson")]:
+        (lesson_path / source / lesson).mkdir(parents=True)
+        (lesson_path / source / lesson / "index.html").write_text(
+            f"<html><head><title>{lesson} & more</title></head><body><h1>Setup</h1></body></html>")
+    (lesson_path / "software-carpentry" / "shell-novice" / "episode.html").write_text(
+        "<title>Pipes</title><h1>Pipes and Filters</h1><h2>Exercises</h2>")
+    catalogue = add_lesson_index_page(lesson_path)
+    assert list(catalogue) == ["data-carpentry/R-ecology-lesson", "software-carpentry/shell-novice"]
+    assert catalogue["software-carpentry/shell-novice"]["title"] == "shell-novice & more"
+    index = (lesson_path / "index.html").read_text()
+    assert index.count("<head>") == 1 and index.count("<body>") == 1
+    assert 'href="software-carpentry/shell-novice/index.html"' in index
+    assert "shell-novice &amp; more" in index
+    search_index = (lesson_path / "search-index.js").read_text()
+    assert '"headings": ["Pipes and Filters", "Exercises"]' in search_index
+
+    index_mtime = (lesson_path / "index.html").stat().st_mtime_ns
+    assert add_lesson_index_page(lesson_path) == catalogue
+    assert (lesson_path / "index.html").stat().st_mtime_ns == index_mtime
+
+    (lesson_path / "data-carpentry" / "R-ecology-lesson" / "index.html").write_text("<title>Ecology</title>")
+    updated = add_lesson_index_page(lesson_path)
+    assert updated["data-carpentry/R-ecology-lesson"]["title"] == "Ecology"
+    assert updated["software-carpentry/shell-novice"] == catalogue["software-carpentry/shell-novice"]
+
+def make_lesson_site(served_dir):
+    for directory in ["lesson/fig", "assets", "fonts", "other"]:
+        (served_dir / directory).mkdir(parents=True)
+    (served_dir / "lesson" / "index.html").write_text(
+        '<html><head><link rel="stylesheet" href="/assets/style.css"></head><body>'
+        '<h1>Lesson</h1><a href="episode.html">Episode</a><a href="../other/">Other</a>'
+        '<a href="https://example.com/">External</a><img src="fig/plot.png"></body></html>')
+    (served_dir / "lesson" / "episode.html").write_text('<a href="index.html#top">Home</a>')
+    (served_dir / "lesson" / "fig" / "plot.png").write_bytes(b"png")
+    (served_dir / "assets" / "style.css").write_text("body { font: url('../fonts/font.woff'); }")
+    (served_dir / "fonts" / "font.woff").write_bytes(b"font")
+    (served_dir / "other" / "index.html").write_text("<h1>Other</h1>")
+
+def test_mirror_website(tmp_path, file_server):
+    served_dir, base_url = file_server
+    make_lesson_site(served_dir)
+    destination = tmp_path / "mirror"
+    state_path = tmp_path / "state.json"
+    failed = mirror_website(f"{base_url}/lesson/", destination, page_requisites=True,
+                            adjust_extension=True, state_path=state_path)
+    assert failed == []
+    mirrored = sorted(path.relative_to(destination).as_posix() for path in destination.rglob("*") if path.is_file())
+    assert mirrored == ["assets/style.css", "fonts/font.woff", "lesson/episode.html",
+                        "lesson/fig/plot.png", "lesson/index.html"]
+    index = (destination / "lesson" / "index.html").read_text()
+    assert 'href="../assets/style.css"' in index
+    assert 'href="episode.html"' in index
+    assert f'href="{base_url}/other/"' in index
+    assert 'href="https://example.com/"' in index
+    assert 'href="index.html#top"' in (destination / "lesson" / "episode.html").read_text()
+
+    RangeRequestHandler.response_log = []
+    mirror_website(f"{base_url}/lesson/", destination, page_requisites=True,
+                   adjust_extension=True, state_path=state_path)
+    assert {code for path, code in RangeRequestHandler.response_log} == {304}
+    assert len(RangeRequestHandler.response_log) == 5
+
+def test_download_lessons_without_wget(tmp_path, file_server):
+    served_dir, base_url = file_server
+    make_lesson_site(served_dir)
+    lesson_sources = {"test-carpentry": {
+        "wget_args": ["-p", "-r", "-k", "-N", "-c", "-E", "-H", "-D", "127.0.0.1", "-K",
+                      "--no-parent", "--no-host-directories"],
+        "lessons": [f"{base_url}/lesson/"]}}
+    results = download_lessons(tmp_path, lesson_sources=lesson_sources, engine="python")
+    assert results[0]["returncode"] == 0
+    assert (tmp_path / "lessons" / "test-carpentry" / "fonts" / "font.woff").exists()
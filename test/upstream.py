@@ -0,0 +1,227 @@
+"""A local stand-in for the upstream hosts offlinedatasci downloads from.
+
+make_upstream_site writes a small imitation of CRAN, python.org, the RStudio
+download page, a PyPI simple index and a lesson site to a directory, and
+UpstreamRequestHandler serves it with optional latency and bandwidth limits
+so the download functions can be tested and benchmarked without network
+access. The upstream fixture in conftest.py points offlinedatasci at it.
+"""
+from http.server import SimpleHTTPRequestHandler
+from pathlib import Path
+import gzip
+import hashlib
+import random
+import time
+import zipfile
+from offlinedatasci.main import update_pypi_mirror
+
+INSTALLER_SIZE = 1024 * 1024
+PACKAGE_SIZE = 64 * 1024
+PYTHON_VERSION = "3.12.7"
+# Installers of each release in the python.org FTP index, by file name suffix and operating system
+PYTHON_RELEASES = {
+    "3.11.9": [(".exe", "Windows"), ("-amd64.exe", "Windows"), ("-macos11.pkg", "macOS")],
+    PYTHON_VERSION: [(".exe", "Windows"), ("-amd64.exe", "Windows"), ("-arm64.exe", "Windows"),
+                     ("-macos11.pkg", "macOS")],
+}
+# Newer releases of the same minor version with only source tarballs, as python.org publishes
+# once a version only gets security fixes
+PYTHON_SOURCE_RELEASES = ["3.12.11"]
+R_VERSION = "R-4.4.1"
+# Earlier R releases, only listed in bin/windows/base/old/ and the macOS build directories
+R_OLD_VERSIONS = ["4.3.3", "4.4.0"]
+RSTUDIO_INSTALLERS = ["RStudio-2024.09.0-375.exe", "RStudio-2024.09.0-375.dmg"]
+R_PACKAGES = {
+    "tidyverse": ["dplyr", "ggplot2"],
+    "dplyr": ["rlang", "vctrs"],
+    "ggplot2": ["rlang"],
+    "RSQLite": ["DBI", "rlang"],
+    "DBI": [],
+    "rlang": [],
+    "vctrs": ["rlang"],
+}
+PYTHON_PACKAGES = {
+    "matplotlib": ["numpy", "pyparsing"],
+    "notebook": ["jupyter-server"],
+    "numpy": [],
+    "pandas": ["numpy", "python-dateutil"],
+    "jupyter-server": [],
+    "pyparsing": [],
+    "python-dateutil": [],
+}
+LESSONS = ["ecology-lesson", "shell-lesson"]
+EPISODES = 5
+
+class UpstreamRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler that can delay responses and limit their bandwidth.
+
+    Keyword arguments:
+    latency -- Seconds to wait before answering each request
+    bandwidth -- Bytes per second to send response bodies at (None for no limit)
+    """
+    chunk_size = 16 * 1024
+
+    def __init__(self, *args, latency=0, bandwidth=None, **kwargs):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        if not self.bandwidth:
+            return super().copyfile(source, outputfile)
+        chunk = source.read(self.chunk_size)
+        while chunk:
+            outputfile.write(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+            chunk = source.read(self.chunk_size)
+
+def make_upstream_site(directory, base_url):
+    """Write the stand-in upstream hosts to directory.
+
+    Returns the lesson sources to use instead of get_lesson_sources().
+
+    Keyword arguments:
+    directory -- Directory the site will be served from
+    base_url -- URL the site will be served at, without a trailing slash
+    """
+    directory = Path(directory)
+    payloads = random.Random(0)
+    make_cran(Path(directory, "cran"), payloads)
+    make_python_org(Path(directory, "python"), base_url, payloads)
+    make_rstudio_page(Path(directory, "rstudio"), base_url, payloads)
+    make_pypi(Path(directory, "pypi"), Path(directory, "wheels"))
+    return make_lessons(Path(directory, "lessons"), base_url)
+
+def write_payload(path, size, payloads):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(payloads.getrandbits(8 * size).to_bytes(size, "big"))
+    return path
+
+def write_listing(directory, names):
+    directory.mkdir(parents=True, exist_ok=True)
+    links = "\n".join(f'<a href="{name}">{name}</a>' for name in names)
+    Path(directory, "index.html").write_text(f"<html><body><pre>\n{links}\n</pre></body></html>\n")
+
+def make_cran(cran_dir, payloads):
+    """Write the CRAN R installers, their bin listings and package repositories."""
+    r_minor_version = ".".join(R_VERSION.replace("R-", "").split(".")[:2])
+    for platform in ["arm64", "x86_64"]:
+        write_payload(Path(cran_dir, f"bin/macosx/big-sur-{platform}/base/{R_VERSION}-{platform}.pkg"),
+                      INSTALLER_SIZE, payloads)
+    write_listing(Path(cran_dir, "bin/macosx"),
+                  [f"big-sur-{platform}/base/{R_VERSION}-{platform}.pkg" for platform in ["arm64", "x86_64"]])
+    write_payload(Path(cran_dir, f"bin/windows/base/{R_VERSION}-win.exe"), INSTALLER_SIZE, payloads)
+    write_listing(Path(cran_dir, "bin/windows/base"), [f"{R_VERSION}-win.exe"])
+    for version in R_OLD_VERSIONS:
+        for platform in ["arm64", "x86_64"]:
+            write_payload(Path(cran_dir, f"bin/macosx/big-sur-{platform}/base/R-{version}-{platform}.pkg"),
+                          INSTALLER_SIZE, payloads)
+        write_payload(Path(cran_dir, f"bin/windows/base/old/{version}/R-{version}-win.exe"),
+                      INSTALLER_SIZE, payloads)
+    write_listing(Path(cran_dir, "bin/windows/base/old"), [f"{version}/" for version in R_OLD_VERSIONS])
+
+    repo_dirs = {"src/contrib": ".tar.gz",
+                 f"bin/windows/contrib/{r_minor_version}": ".zip",
+                 f"bin/macosx/big-sur-x86_64/contrib/{r_minor_version}": ".tgz",
+                 f"bin/macosx/big-sur-arm64/contrib/{r_minor_version}": ".tgz"}
+    for repo_dir, extension in repo_dirs.items():
+        records = []
+        for package, dependencies in sorted(R_PACKAGES.items()):
+            version = "1.0.0"
+            package_path = write_payload(Path(cran_dir, repo_dir, f"{package}_{version}{extension}"),
+                                         PACKAGE_SIZE, payloads)
+            record = f"Package: {package}\nVersion: {version}\nDepends: R (>= 3.5.0)\n"
+            if dependencies:
+                record += f"Imports: {', '.join(dependencies)}\n"
+            record += f"MD5sum: {hashlib.md5(package_path.read_bytes()).hexdigest()}\n"
+            records.append(record)
+        Path(cran_dir, repo_dir, "PACKAGES").write_text("\n".join(records))
+        Path(cran_dir, repo_dir, "PACKAGES.gz").write_bytes(gzip.compress("\n".join(records).encode()))
+
+def make_python_org(python_dir, base_url, payloads):
+    """Write the python.org FTP index, the Python installers and their release pages."""
+    write_listing(Path(python_dir, "ftp/python"),
+                  ["3.11.9/", "3.12.0/", "3.12.6/", PYTHON_VERSION + "/",
+                   *[version + "/" for version in PYTHON_SOURCE_RELEASES], "3.13.0/"])
+    for version in PYTHON_SOURCE_RELEASES:
+        write_payload(Path(python_dir, "ftp/python", version, f"Python-{version}.tgz"), PACKAGE_SIZE, payloads)
+    for version, installers in PYTHON_RELEASES.items():
+        rows = []
+        for suffix, operating_system in installers:
+            name = f"python-{version}{suffix}"
+            installer = write_payload(Path(python_dir, "ftp/python", version, name), INSTALLER_SIZE, payloads)
+            url = f"{base_url}/python/ftp/python/{version}/{name}"
+            rows.append(f'<tr><td><a href="{url}">{name}</a></td><td>{operating_system}</td>'
+                        f'<td>{hashlib.sha256(installer.read_bytes()).hexdigest()}</td></tr>')
+        release_dir = Path(python_dir, f"downloads/release/python-{version.replace('.', '')}")
+        release_dir.mkdir(parents=True)
+        Path(release_dir, "index.html").write_text(
+            "<html><body><table><thead><tr><th>Version</th><th>Operating System</th><th>SHA-256</th></tr></thead>"
+            f"<tbody>{''.join(rows)}</tbody></table></body></html>\n")
+
+def make_rstudio_page(rstudio_dir, base_url, payloads):
+    """Write the RStudio installers and a download page linking to them."""
+    for name in RSTUDIO_INSTALLERS:
+        write_payload(Path(rstudio_dir, name), INSTALLER_SIZE, payloads)
+    links = "".join(f'<a href="{base_url}/rstudio/{name}">{name}</a>' for name in RSTUDIO_INSTALLERS)
+    Path(rstudio_dir, "download").mkdir()
+    Path(rstudio_dir, "download", "index.html").write_text(f"<html><body>{links}</body></html>\n")
+
+def make_wheel(directory, name, version, tag="py3-none-any", requires=(), size=0):
+    """Write a minimal wheel that pip can install.
+
+    Keyword arguments:
+    directory -- Directory to write the wheel to
+    name -- Distribution name
+    version -- Distribution version
+    tag -- Wheel compatibility tag
+    requires -- Names of the distributions the wheel depends on
+    size -- Number of bytes of data to pad the wheel with
+    """
+    dist_name = name.replace("-", "_")
+    wheel_path = Path(directory, f"{dist_name}-{version}-{tag}.whl")
+    metadata = f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+    metadata += "".join(f"Requires-Dist: {requirement}\n" for requirement in requires)
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        wheel.writestr(f"{dist_name}-{version}.dist-info/METADATA", metadata)
+        wheel.writestr(f"{dist_name}-{version}.dist-info/WHEEL",
+                       f"Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: {tag}\n")
+        if size:
+            wheel.writestr(f"{dist_name}/data.bin", random.Random(name).getrandbits(8 * size).to_bytes(size, "big"))
+    return wheel_path
+
+def make_pypi(pypi_dir, wheel_dir):
+    """Write a PyPI simple index of pure Python wheels for PYTHON_PACKAGES."""
+    wheel_dir.mkdir()
+    for name, requires in PYTHON_PACKAGES.items():
+        make_wheel(wheel_dir, name, "1.0.0", requires=requires, size=PACKAGE_SIZE)
+    update_pypi_mirror(wheel_dir, pypi_dir)
+
+def make_lessons(lessons_dir, base_url):
+    """Write lessons sharing a theme and return lesson sources for them."""
+    theme = "".join(f".rule-{number} {{ margin: {number}px; }}\n" for number in range(200))
+    for lesson in LESSONS:
+        lesson_dir = Path(lessons_dir, lesson)
+        Path(lesson_dir, "assets").mkdir(parents=True)
+        Path(lesson_dir, "assets", "theme.css").write_text(theme)
+        episodes = "".join(f'<li><a href="episode-{number}.html">Episode {number}</a></li>'
+                           for number in range(EPISODES))
+        Path(lesson_dir, "index.html").write_text(
+            f'<html><head><title>{lesson}</title><link rel="stylesheet" href="assets/theme.css"></head>'
+            f"<body><h1>{lesson}</h1><ul>{episodes}</ul></body></html>\n")
+        for number in range(EPISODES):
+            Path(lesson_dir, f"episode-{number}.html").write_text(
+                f'<html><head><title>Episode {number}</title><link rel="stylesheet" href="assets/theme.css">'
+                f'</head><body><h1>Episode {number}</h1><p>{"Lesson text. " * 200}</p>'
+                f'<a href="index.html">Home</a></body></html>\n')
+    return {"data-carpentry": {
+        "wget_args": ["-r", "-k", "-N", "-c", "--no-parent", "--no-host-directories", "--unlink"],
+        "lessons": [f"{base_url}/lessons/{lesson}/" for lesson in LESSONS]}}